@@ -1,13 +1,13 @@
 #!/usr/bin/env python3.7
 
-from multiprocessing import Queue
-
 # Import custom subpackages
 from config import config
 from helpers import logger, generic
 from binders import gps_device_binder
-from core import recorder, monitor
+from core import recorder, monitor, pipeline, spool, downsampler, backends, replay
 
+import argparse
+import asyncio
 import os
 import sys
 import time
@@ -19,6 +19,13 @@ logger = logger.get_logger('gps_locator')
 
 if __name__ == '__main__':
 
+    # Parse the command line arguments (they override the configuration file)
+    parser = argparse.ArgumentParser(description="Records the GPS locations reported by GPSD into a SQLite database")
+    parser.add_argument("--source", choices=replay.SOURCES, default=None, help="location source (default: the configuration file)")
+    parser.add_argument("--replay-file", default=None, help="GPSD JSON or NMEA log replayed by the 'replay' source (optionally gzip-compressed)")
+    parser.add_argument("--replay-speed", default=None, help="replay speed factor (1 for real time) or 'max'")
+    args = parser.parse_args()
+
     # Clear console
     generic.clear_console()
 
@@ -28,9 +35,6 @@ if __name__ == '__main__':
     # Initialization
     config_file = "./config/config.json"
 
-    # Setup telemetry queue used by the Monitor and Recorder
-    q = Queue()
-
     # Read the application config
     appConfig = config.AppConfig(config_file)
     rc = appConfig.load_app_config()
@@ -44,36 +48,145 @@ if __name__ == '__main__':
     else:
         logger.info(f'App configuration loaded and parsed successfully.')
 
+    if args.source is not None:
+        appConfig.source = args.source
+    if args.replay_file is not None:
+        appConfig.replay_file = args.replay_file
+    if args.replay_speed is not None:
+        appConfig.replay_speed = args.replay_speed
+
+    # Check the replay parameters
+    replaying = appConfig.source == replay.REPLAY
+    if appConfig.source not in replay.SOURCES:
+        logger.error(f'Unknown location source: {appConfig.source}. Application will stop!')
+        sys.exit()
+
+    if replaying:
+        if appConfig.runtime == "asyncio":
+            logger.error(f'The replay is not available with the asyncio runtime. Application will stop!')
+            sys.exit()
+
+        if not appConfig.replay_file or not os.path.isfile(appConfig.replay_file):
+            logger.error(f'The replay file cannot be found: {appConfig.replay_file}. Application will stop!')
+            sys.exit()
+
+        try:
+            replay.parse_speed(appConfig.replay_speed)
+        except ValueError:
+            logger.error(f'Invalid replay speed: {appConfig.replay_speed}. Application will stop!')
+            sys.exit()
+
+        # No replayed location may be dropped: the replay waits for the recorder instead
+        if appConfig.queue_overflow_policy != "block":
+            logger.info(f'The queue overflow policy is set to "block" for the replay')
+            appConfig.queue_overflow_policy = "block"
+
+        logger.info(f'Replaying {appConfig.replay_file} (speed: {appConfig.replay_speed})')
+
     # Make sure that the GPSD is launched with the appropriate parameters
-    if appConfig.start_gpsd:
+    if appConfig.start_gpsd and not replaying:
         gps_binder = gps_device_binder.GPSDeviceBinder()
         gps_binder.bind(source_name=appConfig.default_device)
         time.sleep(1)
 
-    # Start GPS device monitor
-    tmonitor = monitor.Monitor(q, appConfig)
-    tmonitor.start()
+    # Run the workers as threads of this process or as separate processes
+    backend = backends.get_backend(backends.PROCESS if appConfig.runtime == backends.PROCESS else backends.THREAD)
 
-    # Start database recorder
-    # Initialize and start database recorder
-    trecorder = recorder.Recorder(q, appConfig)
-    trecorder.start()
+    # Start the background downsampler
+    tdownsampler = None
+    if appConfig.rollup_enabled or appConfig.spatial_index_enabled:
+        tdownsampler = backend.start(downsampler.Downsampler, appConfig)
+
+    # Run the GPS device reader and the database recorder as coroutines
+    if appConfig.runtime == "asyncio":
+        try:
+            asyncio.run(pipeline.run(appConfig))
+        except KeyboardInterrupt:
+            logger.info("Asyncio pipeline stopped.")
+
+        if tdownsampler is not None:
+            tdownsampler.stop()
+            tdownsampler.join()
+        sys.exit()
+
+    # The GPSD client of the poll mode holds a single global connection per process
+    sources = appConfig.get_gpsd_sources()
+    if replaying:
+        # A single log is replayed, with the device identifier of the first source
+        sources = sources[:1]
+    elif appConfig.monitor_mode != "stream" and len(sources) > 1 and appConfig.runtime != backends.PROCESS:
+        logger.error(f'Several GPSD sources require the stream monitor mode. Application will stop!')
+        sys.exit()
+
+    # Each recorder worker (shard) has its own queue and spool; the rollover supports a single writer
+    workers = max(1, min(appConfig.recorder_workers, len(sources)))
+    if appConfig.rollover_policy is not None and workers > 1:
+        logger.warning(f'The database rollover supports a single recorder worker')
+        workers = 1
+
+    # Setup telemetry queues used by the Monitors and Recorders
+    queues = [backend.make_queue(appConfig) for i in range(workers)]
+
+    # Setup the spools of the locations not yet committed (shared by a monitor and a recorder thread)
+    spools = [None] * workers
+    if appConfig.spool_directory is not None and appConfig.runtime == backends.PROCESS:
+        logger.warning(f'The spool is not available with the process runtime')
+    elif appConfig.spool_directory is not None:
+        for i in range(workers):
+            directory = appConfig.spool_directory if workers == 1 else os.path.join(appConfig.spool_directory, f"worker_{i}")
+            spools[i] = spool.Spool(directory, segment_size=appConfig.spool_segment_size, fsync_interval=appConfig.spool_fsync_interval)
+            if spools[i].open() != 0:
+                logger.error(f'The spool cannot be opened. Application will stop!')
+                sys.exit()
+
+    # Start GPS device monitors (or the replay source), the sources are spread over the workers
+    source_class = replay.ReplaySource if replaying else monitor.Monitor
+    tmonitors = []
+    for i, source in enumerate(sources):
+        tmonitors.append(backend.start(source_class, queues[i % workers], appConfig, name=source["name"], spool=spools[i % workers], \
+            source=source))
+
+    # Initialize and start database recorders; the first one creates the session
+    session_ready = backend.make_event() if workers > 1 else None
+    trecorders = []
+    for i in range(workers):
+        trecorders.append(backend.start(recorder.Recorder, queues[i], appConfig, name=f"recorder_{i}", spool=spools[i], \
+            primary=(i == 0), session_ready=session_ready))
 
     try:
-        # Sleep main thread
-        while True:
+        # Sleep main thread (a replay ends with its log)
+        while not replaying or any(tmonitor.is_alive() for tmonitor in tmonitors):
             time.sleep(1)
 
+        logger.info("Replay completed. Stopping all threads and processes...")
+
     except Exception as e:
         print(f'Exception: {str(e)}')
 
     except KeyboardInterrupt:
         logger.info("Stopping all threads and processes... (This may take few seconds)")
 
-        # Stop the monitor process
+    # Stop the monitor threads (or processes), then let the recorders drain their queues
+    for tmonitor in tmonitors:
         tmonitor.stop()
+    for tmonitor in tmonitors:
         tmonitor.join()
 
-        # Stop the recorder thread
+    # Stop the recorder threads (or processes)
+    for trecorder in trecorders:
         trecorder.stop()
+    for trecorder in trecorders:
         trecorder.join()
+
+    # Stop the downsampler thread
+    if tdownsampler is not None:
+        tdownsampler.stop()
+        tdownsampler.join()
+
+    for q in queues:
+        logger.info(f'Queue statistics: {q.stats()}')
+        q.close()
+
+    for lspool in spools:
+        if lspool is not None:
+            lspool.close()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3.7
+
+""" A fake GPSD server speaking the GPSD JSON protocol, to run the application or the benchmarks
+    without GPS hardware. Each simulated device drives east at a constant speed and reports a
+    TPV (time-position-velocity) report stamped with the current time at the configured rate.
+
+    - ?WATCH={"enable":true,"json":true}; streams the TPV reports of all the devices
+    - ?WATCH={"enable":true} followed by ?POLL; returns the last report of each device
+
+    Usage (from the project root):  python3 -m benchmarks.fake_gpsd --port 2947 --rate 10 --sources 2
+"""
+
+from helpers import generic
+
+from threading import Thread, Event, Lock
+
+import argparse
+import json
+import math
+import socketserver
+import time
+
+
+# The welcome message of a GPSD 3 server
+VERSION_REPORT = {"class": "VERSION", "release": "3.17", "rev": "3.17", "proto_major": 3, "proto_minor": 12}
+
+# Maximum time between two writes of the stream, in seconds (the reports due are sent in bursts)
+STREAM_TICK = 0.001
+
+# Mean Earth radius, in meters
+EARTH_RADIUS = 6371008.8
+
+
+class FakeDevice():
+
+    """ A simulated GPS receiver moving east at a constant speed
+
+        :param path: the device path
+        :param latitude: the initial latitude, in degrees
+        :param longitude: the initial longitude, in degrees
+        :param speed: the speed, in meters per second
+        :param start: the start time (UNIX timestamp)
+    """
+
+    def __init__(self, path, latitude=45.5, longitude=-73.6, speed=15.0):
+
+        self.path = path
+        self.latitude = latitude
+        self.longitude = longitude
+        self.speed = speed
+        self.start = time.time()
+
+
+    def tpv(self):
+
+        """ Returns the TPV report of the current position
+
+            :return: the TPV report (dictionary)
+        """
+
+        now = time.time()
+        distance = (now - self.start) * self.speed
+        longitude = self.longitude + math.degrees(distance / (EARTH_RADIUS * math.cos(math.radians(self.latitude))))
+
+        return {"class": "TPV", "device": self.path, "mode": 3, "time": generic.epoch_ms_to_iso(int(now * 1000)), \
+                "lat": self.latitude, "lon": longitude, "alt": 30.0, "track": 90.0, "speed": self.speed, "climb": 0.0}
+
+
+class FakeGPSDHandler(socketserver.StreamRequestHandler):
+
+    """ Serves a GPSD client: answers the WATCH and POLL commands and streams the reports
+        of the watching clients from a dedicated thread
+    """
+
+    def handle(self):
+
+        self.lock = Lock()
+        self.watching = Event()
+        self.streamer = None
+
+        try:
+            self.send(VERSION_REPORT)
+
+            for line in self.rfile:
+
+                command = line.decode("ascii", errors="replace").strip().rstrip(";")
+
+                if command.startswith("?WATCH"):
+                    self.watch(json.loads(command[len("?WATCH="):] or "{}"))
+                elif command.startswith("?POLL"):
+                    self.poll()
+
+                if self.server.stopped.is_set():
+                    break
+
+        except (OSError, ValueError):
+            # The client has closed the connection or sent a malformed command
+            pass
+
+        finally:
+            self.watching.clear()
+
+
+    def send(self, *reports):
+
+        """ Writes reports to the client, one JSON object per line """
+
+        data = "".join(json.dumps(report) + "\n" for report in reports).encode("ascii")
+
+        with self.lock:
+            self.wfile.write(data)
+
+
+    def watch(self, options):
+
+        """ Answers a WATCH command and starts streaming if the JSON reports are requested """
+
+        devices = [{"class": "DEVICE", "path": device.path, "driver": "fake", "bps": 9600} for device in self.server.devices]
+        self.send({"class": "DEVICES", "devices": devices}, dict({"class": "WATCH"}, **options))
+
+        if options.get("enable", True) and options.get("json", False):
+            if not self.watching.is_set():
+                self.watching.set()
+                self.streamer = Thread(target=self.stream, daemon=True)
+                self.streamer.start()
+        else:
+            self.watching.clear()
+
+
+    def poll(self):
+
+        """ Answers a POLL command with the current report of every device """
+
+        tpv = [device.tpv() for device in self.server.devices]
+        sky = [{"class": "SKY", "device": device.path, "satellites": []} for device in self.server.devices]
+
+        self.send({"class": "POLL", "time": tpv[0]["time"], "active": len(tpv), "tpv": tpv, "sky": sky})
+
+
+    def stream(self):
+
+        """ Streams the TPV reports at the server rate (per device) until the client stops watching """
+
+        start = time.monotonic()
+        sent = 0
+
+        try:
+            while self.watching.is_set() and not self.server.stopped.is_set():
+
+                due = int((time.monotonic() - start) * self.server.rate)
+                if self.server.count is not None:
+                    due = min(due, self.server.count)
+
+                if due > sent:
+                    self.send(*[device.tpv() for _ in range(due - sent) for device in self.server.devices])
+                    sent = due
+                elif self.server.count is not None and sent >= self.server.count:
+                    break
+
+                time.sleep(min(STREAM_TICK, 1 / self.server.rate))
+
+        except OSError:
+            # The client has closed the connection
+            pass
+
+
+class FakeGPSD(socketserver.ThreadingTCPServer):
+
+    """ A fake GPSD server
+
+        :param rate: the number of reports per second and device
+        :param count: the number of reports streamed per device and client (None for no limit)
+        :param devices: the simulated devices
+        :param stopped: an event set when the server stops
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, rate=1.0, devices=1, count=None, latitude=45.5, longitude=-73.6, speed=15.0):
+
+        """ Initializes the server (the port 0 selects a free port)
+
+            :param host: the listening address (default: '127.0.0.1')
+            :param port: the listening TCP port (default: 0, a free port)
+            :param rate: the number of reports per second and device (default: 1.0)
+            :param devices: the number of simulated devices (default: 1)
+            :param count: the number of reports streamed per device and client (default: None, no limit)
+            :param latitude: the initial latitude of the devices, in degrees
+            :param longitude: the initial longitude of the devices, in degrees
+            :param speed: the speed of the devices, in meters per second
+        """
+
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FakeGPSDHandler)
+        self.rate = rate
+        self.count = count
+        self.devices = [FakeDevice(f"/dev/fake{i}", latitude=latitude + i * 0.001, longitude=longitude, speed=speed) \
+                        for i in range(devices)]
+        self.stopped = Event()
+
+
+    def start(self):
+
+        """ Serves the clients from a background thread
+
+            :return: the listening TCP port
+        """
+
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+
+    def stop(self):
+
+        """Stops the server and the streams"""
+
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+
+def run_servers(sources=1, port=0, rate=1.0, devices=1, count=None, ready=None, stop=None):
+
+    """ Runs one fake GPSD server per source (e.g., one per receiver) until stopped
+
+        :param sources: the number of servers
+        :param port: the TCP port of the first server, the next ones use the following ports (0 for free ports)
+        :param rate: the number of reports per second and device
+        :param devices: the number of devices per server
+        :param count: the number of reports streamed per device and client (None for no limit)
+        :param ready: a function called with the list of the listening ports (optional, e.g., the send method of a pipe)
+        :param stop: an event stopping the servers (default: None, until interrupted)
+    """
+
+    servers = [FakeGPSD(port=port + i if port else 0, rate=rate, devices=devices, count=count) for i in range(sources)]
+    ports = [server.start() for server in servers]
+
+    if ready is not None:
+        ready(ports)
+
+    if stop is None:
+        stop = Event()
+
+    try:
+        while not stop.wait(0.5):
+            pass
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Runs fake GPSD servers streaming synthetic TPV reports")
+    parser.add_argument("--port", type=int, default=2947, help="TCP port of the first server (0 for free ports)")
+    parser.add_argument("--rate", type=float, default=1.0, help="reports per second and device")
+    parser.add_argument("--sources", type=int, default=1, help="number of servers, on consecutive ports")
+    parser.add_argument("--devices", type=int, default=1, help="number of devices per server")
+    parser.add_argument("--count", type=int, default=None, help="number of reports streamed per device and client")
+    args = parser.parse_args()
+
+    def report(ports):
+        print(f"Fake GPSD listening on port(s) {', '.join(str(p) for p in ports)} ({args.rate:g} reports/s per device)")
+
+    run_servers(sources=args.sources, port=args.port, rate=args.rate, devices=args.devices, count=args.count, ready=report)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3.7
+
+""" Micro-benchmark of the location insertion paths of core.database
+
+    Usage (from the project root):  python3 -m benchmarks.insert_benchmark
+"""
+
+from core import database
+
+import argparse
+import os
+import tempfile
+import time
+
+
+# Batch sizes covered by default
+BATCH_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def make_rows(count, session_id=1):
+
+    """ Generates synthetic location records
+
+        :param count: the number of records
+        :param session_id: the session identifier
+        :return: a list of location records
+    """
+
+    rows = []
+    for i in range(count):
+        mode = 3 if i % 2 else 2
+        altitude = 30.0 + i * 0.01 if mode == 3 else None
+        climb = 0.1 if mode == 3 else None
+        rows.append((session_id, 45.5 + i * 1e-6, -73.6 - i * 1e-6, altitude, 90.0, climb, 5.0, mode, \
+                     f"2020-01-01T00:00:{i % 60:02d}.{i % 10}00Z"))
+
+    return rows
+
+
+def run(method, batch_size, total, directory):
+
+    """ Inserts total records in batches of batch_size records into a fresh database
+
+        :param method: the insertion method
+        :param batch_size: the number of records per batch
+        :param total: the total number of records to insert
+        :param directory: the directory where the database is created
+        :return: the insertion rate, in rows/s
+    """
+
+    db_filename = os.path.join(directory, f"bench_{method}_{batch_size}.db")
+    connection_handler = database.connect(db_filename)
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+
+    rows = make_rows(batch_size)
+    batches = max(1, total // batch_size)
+
+    start = time.perf_counter()
+    for _ in range(batches):
+        database.insert_location_data(connection_handler, rows, method=method)
+    elapsed = time.perf_counter() - start
+
+    database.disconnect(connection_handler)
+    os.remove(db_filename)
+
+    return batches * batch_size / elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Compares the location insertion methods")
+    parser.add_argument("--total", type=int, default=200000, help="number of rows inserted per run")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES, help="batch sizes to measure")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        print(f"{'batch size':>10} | {'concat (rows/s)':>16} | {'executemany (rows/s)':>20} | {'speedup':>7}")
+        for batch_size in args.batch_sizes:
+            total = max(args.total, batch_size)
+            concat = run("concat", batch_size, total, directory)
+            executemany = run("executemany", batch_size, total, directory)
+            print(f"{batch_size:>10} | {concat:>16,.0f} | {executemany:>20,.0f} | {executemany / concat:>6.2f}x")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3.7
+
+""" End-to-end benchmark of the ingestion pipeline: fake GPSD servers (see benchmarks.fake_gpsd)
+    stream TPV reports to the real Monitor -> queue -> Recorder -> SQLite pipeline ("thread"
+    runtime). The throughput, the fix-to-commit latency (p50/p99), the queue depth, the CPU
+    usage and the peak RSS of the pipeline are reported. The resulting database is then used
+    to time the retrieval, analytics and export functions.
+
+    Usage (from the project root):  python3 -m benchmarks.pipeline_benchmark --rate 1000 --sources 2
+"""
+
+from config import config
+from core import analytics, backends, database, export, monitor, recorder
+from benchmarks import fake_gpsd
+from helpers import generic
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+
+# Time between two samples of the queue depth, in seconds
+SAMPLE_INTERVAL = 0.05
+
+
+class LatencyRecorder(recorder.Recorder):
+
+    """ A recorder measuring the time between the fix (the time of the GPSD report) and the
+        commit of every location
+
+        :param latencies: the measured latencies, in milliseconds
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        recorder.Recorder.__init__(self, *args, **kwargs)
+        self.latencies = []
+
+
+    def write_batch(self, batch):
+
+        data = recorder.Recorder.write_batch(self, batch)
+
+        now = int(time.time() * 1000)
+        times = (generic.iso_to_epoch_ms(t) for t in batch.utc_time)
+        self.latencies.extend(now - t for t in times if t >= 0)
+
+        return data
+
+
+def make_config(db_filename, ports, args):
+
+    """ Loads the application configuration and points it at the fake GPSD servers
+
+        :param db_filename: the database filename
+        :param ports: the TCP ports of the fake GPSD servers
+        :param args: the command line arguments
+        :return: the application configuration object
+    """
+
+    appconfig = config.AppConfig("./config/config.json")
+    appconfig.load_app_config()
+
+    appconfig.database_filename = db_filename
+    appconfig.gpsd_sources = [{"name": f"fake_{i}", "gpsd_ip_address": "127.0.0.1", "gpsd_port": port} for i, port in enumerate(ports)]
+    appconfig.monitor_mode = args.mode
+    appconfig.monitor_delay = 1 / args.rate if args.mode == "poll" else 0.5
+    appconfig.recorder_workers = args.workers
+    appconfig.storage_layout = args.layout
+    appconfig.filter_enabled = False
+    appconfig.spool_directory = None
+    appconfig.rollover_policy = None
+    appconfig.rollup_enabled = False
+
+    return appconfig
+
+
+def run_pipeline(appconfig, duration):
+
+    """ Runs the monitors and the recorders for duration seconds, then stops them (the
+        recorders drain their queues)
+
+        :param appconfig: the application configuration object
+        :param duration: the ingestion duration, in seconds
+        :return: a dictionary of measurements
+    """
+
+    backend = backends.ThreadBackend()
+    sources = appconfig.get_gpsd_sources()
+    workers = max(1, min(appconfig.recorder_workers, len(sources)))
+
+    queues = [backend.make_queue(appconfig) for i in range(workers)]
+    session_ready = backend.make_event() if workers > 1 else None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+
+    monitors = [backend.start(monitor.Monitor, queues[i % workers], appconfig, name=source["name"], source=source) \
+                for i, source in enumerate(sources)]
+    recorders = [backend.start(LatencyRecorder, queues[i], appconfig, name=f"recorder_{i}", primary=(i == 0), \
+                               session_ready=session_ready) for i in range(workers)]
+
+    depths = []
+    while time.perf_counter() - start < duration:
+        depths.append(sum(q.qsize() for q in queues))
+        time.sleep(SAMPLE_INTERVAL)
+
+    for tmonitor in monitors:
+        tmonitor.stop()
+    for tmonitor in monitors:
+        tmonitor.join()
+
+    drain_start = time.perf_counter()
+    for trecorder in recorders:
+        trecorder.stop()
+    for trecorder in recorders:
+        trecorder.join()
+
+    end = time.perf_counter()
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    latencies = np.array([latency for trecorder in recorders for latency in trecorder.latencies], dtype=np.float64)
+
+    return {
+        "elapsed": end - start,
+        "drain": end - drain_start,
+        "cpu": (end_usage.ru_utime - usage.ru_utime + end_usage.ru_stime - usage.ru_stime) / (end - start),
+        "rss": end_usage.ru_maxrss / 1024,
+        "latencies": latencies,
+        "depth_mean": float(np.mean(depths)) if depths else 0.0,
+        "depth_max": max(depths) if depths else 0,
+        "dropped": sum(q.stats()["dropped"] for q in queues)
+    }
+
+
+def run_queries(db_filename, directory):
+
+    """ Times the retrieval, analytics and export functions on the benchmark database
+
+        :param db_filename: the database filename
+        :param directory: the directory of the exported files
+        :return: a list of tuples (function, number of locations, elapsed time in seconds)
+    """
+
+    connection_handler = database.connect_reader(db_filename)
+    session_id = database.get_newest_session_id(connection_handler)
+    count = sum(1 for _ in database.iter_locations(connection_handler, session_id=session_id))
+
+    operations = [
+        ("iter_locations", lambda: sum(1 for _ in database.iter_locations(connection_handler, session_id=session_id))),
+        ("iter_location_batches", lambda: sum(len(b) for b in database.iter_location_batches(connection_handler, session_id=session_id))),
+        ("iter_session_arrays", lambda: sum(len(c["time"]) for c in database.iter_session_arrays(connection_handler, session_id))),
+        ("iter_locations_in_bbox", lambda: sum(1 for _ in database.iter_locations_in_bbox(connection_handler, (45.0, -74.0, 46.0, -73.0), \
+            session_id=session_id))),
+        ("list_session_summaries", lambda: sum(summary["point_count"] or 0 for summary in database.list_session_summaries(connection_handler))),
+        ("analyze_session", lambda: analytics.analyze_session(db_filename, session_id)["points"]),
+        ("save_as_gpx", lambda: count if export.save_as_gpx(os.path.join(directory, "bench.gpx"), \
+            database.iter_locations(connection_handler, session_id=session_id)) == 0 else 0),
+        ("write_kml", lambda: count if export.write_kml(os.path.join(directory, "bench.kml"), \
+            database.iter_locations(connection_handler, session_id=session_id)) == 0 else 0)
+    ]
+
+    results = []
+    for name, operation in operations:
+        start = time.perf_counter()
+        locations = operation()
+        results.append((name, locations, time.perf_counter() - start))
+
+    database.disconnect(connection_handler)
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Measures the end-to-end ingestion pipeline against fake GPSD servers")
+    parser.add_argument("--rate", type=float, default=100.0, help="reports per second and source")
+    parser.add_argument("--sources", type=int, default=1, help="number of fake GPSD servers (receivers)")
+    parser.add_argument("--workers", type=int, default=1, help="number of recorder workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="ingestion duration, in seconds")
+    parser.add_argument("--mode", choices=("stream", "poll"), default="stream", help="monitor mode")
+    parser.add_argument("--layout", choices=database.STORAGE_LAYOUTS, default=database.ROWS, help="storage layout")
+    parser.add_argument("--skip-queries", action="store_true", help="do not time the retrieval and export functions")
+    args = parser.parse_args()
+
+    if args.mode == "poll" and args.sources > 1:
+        parser.error("the poll mode supports a single source")
+
+    # The fake servers run in their own process, so that their CPU time is not accounted
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    stop = multiprocessing.Event()
+    servers = multiprocessing.Process(target=fake_gpsd.run_servers, kwargs={"sources": args.sources, "rate": args.rate, \
+        "ready": sender.send, "stop": stop}, daemon=True)
+    servers.start()
+    ports = receiver.recv()
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        db_filename = os.path.join(directory, "bench_pipeline.db")
+        result = run_pipeline(make_config(db_filename, ports, args), args.duration)
+
+        stop.set()
+        servers.join()
+
+        connection_handler = database.connect_reader(db_filename)
+        committed = connection_handler.execute("SELECT COUNT(*) FROM location;").fetchone()[0] + \
+            sum(row[0] for row in connection_handler.execute(f"SELECT point_count FROM {database.get_block_table_name()};"))
+        database.disconnect(connection_handler)
+
+        latencies = result["latencies"]
+        p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (float("nan"), float("nan"))
+
+        print(f"{'offered (loc/s)':>15} | {'committed':>9} | {'throughput (loc/s)':>18} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | " \
+              f"{'queue mean/max':>14} | {'dropped':>7} | {'drain (s)':>9} | {'CPU':>6} | {'RSS (MB)':>8}")
+        print(f"{args.rate * args.sources:>15,.0f} | {committed:>9,} | {committed / result['elapsed']:>18,.0f} | {p50:>8.1f} | {p99:>8.1f} | " \
+              f"{result['depth_mean']:>7.1f}/{result['depth_max']:<6} | {result['dropped']:>7,} | {result['drain']:>9.2f} | " \
+              f"{100 * result['cpu']:>5.1f}% | {result['rss']:>8.1f}")
+
+        if not args.skip_queries and committed > 0:
+            print()
+            print(f"{'function':>22} | {'locations':>9} | {'time (s)':>8} | {'loc/s':>12}")
+            for name, locations, elapsed in run_queries(db_filename, directory):
+                print(f"{name:>22} | {locations:>9,} | {elapsed:>8.3f} | {locations / elapsed:>12,.0f}")
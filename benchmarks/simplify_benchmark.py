@@ -0,0 +1,74 @@
+#!/usr/bin/env python3.7
+
+""" Benchmark of the track simplification methods of core.simplify
+
+    Usage (from the project root):  python3 -m benchmarks.simplify_benchmark
+"""
+
+from core import simplify
+
+import argparse
+import time
+
+import numpy as np
+
+
+def make_track(count, seed=0):
+
+    """ Generates a synthetic 10 Hz vehicle track: straight road sections joined by turns,
+        with a GPS noise of about one meter
+
+        :param count: the number of points
+        :param seed: the random generator seed
+        :return: a tuple (latitude, longitude) of arrays, in degrees
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # Speed around 15 m/s, heading changing by sections of 30 s
+    speed = 15.0 + rng.normal(0, 0.5, count)
+    turns = np.repeat(rng.normal(0, 0.6, count // 300 + 1), 300)[:count]
+    heading = np.cumsum(turns * (rng.random(count) < 0.02))
+
+    step = speed * 0.1
+    y = np.cumsum(step * np.cos(heading)) + rng.normal(0, 1.0, count)
+    x = np.cumsum(step * np.sin(heading)) + rng.normal(0, 1.0, count)
+
+    latitude = 45.5 + np.degrees(y / 6371008.8)
+    longitude = -73.6 + np.degrees(x / (6371008.8 * np.cos(np.radians(45.5))))
+
+    return latitude, longitude
+
+
+def run(latitude, longitude, tolerance, method, window):
+
+    """ Simplifies the track in windows and measures the runtime
+
+        :return: a tuple (kept points, elapsed time in seconds)
+    """
+
+    points = zip(latitude, longitude, range(len(latitude)))
+
+    start = time.perf_counter()
+    kept = sum(1 for _ in simplify.simplify_windows(points, tolerance, method=method, window=window))
+    elapsed = time.perf_counter() - start
+
+    return kept, elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Measures the point reduction and runtime of the track simplification")
+    parser.add_argument("--points", type=int, default=1000000, help="number of points of the synthetic track")
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[1.0, 5.0, 10.0], help="tolerances, in meters")
+    parser.add_argument("--window", type=int, default=simplify.WINDOW_SIZE, help="number of points simplified at once")
+    args = parser.parse_args()
+
+    latitude, longitude = make_track(args.points)
+
+    print(f"{'method':>16} | {'tolerance (m)':>13} | {'kept points':>11} | {'reduction':>9} | {'time (s)':>8} | {'points/s':>10}")
+    for method in (simplify.DOUGLAS_PEUCKER, simplify.VISVALINGAM):
+        for tolerance in args.tolerances:
+            kept, elapsed = run(latitude, longitude, tolerance, method, args.window)
+            print(f"{method:>16} | {tolerance:>13.1f} | {kept:>11,} | {100 * (1 - kept / args.points):>8.1f}% | " \
+                  f"{elapsed:>8.2f} | {args.points / elapsed:>10,.0f}")
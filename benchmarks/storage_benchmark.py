@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.7
+
+""" Benchmark of the storage layouts of core.database: size on disk, insertion and read throughputs
+    of the 'rows' layout (one row per location) and the 'blocks' layout (delta-encoded blocks).
+    The recorder is also measured with one location per batch (the rate of a live receiver).
+
+    Usage (from the project root):  python3 -m benchmarks.storage_benchmark
+"""
+
+from config import config
+from core import database, location, recorder, ring_buffer
+from benchmarks.insert_benchmark import make_rows
+
+import argparse
+import os
+import tempfile
+import time
+
+
+def run(layout, total, batch_size, directory):
+
+    """ Stores total records in batches of batch_size records into a fresh database, then reads them back
+
+        :param layout: the storage layout, 'rows' or 'blocks'
+        :param total: the total number of records
+        :param batch_size: the number of records per batch
+        :param directory: the directory where the database is created
+        :return: a tuple (bytes per location, insertion rate, location objects read rate, arrays read rate)
+    """
+
+    db_filename = os.path.join(directory, f"bench_{layout}.db")
+    connection_handler = database.connect(db_filename)
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+    connection_handler.commit()
+
+    # The size of the empty database is not accounted
+    connection_handler.execute("VACUUM;")
+    empty_size = os.path.getsize(db_filename)
+
+    rows = make_rows(batch_size)
+    batches = max(1, total // batch_size)
+
+    start = time.perf_counter()
+    for _ in range(batches):
+        if layout == database.BLOCKS:
+            database.insert_location_blocks(connection_handler, rows)
+        else:
+            database.insert_location_data(connection_handler, rows)
+    insert_rate = batches * batch_size / (time.perf_counter() - start)
+
+    connection_handler.execute("VACUUM;")
+    size = (os.path.getsize(db_filename) - empty_size) / (batches * batch_size)
+
+    start = time.perf_counter()
+    count = sum(1 for _ in database.iter_locations(connection_handler, session_id=1))
+    read_rate = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    count = sum(len(chunk["time"]) for chunk in database.iter_session_arrays(connection_handler, 1))
+    array_rate = count / (time.perf_counter() - start)
+
+    database.disconnect(connection_handler)
+    os.remove(db_filename)
+
+    return size, insert_rate, read_rate, array_rate
+
+
+def run_recorder(layout, total, directory, buffered=True):
+
+    """ Stores total locations through the recorder, one location per batch
+
+        :param layout: the storage layout, 'rows' or 'blocks'
+        :param total: the total number of locations
+        :param directory: the directory where the database is created
+        :param buffered: a flag indicating if the recorder holds the open block (if False,
+                         every batch extends the last block of the database)
+        :return: the insertion rate, in locations/s
+    """
+
+    appconfig = config.AppConfig("./config/config.json")
+    appconfig.load_app_config()
+    appconfig.database_filename = os.path.join(directory, f"bench_recorder_{layout}.db")
+    appconfig.storage_layout = layout
+    appconfig.rollover_policy = None
+
+    worker = recorder.Recorder(ring_buffer.RingBuffer(), appconfig)
+    worker.init_connection()
+    database.create_new_session(worker.connection_handler)
+    worker.session_id = database.get_newest_session_id(worker.connection_handler)
+
+    if not buffered:
+        worker.blocks = None
+
+    batches = [location.LocationBatch([location.Location(*row[1:9])]) for row in make_rows(total)]
+
+    start = time.perf_counter()
+    for batch in batches:
+        worker.write_batch(batch)
+    worker.write_batch(location.LocationBatch(), flush=True)
+    rate = total / (time.perf_counter() - start)
+
+    database.disconnect(worker.connection_handler)
+    os.remove(appconfig.database_filename)
+
+    return rate
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Compares the location storage layouts")
+    parser.add_argument("--total", type=int, default=200000, help="number of locations stored per run")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of locations per insertion")
+    parser.add_argument("--live-total", type=int, default=2000, help="number of locations stored by the recorder one at a time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        print(f"{'layout':>8} | {'bytes/location':>14} | {'insert (loc/s)':>14} | {'read objects (loc/s)':>20} | {'read arrays (loc/s)':>19}")
+        for layout in database.STORAGE_LAYOUTS:
+            size, insert_rate, read_rate, array_rate = run(layout, args.total, args.batch_size, directory)
+            print(f"{layout:>8} | {size:>14,.1f} | {insert_rate:>14,.0f} | {read_rate:>20,.0f} | {array_rate:>19,.0f}")
+
+        print()
+        print(f"{'recorder, 1 location/batch':>34} | {'insert (loc/s)':>14}")
+        print(f"{'rows':>34} | {run_recorder(database.ROWS, args.live_total, directory):>14,.0f}")
+        print(f"{'blocks (open block held)':>34} | {run_recorder(database.BLOCKS, args.live_total, directory):>14,.0f}")
+        print(f"{'blocks (last block rewritten)':>34} | {run_recorder(database.BLOCKS, args.live_total, directory, buffered=False):>14,.0f}")
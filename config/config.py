@@ -13,16 +13,52 @@ class AppConfig():
 
         :param gpsd_ip_address: The GPSD server IP address/hostname (default: '127.0.0.1')
         :param gpsd_port: The GPSD server TCP port (default: 2947)
+        :param gpsd_sources: The GPSD sources (receivers), a list of objects with a name, gpsd_ip_address, gpsd_port and device_id
+                             (default: None, a single source built from gpsd_ip_address and gpsd_port)
         :param start_gpsd: A flag indicating if the application should automatically start the GPSD server (default: true)
         :param default_device: The default port to which the USB GPS device is attached  (default: '/dev/ttyACM0')
         :param enable_new_session: A flag indicating that every time the application starts, it creates a new session (default: true)
         :param database_filename: The SQLite database filename and path (default: 'gps_logger.db')
         :param database: The name of the SQLite database (default: 'gps_logger')
+        :param storage_profile: The SQLite storage profile, 'durable', 'balanced' or 'fast', None for the SQLite defaults (default: 'balanced')
         :param session_tablename: The name of the session datatable (default: 'session')
         :param location_tablename: The name of the location datatable      (default: 'location')
+        :param insert_method: The location insertion method, either 'executemany' or 'concat' (default: 'executemany')
+        :param storage_layout: The location storage layout, 'rows' (one row per location) or 'blocks' (delta-encoded blocks) (default: 'rows')
+        :param storage_block_size: The maximum number of locations per block with the 'blocks' layout (default: 1000)
+        :param storage_block_interval: The maximum time the recorder holds the open block before writing it, in seconds (default: 60)
+        :param rollover_policy: The database file rollover policy, 'daily' or 'rows' (default: None, a single database file)
+        :param rollover_rows: The maximum number of locations per database file with the 'rows' policy (default: 1000000)
+        :param rollover_read_only: A flag indicating if the closed database files are made read-only once compacted (default: false)
+        :param monitor_mode: The monitor mode, either 'stream' (GPSD watcher) or 'poll' (default: 'poll')
         :param monitor_delay: The time interval of the monitor thread (default: 0.5)
-        :param recorder_batch_size: The maximum number of data records stored simultaneously in the database (default: 100)
-        :param recorder_interval: The time interval of the recorder thread (default: 5)
+        :param monitor_batch_size: The maximum number of locations reported at once by the monitor in 'stream' mode (default: 100)
+        :param filter_enabled: A flag indicating if the monitor suppresses the stationary and redundant locations (default: false)
+        :param filter_min_distance: The minimum distance to the last reported location, in meters (default: 5.0)
+        :param filter_min_speed: The minimum speed of a moving device, in meters per second (default: 0.5)
+        :param filter_min_heading_change: The minimum heading change of a moving device, in degrees (default: 10.0)
+        :param filter_keepalive_interval: The maximum time between two reported locations, in seconds (default: 60.0)
+        :param recorder_batch_size: The maximum number of data records stored simultaneously in the database (default: 1000)
+        :param recorder_interval: The maximum time a location waits in the recorder before being committed (default: 1)
+        :param recorder_min_batch_size: The minimum number of locations committed at once in adaptive mode (default: 1)
+        :param recorder_adaptive: A flag indicating if the recorder batch size adapts to the arrival rate and commit time (default: true)
+        :param recorder_workers: The number of recorder workers (shards) sharing the GPSD sources (default: 1)
+        :param queue_capacity: The maximum number of locations buffered between the monitor and the recorder (default: 100000)
+        :param queue_overflow_policy: The policy applied when the buffer is full, 'block', 'drop_oldest', 'drop_newest' or 'spill' (default: 'block')
+        :param queue_spill_directory: The directory of the spill file of the 'spill' policy (default: None, the temporary directory)
+        :param spool_directory: The directory of the spool of the locations not yet committed (default: None, no spool)
+        :param spool_segment_size: The maximum size of a spool segment file, in bytes (default: 4194304)
+        :param spool_fsync_interval: The maximum time between two syncs of the spool to disk, in seconds (default: 1.0)
+        :param rollup_enabled: A flag indicating if the downsampler builds the 1 s, 10 s and 60 s rollups in the background (default: false)
+        :param rollup_interval: The time interval between two downsampler runs, in seconds (default: 60)
+        :param rollup_retention_days: The age after which the rolled up raw locations are deleted, in days (default: None, kept forever)
+        :param spatial_index_enabled: A flag indicating if the downsampler adds the new locations to the spatial index in the background (default: false)
+        :param runtime: The application runtime, 'thread', 'process' or 'asyncio' (default: 'thread')
+        :param process_slots: The number of shared-memory slots between the monitor and recorder processes (default: 64)
+        :param process_slot_size: The maximum number of locations per shared-memory slot (default: 1000)
+        :param source: The location source, 'gpsd' (GPSD server) or 'replay' (recorded log) (default: 'gpsd')
+        :param replay_file: The replayed GPSD JSON or NMEA log, optionally gzip-compressed (default: None)
+        :param replay_speed: The replay speed factor (1 for real time) or 'max' (default: 1.0)
 
     """
 
@@ -36,16 +72,51 @@ class AppConfig():
         self.config_filename = config_filename
         self.gpsd_ip_address = None
         self.gpsd_port = None
+        self.gpsd_sources = None
         self.default_device = None
         self.start_gpsd = None
         self.enable_new_session = None
         self.database_filename = None
         self.database = None
+        self.storage_profile = None
         self.session_tablename = None
         self.location_tablename = None
+        self.insert_method = None
+        self.storage_layout = None
+        self.storage_block_size = None
+        self.storage_block_interval = None
+        self.rollover_policy = None
+        self.rollover_rows = None
+        self.rollover_read_only = None
+        self.monitor_mode = None
         self.monitor_delay = None
+        self.monitor_batch_size = None
+        self.filter_enabled = None
+        self.filter_min_distance = None
+        self.filter_min_speed = None
+        self.filter_min_heading_change = None
+        self.filter_keepalive_interval = None
         self.recorder_batch_size = None
         self.recorder_interval = None
+        self.recorder_min_batch_size = None
+        self.recorder_adaptive = None
+        self.recorder_workers = None
+        self.queue_capacity = None
+        self.queue_overflow_policy = None
+        self.queue_spill_directory = None
+        self.spool_directory = None
+        self.spool_segment_size = None
+        self.spool_fsync_interval = None
+        self.rollup_enabled = None
+        self.rollup_interval = None
+        self.rollup_retention_days = None
+        self.spatial_index_enabled = None
+        self.runtime = None
+        self.process_slots = None
+        self.process_slot_size = None
+        self.source = None
+        self.replay_file = None
+        self.replay_speed = None
 
     def load_app_config(self):
 
@@ -82,6 +153,7 @@ class AppConfig():
             # GPSD / GPS device parameters
             self.gpsd_ip_address = data["gpsd_ip_address"]
             self.gpsd_port = data["gpsd_port"]
+            self.gpsd_sources = data.get("gpsd_sources", None)
             self.start_gpsd = data["start_gpsd"]
             self.default_device = data["default_device"]
 
@@ -89,18 +161,86 @@ class AppConfig():
             self.enable_new_session = data["enable_new_session"]
             self.database_filename = data["database_filename"]
             self.database = data["database"]
+            self.storage_profile = data.get("storage_profile", "balanced")
             self.location_tablename = data["location_tablename"]
             self.session_tablename = data["session_tablename"]
+            self.insert_method = data.get("insert_method", "executemany")
+            self.storage_layout = data.get("storage_layout", "rows")
+            self.storage_block_size = data.get("storage_block_size", 1000)
+            self.storage_block_interval = data.get("storage_block_interval", 60)
+            self.rollover_policy = data.get("rollover_policy", None)
+            self.rollover_rows = data.get("rollover_rows", 1000000)
+            self.rollover_read_only = data.get("rollover_read_only", False)
 
             # Monitor parameters
+            self.monitor_mode = data.get("monitor_mode", "poll")
             self.monitor_delay = data["monitor_delay"]
+            self.monitor_batch_size = data.get("monitor_batch_size", 100)
+
+            # Stationary-point filter parameters
+            self.filter_enabled = data.get("filter_enabled", False)
+            self.filter_min_distance = data.get("filter_min_distance", 5.0)
+            self.filter_min_speed = data.get("filter_min_speed", 0.5)
+            self.filter_min_heading_change = data.get("filter_min_heading_change", 10.0)
+            self.filter_keepalive_interval = data.get("filter_keepalive_interval", 60.0)
 
             # Recorder parameters
             self.recorder_batch_size = data["recorder_batch_size"]
             self.recorder_interval = data["recorder_interval"]
+            self.recorder_min_batch_size = data.get("recorder_min_batch_size", 1)
+            self.recorder_adaptive = data.get("recorder_adaptive", True)
+            self.recorder_workers = data.get("recorder_workers", 1)
+
+            # Queue parameters
+            self.queue_capacity = data.get("queue_capacity", 100000)
+            self.queue_overflow_policy = data.get("queue_overflow_policy", "block")
+            self.queue_spill_directory = data.get("queue_spill_directory", None)
+
+            # Spool parameters
+            self.spool_directory = data.get("spool_directory", None)
+            self.spool_segment_size = data.get("spool_segment_size", 4194304)
+            self.spool_fsync_interval = data.get("spool_fsync_interval", 1.0)
+
+            # Downsampler parameters
+            self.rollup_enabled = data.get("rollup_enabled", False)
+            self.rollup_interval = data.get("rollup_interval", 60)
+            self.rollup_retention_days = data.get("rollup_retention_days", None)
+            self.spatial_index_enabled = data.get("spatial_index_enabled", False)
+
+            # Runtime parameters
+            self.runtime = data.get("runtime", "thread")
+            self.process_slots = data.get("process_slots", 64)
+            self.process_slot_size = data.get("process_slot_size", 1000)
+
+            # Source parameters
+            self.source = data.get("source", "gpsd")
+            self.replay_file = data.get("replay_file", None)
+            self.replay_speed = data.get("replay_speed", 1.0)
 
             return 0
 
         except Exception as e:
             logger.error(f'Exception: {str(e)}')
             return -1
+
+
+    def get_gpsd_sources(self):
+
+        """ Returns the GPSD sources, completed with the default GPSD server parameters
+
+            :return: the list of GPSD source dictionaries (name, gpsd_ip_address, gpsd_port, device_id)
+        """
+
+        if not self.gpsd_sources:
+            return [{"name": "default", "gpsd_ip_address": self.gpsd_ip_address, "gpsd_port": self.gpsd_port, "device_id": None}]
+
+        result = []
+        for i, source in enumerate(self.gpsd_sources):
+            result.append({
+                "name": source.get("name", f"source_{i}"),
+                "gpsd_ip_address": source.get("gpsd_ip_address", self.gpsd_ip_address),
+                "gpsd_port": source.get("gpsd_port", self.gpsd_port),
+                "device_id": source.get("device_id", i)
+            })
+
+        return result
@@ -0,0 +1,276 @@
+from core import archive, database, rollover
+from helpers import geo
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import sqlite3
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Number of rows fetched at once when loading a session
+LOAD_CHUNK_SIZE = 100000
+
+# Speed under which the device is considered stationary, in meters per second
+STATIONARY_SPEED = 0.5
+
+# Time gap above which two consecutive locations are not considered as a continuous move, in seconds
+MAX_GAP = 60.0
+
+# The columns loaded for a session (time as UNIX timestamps in milliseconds, see database.ARRAY_COLUMNS)
+SESSION_COLUMNS = ("time", "latitude", "longitude", "altitude", "speed", "climb", "mode", "device_id")
+
+
+def load_session_arrays(connection_handler, session_id, location_table_name="location", chunk_size=LOAD_CHUNK_SIZE):
+
+    """ Loads the locations of a session as NumPy arrays, in time order. The UTC times are
+        converted to UNIX timestamps (in milliseconds) by SQLite and the missing values are
+        loaded as NaN.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the session identifier
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a dictionary of arrays (see SESSION_COLUMNS)
+        :raises sqlite3.Error: Database error
+    """
+
+    return concatenate_chunks(database.iter_session_arrays(connection_handler, session_id, columns=SESSION_COLUMNS, \
+        location_table_name=location_table_name, chunk_size=chunk_size))
+
+
+def concatenate_chunks(chunks):
+
+    """ Concatenates chunks of session arrays
+
+        :param chunks: an iterable of dictionaries of arrays (see SESSION_COLUMNS)
+        :return: a dictionary of arrays (see SESSION_COLUMNS)
+    """
+
+    columns = {column: [] for column in SESSION_COLUMNS}
+
+    for chunk in chunks:
+        for column in SESSION_COLUMNS:
+            columns[column].append(chunk[column])
+
+    return {column: np.concatenate(columns[column]) if columns[column] else np.empty(0, dtype=database.ARRAY_COLUMNS[column][1]) \
+            for column in SESSION_COLUMNS}
+
+
+def session_statistics(arrays, stationary_speed=STATIONARY_SPEED, max_gap=MAX_GAP):
+
+    """ Computes the statistics of a session from its arrays (fully vectorized). The locations
+        of several devices (receivers) are interleaved in a session: the distance, moving time
+        and elevation changes are computed along the path of each device, then summed.
+
+        :param arrays: the dictionary of arrays returned by load_session_arrays (without
+                       device_id column, the locations are reported by a single device)
+        :param stationary_speed: the speed under which the device is stationary, in meters per second
+        :param max_gap: the time gap above which two locations are not a continuous move, in seconds
+        :return: a dictionary holding the point count, start/end times (UNIX timestamps in ms),
+                 duration, moving time, distance, max/avg speed, elevation gain/loss,
+                 max climb/sink rates and bounding box (None values if not available)
+    """
+
+    n = len(arrays["time"])
+
+    stats = {
+        "points": n,
+        "start_time": None,
+        "end_time": None,
+        "duration": 0.0,
+        "moving_time": 0.0,
+        "distance": 0.0,
+        "max_speed": None,
+        "avg_speed": None,
+        "elevation_gain": 0.0,
+        "elevation_loss": 0.0,
+        "max_climb_rate": None,
+        "max_sink_rate": None,
+        "bbox": None
+    }
+
+    if n == 0:
+        return stats
+
+    time = arrays["time"]
+    latitude = arrays["latitude"]
+    longitude = arrays["longitude"]
+    altitude = arrays["altitude"]
+    speed = arrays["speed"]
+    climb = arrays["climb"]
+
+    stats["start_time"] = int(time[0])
+    stats["end_time"] = int(time[-1])
+    stats["duration"] = float(time[-1] - time[0]) / 1000
+    stats["bbox"] = (float(latitude.min()), float(longitude.min()), float(latitude.max()), float(longitude.max()))
+
+    if n > 1:
+
+        # Group the locations by device, in time order (stable sort), and only keep the steps
+        # between two locations of the same device
+        device = arrays.get("device_id")
+        if device is not None:
+            order = np.argsort(device, kind="stable")
+            time, latitude, longitude, altitude, speed, device = (values[order] for values in \
+                (time, latitude, longitude, altitude, speed, device))
+            same = device[1:] == device[:-1]
+        else:
+            same = np.ones(n - 1, dtype=bool)
+
+        dt = (np.diff(time) / 1000)[same]
+        steps = geo.haversine(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:])[same]
+        stats["distance"] = float(steps.sum())
+
+        # The reported speed is used if available, the speed derived from the positions otherwise
+        with np.errstate(divide="ignore", invalid="ignore"):
+            derived = np.where(dt > 0, steps / dt, 0.0)
+        step_speed = np.where(np.isnan(speed[1:][same]), derived, speed[1:][same])
+
+        moving = (step_speed >= stationary_speed) & (dt > 0) & (dt <= max_gap)
+        stats["moving_time"] = float(dt[moving].sum())
+
+        if stats["moving_time"] > 0:
+            stats["avg_speed"] = float(steps[moving].sum() / stats["moving_time"])
+
+        # Elevation changes, ignoring the locations without altitude
+        valid = ~np.isnan(altitude)
+        if valid.sum() > 1:
+            elevation = np.diff(altitude[valid])
+            if device is not None:
+                elevation = elevation[device[valid][1:] == device[valid][:-1]]
+            stats["elevation_gain"] = float(elevation[elevation > 0].sum())
+            stats["elevation_loss"] = float(np.abs(elevation[elevation < 0].sum()))
+
+    if not np.isnan(speed).all():
+        stats["max_speed"] = float(np.nanmax(speed))
+
+    if not np.isnan(climb).all():
+        stats["max_climb_rate"] = float(np.nanmax(climb))
+        stats["max_sink_rate"] = float(-np.nanmin(climb))
+
+    return stats
+
+
+def analyze_session(db_filename, session_id, location_table_name="location", catalog=False):
+
+    """ Loads a session from a database file and computes its statistics. The function
+        opens its own read-only connection, so that it can run in a worker process.
+
+        :param db_filename: the database filename
+        :param session_id: the session identifier
+        :param location_table_name: the location datatable name
+        :param catalog: a flag indicating if db_filename is the catalog of a rolled over database,
+                        the session is then read across its database files (default: False)
+        :return: the dictionary of statistics or None if an exception arises
+    """
+
+    if catalog:
+        try:
+            return session_statistics(concatenate_chunks(rollover.iter_session_arrays(db_filename, session_id, \
+                columns=SESSION_COLUMNS, location_table_name=location_table_name, chunk_size=LOAD_CHUNK_SIZE)))
+
+        except sqlite3.Error as error:
+            logger.error(f"Exception: {str(error)}")
+            return None
+
+    connection_handler = database.connect_reader(db_filename)
+
+    if connection_handler is None:
+        return None
+
+    try:
+        arrays = load_session_arrays(connection_handler, session_id, location_table_name=location_table_name)
+        return session_statistics(arrays)
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        return None
+
+    finally:
+        database.disconnect(connection_handler)
+
+
+def list_session_ids(connection_handler, location_table_name="location"):
+
+    """ Returns the identifiers of the sessions holding locations, stored as rows or as blocks
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :return: the list of session identifiers
+    """
+
+    return database.list_session_ids(connection_handler, location_table_name=location_table_name)
+
+
+def analyze_sessions(db_filename, session_ids=None, processes=None, location_table_name="location", catalog=False):
+
+    """ Computes the statistics of many sessions in parallel, across a process pool
+
+        :param db_filename: the database filename
+        :param session_ids: the session identifiers (default: None, all the sessions)
+        :param processes: the number of worker processes (default: None, the number of CPUs;
+                          1 to analyze the sessions in the current process)
+        :param location_table_name: the location datatable name
+        :param catalog: a flag indicating if db_filename is the catalog of a rolled over database (default: False)
+        :return: a dictionary mapping the session identifiers to their statistics
+    """
+
+    if session_ids is None and catalog:
+        try:
+            session_ids = rollover.list_session_ids(db_filename, location_table_name=location_table_name)
+        except sqlite3.Error as error:
+            logger.error(f"Exception: {str(error)}")
+            return {}
+
+    elif session_ids is None:
+        connection_handler = database.connect_reader(db_filename)
+        if connection_handler is None:
+            return {}
+        session_ids = list_session_ids(connection_handler, location_table_name=location_table_name)
+        database.disconnect(connection_handler)
+
+    if processes == 1 or len(session_ids) <= 1:
+        return {session_id: analyze_session(db_filename, session_id, location_table_name, catalog) for session_id in session_ids}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(analyze_session, [db_filename] * len(session_ids), session_ids, \
+                               [location_table_name] * len(session_ids), [catalog] * len(session_ids))
+        return dict(zip(session_ids, results))
+
+
+def analyze_archive(path):
+
+    """ Computes the statistics of an archived session, read through memory-mapped arrays
+
+        :param path: the path of the archived session directory
+        :return: the dictionary of statistics or None if the archive cannot be read
+    """
+
+    try:
+        return session_statistics(archive.open_session_archive(path, columns=SESSION_COLUMNS))
+
+    except (OSError, ValueError, KeyError) as error:
+        logger.error(f"Exception: {str(error)}")
+        return None
+
+
+def analyze_archives(paths, processes=None):
+
+    """ Computes the statistics of many archived sessions in parallel, across a process pool
+
+        :param paths: the paths of the archived session directories
+        :param processes: the number of worker processes (default: None, the number of CPUs;
+                          1 to analyze the sessions in the current process)
+        :return: a dictionary mapping the paths to their statistics
+    """
+
+    if processes == 1 or len(paths) <= 1:
+        return {path: analyze_archive(path) for path in paths}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return dict(zip(paths, executor.map(analyze_archive, paths)))
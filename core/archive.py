@@ -0,0 +1,283 @@
+from core import database, location, rollover
+from helpers import generic
+
+import json
+import os
+import shutil
+import sqlite3
+import numpy as np
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Version of the archive format
+ARCHIVE_VERSION = 1
+
+# The header of an archived session
+HEADER_FILENAME = "header.json"
+
+# The archived columns (see database.ARRAY_COLUMNS), each one stored as a raw file of fixed-width values
+ARCHIVE_COLUMNS = ("time", "latitude", "longitude", "altitude", "heading", "climb", "speed", "mode", "device_id")
+
+# Number of rows read from the database and written at once
+ARCHIVE_CHUNK_SIZE = 100000
+
+
+def get_session_path(directory, session_id):
+
+    """ Returns the path of an archived session
+
+        :param directory: the archive directory
+        :param session_id: the session identifier
+        :return: the path of the session directory
+    """
+
+    return os.path.join(directory, f"session_{session_id:06d}")
+
+
+def write_session_archive(connection_handler, session_id, directory, location_table_name="location", chunk_size=ARCHIVE_CHUNK_SIZE):
+
+    """ Archives a session as one raw file per column (e.g., float64 latitudes, int64 UNIX
+        timestamps in milliseconds) and a JSON header describing them. The columns are
+        streamed from the database in chunks and the session directory is replaced once
+        complete. Like the analytics, the archive only holds the locations with a fix
+        (mode 2 or 3, see database.iter_session_arrays).
+
+        :param connection_handler: the connection handler object
+        :param session_id: the session identifier
+        :param directory: the archive directory
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows read and written at once
+        :return: the number of archived locations or -1 if an exception arises
+    """
+
+    return write_archive(database.iter_session_arrays(connection_handler, session_id, columns=ARCHIVE_COLUMNS, \
+        location_table_name=location_table_name, chunk_size=chunk_size), session_id, directory)
+
+
+def write_archive(chunks, session_id, directory):
+
+    """ Archives a session read as chunks of arrays (see write_session_archive)
+
+        :param chunks: an iterable of dictionaries of arrays (see ARCHIVE_COLUMNS), in time order
+        :param session_id: the session identifier
+        :param directory: the archive directory
+        :return: the number of archived locations or -1 if an exception arises
+    """
+
+    path = get_session_path(directory, session_id)
+    tmp_path = f"{path}.tmp"
+    old_path = f"{path}.old"
+
+    try:
+        recover_session_archive(path)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        files = {column: open(os.path.join(tmp_path, f"{column}.bin"), "wb") for column in ARCHIVE_COLUMNS}
+
+        count = 0
+        bbox = None
+        start_time = None
+        end_time = None
+
+        try:
+            for chunk in chunks:
+
+                for column in ARCHIVE_COLUMNS:
+                    chunk[column].tofile(files[column])
+
+                chunk_bbox = (float(chunk["latitude"].min()), float(chunk["longitude"].min()), \
+                              float(chunk["latitude"].max()), float(chunk["longitude"].max()))
+                bbox = chunk_bbox if bbox is None else (min(bbox[0], chunk_bbox[0]), min(bbox[1], chunk_bbox[1]), \
+                                                        max(bbox[2], chunk_bbox[2]), max(bbox[3], chunk_bbox[3]))
+
+                if start_time is None:
+                    start_time = int(chunk["time"][0])
+                end_time = int(chunk["time"][-1])
+                count += len(chunk["time"])
+
+        finally:
+            for f in files.values():
+                f.close()
+
+        header = {
+            "version": ARCHIVE_VERSION,
+            "session_id": session_id,
+            "count": count,
+            "start_time": start_time,
+            "end_time": end_time,
+            "bbox": bbox,
+            "columns": {column: {"file": f"{column}.bin", "dtype": database.ARRAY_COLUMNS[column][1]} for column in ARCHIVE_COLUMNS}
+        }
+
+        with open(os.path.join(tmp_path, HEADER_FILENAME), "w") as header_file:
+            json.dump(header, header_file, indent=2)
+
+        # A directory cannot be replaced in a single rename: the previous archive is renamed
+        # aside first and restored if the new one cannot take its place
+        if os.path.exists(path):
+            os.replace(path, old_path)
+
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(old_path):
+                os.replace(old_path, path)
+            raise
+
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        logger.info(f"Session {session_id} archived: {count} locations")
+        return count
+
+    except (sqlite3.Error, OSError) as error:
+        logger.error(f"Exception: {str(error)}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return -1
+
+
+def recover_session_archive(path):
+
+    """ Restores the previous archive of a session if the writer stopped between the two
+        renames of the swap, and removes it otherwise
+
+        :param path: the path of the session directory
+        :raises OSError: The previous archive cannot be restored
+    """
+
+    old_path = f"{path}.old"
+
+    if not os.path.exists(old_path):
+        return
+
+    if os.path.exists(path):
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(old_path, path)
+
+
+def archive_sessions(db_filename, directory, session_ids=None, location_table_name="location", catalog=False):
+
+    """ Archives many sessions of a database file
+
+        :param db_filename: the database filename
+        :param directory: the archive directory
+        :param session_ids: the session identifiers (default: None, all the sessions)
+        :param location_table_name: the location datatable name
+        :param catalog: a flag indicating if db_filename is the catalog of a rolled over database,
+                        the sessions are then read across its database files (default: False)
+        :return: a dictionary mapping the session identifiers to their number of archived locations (-1 if failure)
+    """
+
+    if catalog:
+        try:
+            if session_ids is None:
+                session_ids = rollover.list_session_ids(db_filename, location_table_name=location_table_name)
+
+            return {session_id: write_archive(rollover.iter_session_arrays(db_filename, session_id, columns=ARCHIVE_COLUMNS, \
+                        location_table_name=location_table_name, chunk_size=ARCHIVE_CHUNK_SIZE), session_id, directory) \
+                    for session_id in session_ids}
+
+        except sqlite3.Error as error:
+            logger.error(f"Exception: {str(error)}")
+            return {}
+
+    connection_handler = database.connect_reader(db_filename)
+
+    if connection_handler is None:
+        return {}
+
+    try:
+        if session_ids is None:
+            session_ids = database.list_session_ids(connection_handler, location_table_name)
+
+        return {session_id: write_session_archive(connection_handler, session_id, directory, location_table_name=location_table_name) \
+                for session_id in session_ids}
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        return {}
+
+    finally:
+        database.disconnect(connection_handler)
+
+
+def read_header(path):
+
+    """ Reads the header of an archived session
+
+        :param path: the path of the session directory
+        :return: the header dictionary
+        :raises OSError: Missing header
+        :raises ValueError: Invalid header or unsupported version
+    """
+
+    with open(os.path.join(path, HEADER_FILENAME), "r") as header_file:
+        header = json.load(header_file)
+
+    if header.get("version") != ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported archive version: {header.get('version')}")
+
+    return header
+
+
+def open_session_archive(path, columns=None):
+
+    """ Opens an archived session as read-only memory-mapped NumPy arrays (zero-copy: the
+        pages are read from the disk on access). The result can be passed to
+        analytics.session_statistics.
+
+        :param path: the path of the session directory
+        :param columns: the columns to open (default: None, all the archived columns)
+        :return: a dictionary of arrays, by column
+        :raises OSError: Missing file
+        :raises ValueError: Invalid header or unsupported version
+    """
+
+    header = read_header(path)
+    arrays = {}
+
+    for column in (columns or header["columns"]):
+
+        spec = header["columns"][column]
+        dtype = np.dtype(spec["dtype"])
+
+        # An empty file cannot be memory-mapped
+        if header["count"] == 0:
+            arrays[column] = np.empty(0, dtype=dtype)
+        else:
+            arrays[column] = np.memmap(os.path.join(path, spec["file"]), dtype=dtype, mode="r", shape=(header["count"],))
+
+    return arrays
+
+
+def iter_archive_locations(path, chunk_size=database.FETCH_CHUNK_SIZE):
+
+    """ Iterates over an archived session as location objects (e.g., to export it)
+
+        :param path: the path of the session directory
+        :param chunk_size: the number of locations converted at once
+        :return: a generator of location objects
+        :raises OSError: Missing file
+        :raises ValueError: Invalid header or unsupported version
+    """
+
+    session_id = read_header(path)["session_id"]
+    arrays = open_session_archive(path)
+
+    def value(v):
+        return None if v != v else v
+
+    for start in range(0, len(arrays["time"]), chunk_size):
+
+        chunk = {column: arrays[column][start:start + chunk_size].tolist() for column in ARCHIVE_COLUMNS}
+
+        for i in range(len(chunk["time"])):
+            yield location.Location(chunk["latitude"][i], chunk["longitude"][i], value(chunk["altitude"][i]), \
+                value(chunk["heading"][i]), value(chunk["climb"][i]), value(chunk["speed"][i]), chunk["mode"][i], \
+                generic.epoch_ms_to_iso(chunk["time"][i]), session_id=session_id, \
+                device_id=None if chunk["device_id"][i] < 0 else chunk["device_id"][i])
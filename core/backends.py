@@ -0,0 +1,538 @@
+from core import location, ring_buffer
+
+from threading import Event
+
+import multiprocessing
+import queue
+import signal
+import time
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Execution backends of the monitor, the recorder and the other workers
+THREAD = "thread"
+PROCESS = "process"
+
+BACKENDS = (THREAD, PROCESS)
+
+# The UTC times (ISO 8601 strings) are copied into fixed-size, NUL-padded fields
+UTC_TIME_SIZE = 32
+
+# The columns of a shared-memory slot: the location batch columns and their item sizes, in bytes
+SLOT_COLUMNS = tuple((column, UTC_TIME_SIZE if column == "utc_time" else getattr(location.LocationBatch(), column).itemsize) \
+                     for column in location.LocationBatch.__slots__)
+
+# Time between two checks of the stop event of a worker process, in seconds
+STOP_POLL_INTERVAL = 0.5
+
+
+class SharedBatchQueue():
+
+    """ A bounded queue of location batches between processes. The batches are copied,
+        column by column, into fixed-size slots of a shared-memory buffer; only the slot
+        indices are exchanged, through a FIFO in shared memory (no pickling of the
+        locations). The producers append to the open slot, which is published as soon as
+        the consumer has nothing left to read or the slot is full, so that the small
+        batches of a live receiver are coalesced when the consumer falls behind. The
+        consumer copies the slot back into a location batch and frees it. When no slot is
+        free, the overflow policy applies as in the ring buffer ('spill' is not supported
+        and blocks). The queue has the interface of the ring buffer used by the monitor
+        and the recorder and supports a single consumer.
+
+        :param slots: the number of slots
+        :param slot_size: the maximum number of locations per slot
+        :param capacity: the maximum number of buffered locations
+        :param overflow_policy: the overflow policy, 'block', 'drop_oldest' or 'drop_newest'
+        :param buffer: the shared-memory buffer
+        :param lock: the condition protecting the shared state below
+        :param free_slots: the stack of the free slot indices (free_count entries)
+        :param published: the FIFO of the published slots (index and number of locations),
+                          published_count entries from published_head
+        :param open_index: the index of the open slot (-1 if none)
+        :param open_count: the number of locations of the open slot
+        :param size: the number of buffered locations
+        :param dropped: the number of dropped locations
+        :param high_water: the highest number of buffered locations
+        :param pending: a slot dequeued but not consumed yet (consumer side)
+    """
+
+    def __init__(self, slots=64, slot_size=1000, overflow_policy=ring_buffer.BLOCK):
+
+        """ Initializes the shared queue. It must be created before the processes are started.
+
+            :param slots: the number of slots (default: 64)
+            :param slot_size: the maximum number of locations per slot (default: 1000)
+            :param overflow_policy: 'block', 'drop_oldest' or 'drop_newest' (default: 'block')
+            :raises ValueError: Unknown overflow policy
+        """
+
+        if overflow_policy not in ring_buffer.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        if overflow_policy == ring_buffer.SPILL:
+            logger.warning(f"The shared queue does not spill, the producers wait for a free slot")
+            overflow_policy = ring_buffer.BLOCK
+
+        self.slots = max(1, slots)
+        self.slot_size = max(1, slot_size)
+        self.capacity = self.slots * self.slot_size
+        self.overflow_policy = overflow_policy
+
+        # Offset of every column within a slot
+        self.offsets = {}
+        offset = 0
+        for column, itemsize in SLOT_COLUMNS:
+            self.offsets[column] = offset
+            offset += self.slot_size * itemsize
+        self.slot_bytes = offset
+
+        self.buffer = multiprocessing.RawArray('b', self.slots * self.slot_bytes)
+
+        self.lock = multiprocessing.Condition()
+
+        self.free_slots = multiprocessing.RawArray('q', range(self.slots))
+        self.free_count = multiprocessing.RawValue('q', self.slots)
+
+        self.published = multiprocessing.RawArray('q', 2 * self.slots)
+        self.published_head = multiprocessing.RawValue('q', 0)
+        self.published_count = multiprocessing.RawValue('q', 0)
+
+        self.open_index = multiprocessing.RawValue('q', -1)
+        self.open_count = multiprocessing.RawValue('q', 0)
+
+        self.size = multiprocessing.RawValue('q', 0)
+        self.dropped = multiprocessing.RawValue('q', 0)
+        self.high_water = multiprocessing.RawValue('q', 0)
+
+        self.pending = None
+
+
+    def put(self, item, block=True, timeout=None):
+
+        """ Puts an item (a location batch or a location object) into the queue
+
+            :param item: the item
+            :param block: a flag indicating if the producer may wait for a free slot ('block' policy)
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :return: True if the item was queued, False if (part of) it was dropped
+        """
+
+        if not isinstance(item, location.LocationBatch):
+            item = location.LocationBatch([item])
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        start = 0
+
+        with self.lock:
+
+            while start < len(item):
+
+                if self.open_index.value < 0:
+                    index = self._take_free_slot(block, deadline)
+
+                    if index is None:
+                        self.dropped.value += len(item) - start
+                        return False
+
+                    self.open_index.value = index
+                    self.open_count.value = 0
+
+                start = self._append(item, start)
+
+        return True
+
+
+    def get(self, block=True, timeout=None):
+
+        """ Removes and returns the oldest slot as a location batch
+
+            :param block: a flag indicating if the consumer may wait for a slot
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :return: the location batch
+            :raises queue.Empty: No slot available before the timeout expired
+        """
+
+        if self.pending is not None:
+            index, count = self.pending
+            self.pending = None
+        else:
+            index, count = self._next_slot(block, timeout)
+
+        return self._read_slot(index, count)
+
+
+    def get_many(self, max_locations, block=True, timeout=None):
+
+        """ Removes and returns the oldest slots, up to max_locations locations
+            (at least one slot is returned, whatever its size)
+
+            :param max_locations: the maximum number of locations to dequeue
+            :param block: a flag indicating if the consumer may wait for a slot
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :return: the list of dequeued location batches
+            :raises queue.Empty: No slot available before the timeout expired
+        """
+
+        items = [self.get(block, timeout)]
+        count = len(items[0])
+
+        while count < max_locations:
+
+            try:
+                self.pending = self._next_slot(block=False)
+            except queue.Empty:
+                break
+
+            if count + self.pending[1] > max_locations:
+                break
+
+            items.append(self.get())
+            count += len(items[-1])
+
+        return items
+
+
+    def qsize(self):
+
+        """ Returns the number of buffered locations """
+
+        return self.size.value
+
+
+    def empty(self):
+
+        """ Checks if the queue is empty (including the open slot) """
+
+        return self.size.value == 0
+
+
+    def stats(self):
+
+        """ Returns the queue counters
+
+            :return: a dictionary holding the counters
+        """
+
+        with self.lock:
+            return {
+                "size": self.size.value,
+                "capacity": self.capacity,
+                "dropped": self.dropped.value,
+                "spilled": 0,
+                "high_water": self.high_water.value
+            }
+
+
+    def close(self):
+
+        """Nothing to release: the shared memory is freed with the last process using it"""
+
+        pass
+
+
+    def _append(self, item, start):
+
+        """ Copies locations of an item into the open slot and publishes the slot if it is
+            full or if the consumer has nothing left to read (the lock must be held)
+
+            :param item: the location batch
+            :param start: the index of the first location to copy
+            :return: the index of the first location left
+        """
+
+        view = memoryview(self.buffer).cast('B')
+        index = self.open_index.value
+        offset = self.open_count.value
+        count = min(self.slot_size - offset, len(item) - start)
+
+        base = index * self.slot_bytes
+        for column, itemsize in SLOT_COLUMNS:
+            if column == "utc_time":
+                data = b''.join(t.encode('ascii', 'replace')[:UTC_TIME_SIZE].ljust(UTC_TIME_SIZE, b'\0') \
+                                for t in item.utc_time[start:start + count])
+            else:
+                data = memoryview(getattr(item, column))[start:start + count].cast('B')
+            position = base + self.offsets[column] + offset * itemsize
+            view[position:position + len(data)] = data
+
+        self.open_count.value += count
+        self.size.value += count
+        self.high_water.value = max(self.high_water.value, self.size.value)
+
+        if self.open_count.value >= self.slot_size or self.published_count.value == 0:
+            tail = (self.published_head.value + self.published_count.value) % self.slots
+            self.published[2 * tail] = index
+            self.published[2 * tail + 1] = self.open_count.value
+            self.published_count.value += 1
+            self.open_index.value = -1
+            self.open_count.value = 0
+
+        self.lock.notify_all()
+        return start + count
+
+
+    def _take_free_slot(self, block, deadline):
+
+        """ Takes a free slot, applying the overflow policy if none is left (the lock must be held)
+
+            :param block: a flag indicating if the producer may wait for a free slot
+            :param deadline: the time the producer stops waiting (None for no limit)
+            :return: the slot index or None if the new locations are dropped
+        """
+
+        while self.free_count.value == 0:
+
+            if self.overflow_policy == ring_buffer.DROP_NEWEST or not block:
+                return None
+
+            # Reuse the oldest published slot, its locations are dropped
+            if self.overflow_policy == ring_buffer.DROP_OLDEST and self.published_count.value > 0:
+                index, count = self._pop_published()
+                self.size.value -= count
+                self.dropped.value += count
+                return index
+
+            # Wait until the consumer frees a slot
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.lock.wait(remaining)
+
+        self.free_count.value -= 1
+        return self.free_slots[self.free_count.value]
+
+
+    def _pop_published(self):
+
+        """ Removes the oldest published slot (the lock must be held)
+
+            :return: a tuple (slot index, number of locations)
+        """
+
+        head = self.published_head.value
+        self.published_head.value = (head + 1) % self.slots
+        self.published_count.value -= 1
+
+        return self.published[2 * head], self.published[2 * head + 1]
+
+
+    def _next_slot(self, block=True, timeout=None):
+
+        """ Dequeues the oldest published slot. If none is published, the open slot is
+            taken as is, so that its locations do not wait for the next producer.
+
+            :param block: a flag indicating if the consumer may wait for a slot
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :return: a tuple (slot index, number of locations)
+            :raises queue.Empty: No slot available before the timeout expired
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.lock:
+
+            while True:
+
+                if self.published_count.value > 0:
+                    return self._pop_published()
+
+                if self.open_index.value >= 0 and self.open_count.value > 0:
+                    index, count = self.open_index.value, self.open_count.value
+                    self.open_index.value = -1
+                    self.open_count.value = 0
+                    return index, count
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+
+                self.lock.wait(remaining)
+
+
+    def _read_slot(self, index, count):
+
+        """ Copies a slot into a new location batch and frees the slot
+
+            :param index: the slot index
+            :param count: the number of locations of the slot
+            :return: the location batch
+        """
+
+        view = memoryview(self.buffer).cast('B')
+        base = index * self.slot_bytes
+
+        batch = location.LocationBatch()
+        for column, itemsize in SLOT_COLUMNS:
+            start = base + self.offsets[column]
+            if column == "utc_time":
+                data = bytes(view[start:start + count * itemsize])
+                batch.utc_time.extend(data[k:k + itemsize].rstrip(b'\0').decode('ascii') for k in range(0, len(data), itemsize))
+            else:
+                getattr(batch, column).frombytes(view[start:start + count * itemsize])
+
+        with self.lock:
+            self.free_slots[self.free_count.value] = index
+            self.free_count.value += 1
+            self.size.value -= count
+            self.lock.notify_all()
+
+        return batch
+
+
+class WorkerProcess(multiprocessing.Process):
+
+    """ Runs a worker thread (e.g., a monitor or a recorder) in a separate process, with its
+        own interpreter and GIL. The worker is created in the child process; it is stopped
+        and joined there when the stop event is set, so that it drains its queue as usual.
+
+        :param worker_class: the worker class (a thread class with the start and stop methods)
+        :param args: the positional arguments of the worker
+        :param kwargs: the keyword arguments of the worker
+        :param worker_name: the name given to the worker
+        :param stop_event: the event requesting the worker to stop
+    """
+
+    def __init__(self, worker_class, *args, name="", **kwargs):
+
+        """ Initializes the worker process
+
+            :param worker_class: the worker class
+            :param args: the positional arguments of the worker
+            :param name: a name that can be attributed to the process
+            :param kwargs: the keyword arguments of the worker
+        """
+
+        multiprocessing.Process.__init__(self)
+        if name != "":
+            self.name = name
+        self.worker_name = name
+        self.worker_class = worker_class
+        self.args = args
+        self.kwargs = kwargs
+        self.stop_event = multiprocessing.Event()
+
+
+    def run(self):
+
+        """ Runs the worker until the stop event is set or the worker ends """
+
+        # The main process handles the interruptions and stops the workers in order
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        worker = self.worker_class(*self.args, name=self.worker_name, **self.kwargs)
+        worker.start()
+
+        while not self.stop_event.wait(STOP_POLL_INTERVAL):
+            if not worker.is_alive():
+                break
+
+        worker.stop()
+        worker.join()
+
+
+    def stop(self):
+
+        """Requests the worker process to stop"""
+
+        self.stop_event.set()
+
+
+class ThreadBackend():
+
+    """ Runs the workers as threads of the current process (default backend) """
+
+    def make_queue(self, appconfig):
+
+        """ Creates the queue between a monitor and a recorder
+
+            :param appconfig: the application configuration object
+            :return: a ring buffer
+        """
+
+        return ring_buffer.RingBuffer(capacity=appconfig.queue_capacity, overflow_policy=appconfig.queue_overflow_policy, \
+            spill_directory=appconfig.queue_spill_directory)
+
+
+    def make_event(self):
+
+        """ Creates an event shared by the workers """
+
+        return Event()
+
+
+    def start(self, worker_class, *args, name="", **kwargs):
+
+        """ Creates and starts a worker thread
+
+            :param worker_class: the worker class
+            :param args: the positional arguments of the worker
+            :param name: a name that can be attributed to the worker
+            :param kwargs: the keyword arguments of the worker
+            :return: the worker thread (with the stop and join methods)
+        """
+
+        worker = worker_class(*args, name=name, **kwargs)
+        worker.start()
+        return worker
+
+
+class ProcessBackend():
+
+    """ Runs every worker in its own process. The monitors and the recorders exchange the
+        locations through shared-memory slots (see SharedBatchQueue).
+    """
+
+    def make_queue(self, appconfig):
+
+        """ Creates the queue between monitor and recorder processes
+
+            :param appconfig: the application configuration object
+            :return: a shared batch queue
+        """
+
+        return SharedBatchQueue(slots=appconfig.process_slots, slot_size=appconfig.process_slot_size, \
+            overflow_policy=appconfig.queue_overflow_policy)
+
+
+    def make_event(self):
+
+        """ Creates an event shared by the worker processes """
+
+        return multiprocessing.Event()
+
+
+    def start(self, worker_class, *args, name="", **kwargs):
+
+        """ Creates and starts a worker process
+
+            :param worker_class: the worker class
+            :param args: the positional arguments of the worker
+            :param name: a name that can be attributed to the worker
+            :param kwargs: the keyword arguments of the worker
+            :return: the worker process (with the stop and join methods)
+        """
+
+        worker = WorkerProcess(worker_class, *args, name=name, **kwargs)
+        worker.start()
+        return worker
+
+
+def get_backend(name):
+
+    """ Returns the execution backend of the workers
+
+        :param name: the backend name, 'thread' or 'process'
+        :return: the backend object
+        :raises ValueError: Unknown backend
+    """
+
+    if name == THREAD:
+        return ThreadBackend()
+    elif name == PROCESS:
+        return ProcessBackend()
+
+    raise ValueError(f"Unknown execution backend: {name}")
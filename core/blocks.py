@@ -0,0 +1,197 @@
+import struct
+import numpy as np
+
+
+# Version of the block encoding
+BLOCK_VERSION = 1
+
+# Header of an encoded block: version and number of locations
+BLOCK_HEADER = struct.Struct("<BI")
+
+# The encoded columns (see database.ARRAY_COLUMNS) and their scale: the values are stored
+# as integers (e.g., latitudes in 1e-7 degrees, about 1 cm), time in milliseconds
+BLOCK_COLUMNS = (
+    ("time", 1),
+    ("latitude", 10000000),
+    ("longitude", 10000000),
+    ("altitude", 100),
+    ("heading", 100),
+    ("climb", 100),
+    ("speed", 100),
+    ("mode", 1)
+)
+
+# The columns which may hold missing values, encoded with a presence bitmap
+NULLABLE_COLUMNS = ("altitude", "heading", "climb", "speed")
+
+# Maximum number of bytes of a 64-bit varint
+VARINT_MAX_BYTES = 10
+
+
+def zigzag_encode(values):
+
+    """ Maps signed integers to unsigned ones so that small magnitudes get small codes
+        (0, -1, 1, -2... -> 0, 1, 2, 3...)
+
+        :param values: an array of int64
+        :return: an array of uint64
+    """
+
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+
+    """ Reverses zigzag_encode
+
+        :param values: an array of uint64
+        :return: an array of int64
+    """
+
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def varint_encode(values):
+
+    """ Encodes unsigned integers as LEB128 varints (7 bits per byte, the high bit flags
+        a continuation byte), vectorized
+
+        :param values: an array of uint64
+        :return: the encoded bytes
+    """
+
+    values = np.asarray(values, dtype=np.uint64)
+
+    if values.size == 0:
+        return b''
+
+    # Number of bytes of each varint
+    lengths = np.ones(values.size, dtype=np.int64)
+    for k in range(1, VARINT_MAX_BYTES):
+        lengths += values >= (np.uint64(1) << np.uint64(7 * k))
+
+    width = int(lengths.max())
+    shifts = np.arange(width, dtype=np.uint64) * np.uint64(7)
+
+    digits = ((values[:, None] >> shifts[None, :]) & np.uint64(0x7f)).astype(np.uint8)
+    positions = np.arange(width)[None, :]
+
+    # Continuation bit on every byte but the last one of each varint
+    digits |= np.where(positions < (lengths[:, None] - 1), 0x80, 0).astype(np.uint8)
+
+    return digits[positions < lengths[:, None]].tobytes()
+
+
+def varint_decode(data, count):
+
+    """ Decodes count LEB128 varints, vectorized
+
+        :param data: the encoded bytes
+        :param count: the number of varints
+        :return: a tuple (array of uint64, number of bytes read)
+        :raises ValueError: Truncated data
+    """
+
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), 0
+
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero((raw & 0x80) == 0)
+
+    if ends.size < count:
+        raise ValueError("Truncated varint data")
+
+    size = int(ends[count - 1]) + 1
+    raw = raw[:size]
+    ends = ends[:count]
+
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # Position of every byte within its varint
+    index = np.repeat(np.arange(count), ends - starts + 1)
+    shifts = ((np.arange(size) - starts[index]) * 7).astype(np.uint64)
+
+    digits = (raw & 0x7f).astype(np.uint64) << shifts
+    return np.bitwise_or.reduceat(digits, starts), size
+
+
+def encode_block(arrays):
+
+    """ Encodes a run of locations: every column is scaled to integers, delta-encoded,
+        zigzag-encoded and written as varints. The missing values of the nullable
+        columns are recorded in presence bitmaps.
+
+        :param arrays: a dictionary of arrays, by column (see BLOCK_COLUMNS; NaN for missing values)
+        :return: the encoded block
+    """
+
+    count = len(arrays["time"])
+
+    bitmaps = []
+    streams = []
+
+    for column, scale in BLOCK_COLUMNS:
+
+        values = np.asarray(arrays[column], dtype=np.float64)
+
+        if column in NULLABLE_COLUMNS:
+            present = ~np.isnan(values)
+            bitmaps.append(np.packbits(present).tobytes())
+            values = values[present]
+
+        scaled = np.round(values * scale).astype(np.int64)
+        deltas = np.diff(scaled, prepend=np.int64(0))
+        streams.append(varint_encode(zigzag_encode(deltas)))
+
+    return BLOCK_HEADER.pack(BLOCK_VERSION, count) + b''.join(bitmaps) + b''.join(streams)
+
+
+def decode_block(data):
+
+    """ Decodes a block encoded by encode_block
+
+        :param data: the encoded block
+        :return: a dictionary of arrays, by column (int64 time, int8 mode, float64 otherwise, NaN for missing values)
+        :raises ValueError: Unsupported version or truncated block
+    """
+
+    version, count = BLOCK_HEADER.unpack_from(data)
+
+    if version != BLOCK_VERSION:
+        raise ValueError(f"Unsupported block version: {version}")
+
+    offset = BLOCK_HEADER.size
+    bitmap_size = (count + 7) // 8
+
+    presence = {}
+    for column in NULLABLE_COLUMNS:
+        presence[column] = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=bitmap_size, offset=offset), count=count).astype(bool)
+        offset += bitmap_size
+
+    arrays = {}
+    for column, scale in BLOCK_COLUMNS:
+
+        present = presence.get(column)
+        n = count if present is None else int(present.sum())
+
+        codes, size = varint_decode(data[offset:], n)
+        offset += size
+
+        scaled = np.cumsum(zigzag_decode(codes))
+
+        if column == "time":
+            arrays[column] = scaled
+        elif column == "mode":
+            arrays[column] = scaled.astype(np.int8)
+        elif present is None:
+            arrays[column] = scaled / scale
+        else:
+            values = np.full(count, np.nan)
+            values[present] = scaled / scale
+            arrays[column] = values
+
+    return arrays
@@ -1,8 +1,12 @@
 
 from datetime import datetime
-from core import location
+from core import blocks, location
+from helpers import generic, geo
 
+import itertools
+import numpy as np
 import sqlite3
+import math
 import os
 import logging
 
@@ -11,6 +15,88 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# SQLite pragmas applied when a connection opens, by storage profile.
+# The page size only applies to a new database (or after a VACUUM).
+STORAGE_PROFILES = {
+    "durable": {
+        "page_size": 4096,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT"
+    },
+    "balanced": {
+        "page_size": 4096,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 67108864,
+        "temp_store": "MEMORY"
+    },
+    "fast": {
+        "page_size": 8192,
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY"
+    }
+}
+
+# Pragmas that only the writer is allowed to change
+WRITER_PRAGMAS = ("page_size", "journal_mode", "synchronous")
+
+# Time a connection waits for a lock held by another connection, in milliseconds
+BUSY_TIMEOUT = 5000
+
+# The columns of the location datatable
+LOCATION_COLUMNS = ("id", "session_id", "latitude", "longitude", "altitude", "heading", "climb", "speed", "mode", "utc_time", "db_timestamp", \
+                    "device_id")
+
+# The columns used to build the location objects
+LOCATION_OBJECT_COLUMNS = ("latitude", "longitude", "altitude", "heading", "climb", "speed", "mode", "utc_time", "session_id")
+
+# The columns of the telemetry records, in order (the trailing device_id may be omitted)
+RECORD_COLUMNS = ("session_id", "latitude", "longitude", "altitude", "heading", "climb", "speed", "mode", "utc_time", "device_id")
+
+# Number of rows fetched at once when iterating over the location data
+FETCH_CHUNK_SIZE = 1000
+
+# The columns loaded as NumPy arrays: SQL expression and array type (little-endian).
+# The UTC time is converted to a UNIX timestamp in milliseconds.
+ARRAY_COLUMNS = {
+    "time": ("CAST(ROUND((julianday(utc_time) - 2440587.5) * 86400000) AS INTEGER)", "<i8"),
+    "latitude": ("latitude", "<f8"),
+    "longitude": ("longitude", "<f8"),
+    "altitude": ("altitude", "<f8"),
+    "heading": ("heading", "<f8"),
+    "climb": ("climb", "<f8"),
+    "speed": ("speed", "<f8"),
+    "mode": ("mode", "i1"),
+    "device_id": ("device_id", "<i8")
+}
+
+# Storage layouts: one row per location or blocks of encoded locations
+ROWS = "rows"
+BLOCKS = "blocks"
+
+STORAGE_LAYOUTS = (ROWS, BLOCKS)
+
+# Maximum number of locations per block
+BLOCK_SIZE = 1000
+
+# The resolutions of the rollup datatables, in seconds
+ROLLUP_RESOLUTIONS = (1, 10, 60)
+
+# Maximum number of location identifiers added to the spatial index per transaction
+SPATIAL_INDEX_CHUNK_SIZE = 50000
+
+# The columns of the session summary datatable
+SUMMARY_COLUMNS = ("session_id", "point_count", "first_time", "last_time", "min_latitude", "min_longitude", "max_latitude", \
+                   "max_longitude", "distance", "max_speed", "last_latitude", "last_longitude")
+
+
 # Initializes the database connection
 def check_connection(db_filename, db_path=""):
     """ Checks if it is possible to establish a connection to the SQLite database
@@ -66,21 +152,31 @@ def check_if_datatable_exists(connection_handler, table_name):
 
 
 # Open a new connection handler to the database
-def connect(db_filename, db_path=""):
+def connect(db_filename, db_path="", storage_profile=None, read_only=False):
 
     """ Creates a database connection handler to the SQLite database
         specified by the db_filename parameter
 
         :param db_filename: database filename
         :param db_path: the path to the database file
+        :param storage_profile: the name of a storage profile ('durable', 'balanced' or 'fast')
+                                or a dictionary of pragmas, None to keep the SQLite defaults
+        :param read_only: a flag indicating if the connection is a read-only (reader) connection
         :return: a connection object or None
     """
 
     try:
         db_name = os.path.join(db_path, db_filename)
-        connection_handler = sqlite3.connect(db_name)
+
+        if read_only:
+            connection_handler = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, timeout=BUSY_TIMEOUT/1000)
+        else:
+            connection_handler = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT/1000)
         connection_handler.text_factory = sqlite3.OptimizedUnicode
 
+        if storage_profile is not None:
+            apply_storage_profile(connection_handler, storage_profile, read_only=read_only)
+
         return connection_handler
 
     except sqlite3.Error as e:
@@ -88,6 +184,49 @@ def connect(db_filename, db_path=""):
         return None
 
 
+def connect_reader(db_filename, db_path="", storage_profile=None):
+
+    """ Creates a read-only connection handler to the SQLite database. In WAL mode, readers
+        using their own connections neither block the recorder nor are blocked by it.
+
+        :param db_filename: database filename
+        :param db_path: the path to the database file
+        :param storage_profile: the name of a storage profile or a dictionary of pragmas
+        :return: a connection object or None
+    """
+
+    return connect(db_filename, db_path=db_path, storage_profile=storage_profile, read_only=True)
+
+
+def apply_storage_profile(connection_handler, storage_profile, read_only=False):
+
+    """ Applies the pragmas of a storage profile to a database connection
+
+        :param connection_handler: the connection handler object
+        :param storage_profile: the name of a storage profile or a dictionary of pragmas
+        :param read_only: a flag indicating if the writer-only pragmas should be skipped
+        :return: 0 if success, -1 if the profile is unknown
+    """
+
+    if isinstance(storage_profile, dict):
+        pragmas = storage_profile
+    elif storage_profile in STORAGE_PROFILES:
+        pragmas = STORAGE_PROFILES[storage_profile]
+    else:
+        logger.error(f"Unknown storage profile: {storage_profile}")
+        return -1
+
+    cursor = connection_handler.cursor()
+
+    for pragma, value in pragmas.items():
+        if read_only and pragma in WRITER_PRAGMAS:
+            continue
+        cursor.execute(f"PRAGMA {pragma}={value};")
+
+    cursor.close()
+    return 0
+
+
 # Closes the ongoing database connection if still alive
 def disconnect(connection_handler):
 
@@ -127,8 +266,8 @@ def create_location_table(connection_handler, location_table_name="location", se
                     altitude FLOAT DEFAULT NULL,
                     heading FLOAT DEFAULT NULL,
                     climb FLOAT DEFAULT NULL,
-                    speed INTEGER DEFAULT NULL,
-                    mode NTEGER DEFAULT 0,
+                    speed FLOAT DEFAULT NULL,
+                    mode INTEGER DEFAULT 0,
                     utc_time DATETIME DEFAULT NULL,                    
                     db_timestamp DATETIME DEFAULT (DATETIME(CURRENT_TIMESTAMP)),
                     FOREIGN KEY(session_id) REFERENCES {session_table_name}(id)
@@ -175,6 +314,331 @@ def create_session_table(connection_handler, session_table_name="session"):
         return -2
 
 
+def create_tables(connection_handler, session_table_name="session", location_table_name="location"):
+
+    """ Creates the session and location datatables if they do not already exist
+
+        :param connection_handler: the connection handler object
+        :param session_table_name: the session datatable name (default: session)
+        :param location_table_name: the location datatable name (default: location)
+        :return: 0 if success, -1 if the connection handler is None and -2 if exception arises
+    """
+
+    if connection_handler is None:
+        return -1
+
+    # session table
+    if not check_if_datatable_exists(connection_handler=connection_handler, table_name=session_table_name):
+
+        # create the session datatable structure
+        if create_session_table(connection_handler=connection_handler, session_table_name=session_table_name) != 0:
+            return -2
+
+    # location table
+    if not check_if_datatable_exists(connection_handler=connection_handler, table_name=location_table_name):
+
+        # create the location datatable structure
+        if create_location_table(connection_handler=connection_handler, location_table_name=location_table_name, session_table_name=session_table_name) != 0:
+            return -2
+
+    return 0
+
+
+def get_schema_version(connection_handler):
+
+    """ Returns the schema version of the database, stored in the user_version pragma
+
+        :param connection_handler: the connection handler object
+        :return: the schema version
+    """
+
+    return connection_handler.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def migrate_location_columns(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 1: fixes the declared types of the speed and mode columns of the location
+        datatable and replaces the 'NULL' strings stored by older versions with real NULL values.
+        The datatable is rebuilt only if its declared column types are wrong.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    cursor = connection_handler.cursor()
+
+    columns = {row[1]: row[2].upper() for row in cursor.execute(f"PRAGMA table_info({location_table_name});")}
+
+    if columns.get("speed") != "FLOAT" or columns.get("mode") != "INTEGER":
+
+        logger.info(f"Rebuilding the {location_table_name} datatable (This may take a while)")
+
+        cursor.execute(f"ALTER TABLE {location_table_name} RENAME TO {location_table_name}_v0;")
+        create_location_table(connection_handler, location_table_name=location_table_name, session_table_name=session_table_name)
+
+        cursor.execute(f"""
+                INSERT INTO {location_table_name}
+                    (id, session_id, latitude, longitude, altitude, heading, climb, speed, mode, utc_time, db_timestamp)
+                SELECT id, session_id, latitude, longitude, NULLIF(altitude, 'NULL'), heading, NULLIF(climb, 'NULL'),
+                       CAST(speed AS FLOAT), CAST(mode AS INTEGER), utc_time, db_timestamp
+                FROM {location_table_name}_v0;
+               """)
+        cursor.execute(f"DROP TABLE {location_table_name}_v0;")
+
+    else:
+        cursor.execute(f"UPDATE {location_table_name} SET altitude = NULL WHERE altitude = 'NULL';")
+        cursor.execute(f"UPDATE {location_table_name} SET climb = NULL WHERE climb = 'NULL';")
+
+    cursor.close()
+
+
+def migrate_location_indexes(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 2: indexes the location datatable by session and time
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    cursor = connection_handler.cursor()
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{location_table_name}_session_time ON {location_table_name}(session_id, utc_time);")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{location_table_name}_utc_time ON {location_table_name}(utc_time);")
+    cursor.close()
+
+
+def migrate_session_summary(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 3: creates the session summary datatable and fills it from the
+        locations already stored
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    create_summary_table(connection_handler, session_table_name=session_table_name)
+
+    cursor = connection_handler.cursor()
+    cursor.execute(f"DELETE FROM {get_summary_table_name(session_table_name)};")
+    cursor.execute(f"DELETE FROM {get_summary_device_table_name(session_table_name)};")
+    cursor.close()
+
+    for session_id in list_session_ids(connection_handler, location_table_name):
+        rebuild_session_summary(connection_handler, session_id, location_table_name=location_table_name, \
+            session_table_name=session_table_name)
+
+
+def migrate_spatial_index(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 4: creates the R*Tree spatial index of the location datatable, fills it
+        from the locations already stored and creates the triggers keeping it up to date.
+        If the SQLite library is built without the R*Tree module, the index is not created
+        and the spatial queries are unavailable.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    rtree_table_name = get_rtree_table_name(location_table_name)
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {rtree_table_name}
+                          USING rtree(id, min_latitude, max_latitude, min_longitude, max_longitude);""")
+    except sqlite3.OperationalError as error:
+        logger.warning(f"Spatial index not created: {str(error)}")
+        cursor.close()
+        return
+
+    cursor.execute(f"""INSERT OR REPLACE INTO {rtree_table_name}
+                      SELECT id, latitude, latitude, longitude, longitude FROM {location_table_name}
+                      WHERE latitude IS NOT NULL AND longitude IS NOT NULL;""")
+
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {rtree_table_name}_insert AFTER INSERT ON {location_table_name}
+                      WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+                      BEGIN
+                          INSERT OR REPLACE INTO {rtree_table_name} VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+                      END;""")
+
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {rtree_table_name}_update AFTER UPDATE OF latitude, longitude ON {location_table_name}
+                      BEGIN
+                          DELETE FROM {rtree_table_name} WHERE id = OLD.id;
+                          INSERT INTO {rtree_table_name}
+                              SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+                              WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+                      END;""")
+
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {rtree_table_name}_delete AFTER DELETE ON {location_table_name}
+                      BEGIN
+                          DELETE FROM {rtree_table_name} WHERE id = OLD.id;
+                      END;""")
+
+    cursor.close()
+
+
+def migrate_rollup_tables(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 5: creates the rollup datatables and their watermarks. The rollups
+        are filled by the downsampler.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    create_rollup_tables(connection_handler, location_table_name=location_table_name)
+
+
+def migrate_block_table(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 6: creates the datatable of the location blocks ('blocks' storage layout)
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    block_table_name = get_block_table_name(location_table_name)
+
+    cursor = connection_handler.cursor()
+    cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {block_table_name} (
+                id INTEGER PRIMARY KEY,
+                session_id INTEGER NOT NULL,
+                point_count INTEGER NOT NULL,
+                first_time DATETIME DEFAULT NULL,
+                last_time DATETIME DEFAULT NULL,
+                min_latitude FLOAT DEFAULT NULL,
+                min_longitude FLOAT DEFAULT NULL,
+                max_latitude FLOAT DEFAULT NULL,
+                max_longitude FLOAT DEFAULT NULL,
+                data BLOB NOT NULL,
+                FOREIGN KEY(session_id) REFERENCES {session_table_name}(id)
+            );
+           """)
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{block_table_name}_session_time ON {block_table_name}(session_id, first_time);")
+    cursor.close()
+
+
+def migrate_device_columns(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 7: adds the identifier of the reporting device (receiver) to the
+        location and block datatables
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    cursor = connection_handler.cursor()
+
+    for table_name in (location_table_name, get_block_table_name(location_table_name)):
+
+        existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name});")]
+
+        if "device_id" not in existing:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN device_id INTEGER DEFAULT NULL;")
+
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{location_table_name}_device_time ON {location_table_name}(device_id, utc_time);")
+    cursor.close()
+
+
+def migrate_spatial_index_batches(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 8: drops the trigger adding every inserted location to the spatial index,
+        which slowed the inserts down about 3 times. The index is now updated in batches by
+        update_spatial_index up to a watermark (the identifier of the last location indexed);
+        the spatial queries scan the locations stored after it.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    rtree_table_name = get_rtree_table_name(location_table_name)
+
+    # No spatial index (SQLite built without the R*Tree module)
+    if not check_if_datatable_exists(connection_handler, rtree_table_name):
+        return
+
+    cursor = connection_handler.cursor()
+    cursor.execute(f"DROP TRIGGER IF EXISTS {rtree_table_name}_insert;")
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {rtree_table_name}_state (watermark INTEGER NOT NULL);")
+
+    # Every location stored so far was indexed by the trigger
+    cursor.execute(f"DELETE FROM {rtree_table_name}_state;")
+    cursor.execute(f"INSERT INTO {rtree_table_name}_state SELECT COALESCE(MAX(id), 0) FROM {location_table_name};")
+    cursor.close()
+
+
+def migrate_summary_devices(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Schema version 9: creates the datatable of the last position of every device of a
+        session and rebuilds the session summaries, whose distance was computed across the
+        interleaved locations of the devices
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+    """
+
+    migrate_session_summary(connection_handler, location_table_name=location_table_name, session_table_name=session_table_name)
+
+
+# Schema migrations, by target schema version (PRAGMA user_version)
+MIGRATIONS = [
+    (1, migrate_location_columns),
+    (2, migrate_location_indexes),
+    (3, migrate_session_summary),
+    (4, migrate_spatial_index),
+    (5, migrate_rollup_tables),
+    (6, migrate_block_table),
+    (7, migrate_device_columns),
+    (8, migrate_spatial_index_batches),
+    (9, migrate_summary_devices)
+]
+
+
+def migrate(connection_handler, location_table_name="location", session_table_name="session"):
+
+    """ Upgrades the database schema in place by applying the pending migrations in order.
+        Each migration runs in its own transaction together with the schema version update.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+        :return: the resulting schema version or -1 if a migration fails
+    """
+
+    try:
+        version = get_schema_version(connection_handler)
+
+        for target, migration in MIGRATIONS:
+
+            if target <= version:
+                continue
+
+            logger.info(f"Migrating the database schema to version {target}")
+
+            connection_handler.execute("BEGIN;")
+            migration(connection_handler, location_table_name=location_table_name, session_table_name=session_table_name)
+            connection_handler.execute(f"PRAGMA user_version = {target};")
+            connection_handler.commit()
+
+            version = target
+
+        return version
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
+        return -1
+
+
 def get_newest_session_id(connection_handler, session_tablename="session"):
 
     """
@@ -227,75 +691,1144 @@ def create_new_session(connection_handler, session_tablename="session"):
         return -1
 
 
-def insert_location_data(connection_handler, data, location_table_name="location"):
+def insert_location_data(connection_handler, data, location_table_name="location", method="executemany", session_table_name=None):
 
     """ Query the database to insert a list of location records into the location the database
 
         :param connection_handler: the connection handler object
-        :param data: the list of telemetry records
+        :param data: the list of telemetry records (see RECORD_COLUMNS)
         :param table_name: the data table name
+        :param method: the insertion method, either 'executemany' (prepared and parameterized
+                       statement) or 'concat' (single statement built by concatenation)
+        :param session_table_name: the session datatable name; if set, the session summaries
+                                   are updated in the same transaction (default: None)
         :return: count of inserted records or -1 if exception arises
     """
 
     try:
         cursor = connection_handler.cursor()
 
-        sqlite_insert_query = f"""INSERT INTO `{location_table_name}`
-                                ('session_id', 'latitude', 'longitude', 'altitude', 'heading', 'climb', 'speed', 'mode', 'utc_time') 
-                                VALUES """
+        if method == "concat":
+            cursor.execute(build_location_insert_query(data, location_table_name))
+        else:
+            columns = RECORD_COLUMNS[:len(data[0])] if data else RECORD_COLUMNS
+
+            sqlite_insert_query = f"""INSERT INTO `{location_table_name}`
+                                    ({', '.join(columns)})
+                                    VALUES ({', '.join('?' * len(columns))})"""
 
-        # condition_if_true if condition else condition_if_false
-        for i in range(len(data)):
-            item = data[i]
+            cursor.executemany(sqlite_insert_query, data)
 
-            insert = f"({item[0]}, {item[1]}, {item[2]}, {item[3]}, {item[4]}, {item[5]}, '{item[6]}', '{item[7]}', '{item[8]}')"
-            sqlite_insert_query = f"{sqlite_insert_query}{insert}"
+        count = cursor.rowcount
 
-            if i == len(data)-1:
-                sqlite_insert_query = f"{sqlite_insert_query};"
-            else:
-                sqlite_insert_query = f"{sqlite_insert_query},"
+        if session_table_name is not None:
+            update_session_summary(connection_handler, data, session_table_name=session_table_name)
 
-        count = cursor.execute(sqlite_insert_query)
         connection_handler.commit()
         cursor.close()
 
-        logger.debug(f"Data rows inserted: {cursor.rowcount}")
+        logger.debug(f"Data rows inserted: {count}")
         return count
 
     except sqlite3.Error as error:
         logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
         return -1
 
 
-def retrieve_data(connection_handler, session_id=-1):
+def build_location_insert_query(data, location_table_name="location"):
 
-    """ Retrieves the location data stored in the database
+    """ Builds a single insertion query holding all the location records, with the values
+        concatenated into the SQL text. This is the legacy insertion path, kept for comparison.
+
+        :param data: the list of telemetry records
+        :param location_table_name: the location datatable name
+        :return: the SQL query
+    """
+
+    def literal(value):
+        return 'NULL' if value is None else value
+
+    columns = RECORD_COLUMNS[:len(data[0])] if data else RECORD_COLUMNS
+
+    values = []
+    for item in data:
+        device_id = f", {literal(item[9])}" if len(item) > 9 else ""
+        values.append(f"({item[0]}, {literal(item[1])}, {literal(item[2])}, {literal(item[3])}, {literal(item[4])}, " \
+                      f"{literal(item[5])}, '{item[6]}', '{item[7]}', '{item[8]}'{device_id})")
+
+    return f"""INSERT INTO `{location_table_name}`
+                ({', '.join(f"'{column}'" for column in columns)})
+                VALUES {','.join(values)};"""
+
+
+def get_block_table_name(location_table_name="location"):
+
+    """ Returns the name of the location block datatable
+
+        :param location_table_name: the location datatable name
+        :return: the block datatable name
+    """
+
+    return f"{location_table_name}_blocks"
+
+
+def write_block(cursor, block_table_name, session_id, arrays, block_id=None, device_id=None):
+
+    """ Encodes a run of locations and stores it as a block, with the header used for pruning
+
+        :param cursor: the database cursor
+        :param block_table_name: the block datatable name
+        :param session_id: the session identifier
+        :param arrays: a dictionary of arrays, by column (see blocks.BLOCK_COLUMNS)
+        :param block_id: the identifier of the block to replace (default: None, a new block)
+        :param device_id: the identifier of the device which reported the locations (default: None)
+    """
+
+    header = (session_id, device_id, len(arrays["time"]), generic.epoch_ms_to_iso(int(arrays["time"].min())), \
+              generic.epoch_ms_to_iso(int(arrays["time"].max())), float(arrays["latitude"].min()), float(arrays["longitude"].min()), \
+              float(arrays["latitude"].max()), float(arrays["longitude"].max()), blocks.encode_block(arrays))
+
+    if block_id is None:
+        cursor.execute(f"""INSERT INTO {block_table_name} (session_id, device_id, point_count, first_time, last_time, min_latitude,
+                                                             min_longitude, max_latitude, max_longitude, data)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);""", header)
+    else:
+        cursor.execute(f"""UPDATE {block_table_name} SET session_id = ?, device_id = ?, point_count = ?, first_time = ?, last_time = ?, min_latitude = ?,
+                                  min_longitude = ?, max_latitude = ?, max_longitude = ?, data = ?
+                           WHERE id = ?;""", header + (block_id,))
+
+
+def insert_location_blocks(connection_handler, data, location_table_name="location", session_table_name=None, block_size=BLOCK_SIZE):
+
+    """ Inserts a list of location records as encoded blocks ('blocks' storage layout). The
+        records extend the last block of their session and device until it holds block_size
+        locations, then new blocks are created.
 
         :param connection_handler: the connection handler object
-        :param session_id: the identifier of the related session
-        :return: A list of location objects and None if an exception arises
+        :param data: the list of telemetry records (see insert_location_data)
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name; if set, the session summaries
+                                   are updated in the same transaction (default: None)
+        :param block_size: the maximum number of locations per block
+        :return: count of inserted records or -1 if exception arises
     """
 
-    try:
+    block_table_name = get_block_table_name(location_table_name)
 
-        # Check the list of tables
+    # Group the records by session and device, ignoring the records without position
+    sessions = {}
+    for item in data:
+        if item[1] is not None and item[2] is not None:
+            sessions.setdefault((item[0], item[9] if len(item) > 9 else None), []).append(item)
+
+    try:
         cursor = connection_handler.cursor()
-        if session_id == -1:
-            cursor.execute(f"SELECT * FROM location;")
-        else:
-            cursor.execute(f"SELECT * FROM location WHERE session_id={session_id};")
+        count = 0
+
+        for (session_id, device_id), items in sessions.items():
+
+            arrays = {
+                "time": np.array([generic.iso_to_epoch_ms(item[8] or '') for item in items], dtype=np.int64),
+                "latitude": np.array([item[1] for item in items], dtype=np.float64),
+                "longitude": np.array([item[2] for item in items], dtype=np.float64),
+                "altitude": np.array([item[3] for item in items], dtype=np.float64),
+                "heading": np.array([item[4] for item in items], dtype=np.float64),
+                "climb": np.array([item[5] for item in items], dtype=np.float64),
+                "speed": np.array([item[6] for item in items], dtype=np.float64),
+                "mode": np.array([item[7] or 0 for item in items], dtype=np.int8)
+            }
+
+            # Extend the last block of the session and device if it is not full
+            cursor.execute(f"""SELECT id, point_count, data FROM {block_table_name} WHERE session_id = ? AND device_id IS ?
+                               ORDER BY id DESC LIMIT 1;""", (session_id, device_id))
+            tail = cursor.fetchone()
+
+            start = 0
+            if tail is not None and tail[1] < block_size:
+                start = min(len(items), block_size - tail[1])
+                merged = {column: np.concatenate((values, arrays[column][:start])) for column, values in blocks.decode_block(tail[2]).items()}
+                write_block(cursor, block_table_name, session_id, merged, block_id=tail[0], device_id=device_id)
+
+            for i in range(start, len(items), block_size):
+                write_block(cursor, block_table_name, session_id, {column: values[i:i + block_size] for column, values in arrays.items()}, \
+                    device_id=device_id)
 
-        rows = cursor.fetchall()
+            count += len(items)
 
+        if session_table_name is not None:
+            update_session_summary(connection_handler, data, session_table_name=session_table_name)
+
+        connection_handler.commit()
         cursor.close()
 
-        data=[]
-        for row in rows:
-            loc = location.Location(row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9])
-            data.append(loc)
-        
-        return data
+        logger.debug(f"Data rows inserted as blocks: {count}")
+        return count
+
+    except (sqlite3.Error, TypeError, ValueError) as error:
+        logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
+        return -1
+
+
+def has_blocks(connection_handler, location_table_name="location"):
+
+    """ Checks if locations are stored as blocks
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :return: True if the block datatable exists and is not empty
+    """
+
+    try:
+        return connection_handler.execute(f"SELECT 1 FROM {get_block_table_name(location_table_name)} LIMIT 1;").fetchone() is not None
+
+    except sqlite3.OperationalError:
+        return False
+
+
+def list_session_ids(connection_handler, location_table_name="location"):
+
+    """ Returns the identifiers of the sessions holding locations, stored as rows or as blocks
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :return: the sorted list of session identifiers
+        :raises sqlite3.Error: Database error
+    """
+
+    session_ids = {row[0] for row in connection_handler.execute(f"SELECT DISTINCT session_id FROM {location_table_name};")}
+
+    if has_blocks(connection_handler, location_table_name):
+        session_ids.update(row[0] for row in connection_handler.execute(f"SELECT DISTINCT session_id FROM {get_block_table_name(location_table_name)};"))
+
+    return sorted(session_ids)
+
+
+def iter_block_arrays(connection_handler, session_id=-1, start_time=None, end_time=None, bbox=None, location_table_name="location", \
+                      device_id=None):
+
+    """ Iterates over the decoded location blocks matching the filters. The blocks are
+        pruned by their header, then their locations are filtered exactly. Like the rows,
+        the locations are returned whatever their mode.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param location_table_name: the location datatable name
+        :param device_id: the identifier of the reporting device (default: None, all devices)
+        :return: a generator of tuples (session identifier, device identifier, dictionary of arrays by column)
+        :raises sqlite3.Error: Database error
+    """
+
+    conditions = []
+    parameters = []
+
+    if session_id != -1:
+        conditions.append("session_id = ?")
+        parameters.append(session_id)
+
+    if device_id is not None:
+        conditions.append("device_id = ?")
+        parameters.append(device_id)
+
+    if start_time is not None:
+        conditions.append("last_time >= ?")
+        parameters.append(start_time)
+
+    if end_time is not None:
+        conditions.append("first_time < ?")
+        parameters.append(end_time)
+
+    if bbox is not None:
+        condition, condition_parameters = build_bbox_condition(bbox, "min_latitude", "max_latitude", "min_longitude", "max_longitude")
+        conditions.append(condition)
+        parameters.extend(condition_parameters)
+
+    sql = f"SELECT session_id, device_id, data FROM {get_block_table_name(location_table_name)}"
+
+    if conditions:
+        sql = f"{sql} WHERE {' AND '.join(conditions)}"
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(f"{sql} ORDER BY session_id, first_time, id;", parameters)
+
+        for block_session_id, block_device_id, data in cursor:
+
+            arrays = blocks.decode_block(data)
+
+            mask = np.ones(len(arrays["time"]), dtype=bool)
+            if start_time is not None:
+                mask &= arrays["time"] >= generic.iso_to_epoch_ms(start_time)
+            if end_time is not None:
+                mask &= arrays["time"] < generic.iso_to_epoch_ms(end_time)
+            if bbox is not None:
+                within = np.zeros(len(arrays["time"]), dtype=bool)
+                for part in split_bbox(bbox):
+                    within |= (arrays["latitude"] >= part[0]) & (arrays["latitude"] <= part[2]) & \
+                              (arrays["longitude"] >= part[1]) & (arrays["longitude"] <= part[3])
+                mask &= within
+
+            if not mask.all():
+                arrays = {column: values[mask] for column, values in arrays.items()}
+
+            if len(arrays["time"]) > 0:
+                yield block_session_id, block_device_id, arrays
+
+    finally:
+        cursor.close()
+
+
+def iter_block_locations(connection_handler, session_id=-1, start_time=None, end_time=None, bbox=None, columns=None, \
+                         location_table_name="location", device_id=None):
+
+    """ Iterates over the locations stored as blocks, like iter_locations (the id and
+        db_timestamp columns are not stored in blocks, their values are None)
+
+        :param connection_handler: the connection handler object
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param columns: the selected columns; if None, location objects are yielded
+        :param location_table_name: the location datatable name
+        :param device_id: the identifier of the reporting device (default: None, all devices)
+        :return: a generator of location objects or tuples
+        :raises sqlite3.Error: Database error
+    """
+
+    if not has_blocks(connection_handler, location_table_name):
+        return
+
+    selected = LOCATION_OBJECT_COLUMNS if columns is None else columns
+
+    for block_session_id, block_device_id, arrays in iter_block_arrays(connection_handler, session_id=session_id, start_time=start_time, \
+            end_time=end_time, bbox=bbox, location_table_name=location_table_name, device_id=device_id):
+
+        count = len(arrays["time"])
+        values = {
+            "id": [None] * count,
+            "db_timestamp": [None] * count,
+            "session_id": [block_session_id] * count,
+            "device_id": [block_device_id] * count,
+            "utc_time": [generic.epoch_ms_to_iso(t) for t in arrays["time"].tolist()]
+        }
+
+        for column in ("latitude", "longitude", "altitude", "heading", "climb", "speed", "mode"):
+            values[column] = [None if v != v else v for v in arrays[column].tolist()]
+
+        rows = zip(*(values[column] for column in selected))
+
+        if columns is None:
+            for row in rows:
+                yield location.Location(*row)
+        else:
+            yield from rows
+
+
+def build_location_query(session_id=-1, start_time=None, end_time=None, bbox=None, columns=None, limit=None, offset=None, \
+                         location_table_name="location", spatial_index=False, device_id=None, min_id=None, min_mode=None):
+
+    """ Builds the parameterized query selecting location records
+
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param columns: the selected columns (default: the location object columns)
+        :param limit: the maximum number of records
+        :param offset: the number of records to skip
+        :param location_table_name: the location datatable name
+        :param spatial_index: a flag indicating if the bounding box is looked up in the R*Tree spatial index
+        :param device_id: the identifier of the reporting device (default: None, all devices)
+        :param min_id: the location identifier above which the records are selected (default: None, all)
+        :param min_mode: the minimum mode of the selected records (default: None, all)
+        :return: a tuple (SQL query, parameters)
+        :raises ValueError: Unknown column
+    """
+
+    if columns is None:
+        columns = LOCATION_OBJECT_COLUMNS
+
+    for column in columns:
+        if column not in LOCATION_COLUMNS:
+            raise ValueError(f"Unknown column: {column}")
+
+    conditions = []
+    parameters = []
+
+    if session_id != -1:
+        conditions.append("session_id = ?")
+        parameters.append(session_id)
+
+    if device_id is not None:
+        conditions.append("device_id = ?")
+        parameters.append(device_id)
+
+    if min_id is not None:
+        conditions.append("id > ?")
+        parameters.append(min_id)
+
+    if min_mode is not None:
+        conditions.append("mode >= ?")
+        parameters.append(min_mode)
+
+    if start_time is not None:
+        conditions.append("utc_time >= ?")
+        parameters.append(start_time)
+
+    if end_time is not None:
+        conditions.append("utc_time < ?")
+        parameters.append(end_time)
+
+    if bbox is not None:
+
+        # The R*Tree stores rounded coordinates, its candidates are checked against the exact ones.
+        # The locations stored after its watermark are not indexed yet.
+        if spatial_index:
+            rtree_table_name = get_rtree_table_name(location_table_name)
+            condition, condition_parameters = build_bbox_condition(bbox, "min_latitude", "max_latitude", "min_longitude", "max_longitude")
+            conditions.append(f"id IN (SELECT id FROM {rtree_table_name} WHERE {condition} " \
+                              f"UNION ALL SELECT id FROM {location_table_name} WHERE id > (SELECT watermark FROM {rtree_table_name}_state))")
+            parameters.extend(condition_parameters)
+
+        condition, condition_parameters = build_bbox_condition(bbox)
+        conditions.append(condition)
+        parameters.extend(condition_parameters)
+
+    sql = f"SELECT {', '.join(columns)} FROM {location_table_name}"
+
+    if conditions:
+        sql = f"{sql} WHERE {' AND '.join(conditions)}"
+
+    sql = f"{sql} ORDER BY session_id, utc_time, id"
+
+    if limit is not None or offset is not None:
+        sql = f"{sql} LIMIT ? OFFSET ?"
+        parameters.extend([-1 if limit is None else limit, 0 if offset is None else offset])
+
+    return sql, parameters
+
+
+def iter_locations(connection_handler, session_id=-1, start_time=None, end_time=None, bbox=None, columns=None, limit=None, offset=None, \
+                   location_table_name="location", chunk_size=FETCH_CHUNK_SIZE, spatial_index=False, device_id=None):
+
+    """ Iterates over the location data stored in the database. The rows are fetched in chunks,
+        so that the memory usage does not depend on the number of retrieved records.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param columns: the selected columns; if None, location objects are yielded,
+                        otherwise tuples of the selected column values
+        :param limit: the maximum number of records
+        :param offset: the number of records to skip
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :param spatial_index: a flag indicating if the bounding box is looked up in the R*Tree spatial index
+        :param device_id: the identifier of the reporting device (default: None, all devices)
+        :return: a generator of location objects or tuples (the locations stored as blocks follow the rows)
+        :raises sqlite3.Error: Database error
+        :raises ValueError: Unknown column
+    """
+
+    # The limit and offset span both the rows and the blocks
+    if (limit is not None or offset is not None) and has_blocks(connection_handler, location_table_name):
+        start = offset or 0
+        yield from itertools.islice(iter_locations(connection_handler, session_id=session_id, start_time=start_time, end_time=end_time, \
+            bbox=bbox, columns=columns, location_table_name=location_table_name, chunk_size=chunk_size, spatial_index=spatial_index, \
+            device_id=device_id), start, None if limit is None else start + limit)
+        return
+
+    sql, parameters = build_location_query(session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox, \
+        columns=columns, limit=limit, offset=offset, location_table_name=location_table_name, spatial_index=spatial_index, \
+        device_id=device_id)
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(sql, parameters)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            if columns is None:
+                for row in rows:
+                    yield location.Location(*row)
+            else:
+                yield from rows
+
+    finally:
+        cursor.close()
+
+    yield from iter_block_locations(connection_handler, session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox, \
+        columns=columns, location_table_name=location_table_name, device_id=device_id)
+
+
+def iter_location_batches(connection_handler, session_id=-1, start_time=None, end_time=None, bbox=None, limit=None, offset=None, \
+                          location_table_name="location", chunk_size=FETCH_CHUNK_SIZE, spatial_index=False, device_id=None):
+
+    """ Iterates over the location data stored in the database as location batches of
+        (at most) chunk_size locations. The filters are the ones of iter_locations.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param limit: the maximum number of records
+        :param offset: the number of records to skip
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of locations per batch
+        :param spatial_index: a flag indicating if the bounding box is looked up in the R*Tree spatial index
+        :param device_id: the identifier of the reporting device (default: None, all devices)
+        :return: a generator of location batches
+        :raises sqlite3.Error: Database error
+    """
+
+    # The locations stored as blocks are decoded by iter_locations
+    if has_blocks(connection_handler, location_table_name):
+        batch = location.LocationBatch()
+
+        for loc in iter_locations(connection_handler, session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox, \
+                limit=limit, offset=offset, location_table_name=location_table_name, chunk_size=chunk_size, spatial_index=spatial_index, \
+                device_id=device_id):
+            batch.append(loc)
+
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = location.LocationBatch()
+
+        if len(batch) > 0:
+            yield batch
+        return
+
+    sql, parameters = build_location_query(session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox, \
+        limit=limit, offset=offset, location_table_name=location_table_name, spatial_index=spatial_index, device_id=device_id)
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(sql, parameters)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            batch = location.LocationBatch()
+            for row in rows:
+                batch.append(location.Location(*row))
+
+            yield batch
+
+    finally:
+        cursor.close()
+
+
+def iter_session_arrays(connection_handler, session_id, columns=tuple(ARRAY_COLUMNS), location_table_name="location", \
+                        chunk_size=FETCH_CHUNK_SIZE):
+
+    """ Iterates over the locations of a session (with a fix) as chunks of NumPy arrays,
+        in time order. The missing values are NaN in the float columns and -1 in the
+        integer ones.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the session identifier
+        :param columns: the selected columns (see ARRAY_COLUMNS)
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of dictionaries of arrays, by column
+        :raises sqlite3.Error: Database error
+        :raises ValueError: Unknown column
+    """
+
+    for column in columns:
+        if column not in ARRAY_COLUMNS:
+            raise ValueError(f"Unknown column: {column}")
+
+    sql = f"""SELECT {', '.join(ARRAY_COLUMNS[column][0] for column in columns)}
+              FROM {location_table_name}
+              WHERE session_id = ? AND mode >= 2
+              ORDER BY session_id, utc_time, id"""
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(sql, (session_id,))
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            # Transpose the chunk into columns, None values become NaN
+            values = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns)).T
+
+            chunk = {}
+            for column, value in zip(columns, values):
+                dtype = np.dtype(ARRAY_COLUMNS[column][1])
+                if dtype.kind == "f":
+                    chunk[column] = value.astype(dtype)
+                else:
+                    chunk[column] = np.nan_to_num(value, nan=-1).astype(dtype)
+
+            yield chunk
+
+    finally:
+        cursor.close()
+
+    # The locations stored as blocks are already columnar
+    if has_blocks(connection_handler, location_table_name):
+        for _, device_id, arrays in iter_block_arrays(connection_handler, session_id=session_id, location_table_name=location_table_name):
+            fix = arrays["mode"] >= 2
+            if fix.any():
+                arrays["device_id"] = np.full(len(fix), -1 if device_id is None else device_id, dtype=ARRAY_COLUMNS["device_id"][1])
+                yield {column: arrays[column][fix].astype(ARRAY_COLUMNS[column][1]) for column in columns}
+
+
+def retrieve_data(connection_handler, session_id=-1, location_table_name="location", **filters):
+
+    """ Retrieves the location data stored in the database
+
+        :param connection_handler: the connection handler object
+        :param session_id: the identifier of the related session
+        :param location_table_name: the location datatable name (default: location)
+        :param filters: the other filters accepted by iter_locations (e.g., start_time, end_time, bbox)
+        :return: A list of location objects and None if an exception arises
+    """
+
+    try:
+
+        return list(iter_locations(connection_handler, session_id=session_id, location_table_name=location_table_name, **filters))
+
+    except (sqlite3.Error, ValueError) as error:
+        logger.error(f"Exception: {str(error)}")
+        return None
+
+
+def get_rtree_table_name(location_table_name="location"):
+
+    """ Returns the name of the R*Tree spatial index of the location datatable
+
+        :param location_table_name: the location datatable name
+        :return: the spatial index name
+    """
+
+    return f"{location_table_name}_rtree"
+
+
+def split_bbox(bbox):
+
+    """ Splits a bounding box crossing the antimeridian (min_longitude > max_longitude)
+        into its eastern and western parts
+
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :return: the list of bounding boxes (one or two)
+    """
+
+    if bbox[1] <= bbox[3]:
+        return [tuple(bbox)]
+
+    return [(bbox[0], bbox[1], bbox[2], 180.0), (bbox[0], -180.0, bbox[2], bbox[3])]
+
+
+def build_bbox_condition(bbox, min_latitude="latitude", max_latitude="latitude", min_longitude="longitude", max_longitude="longitude"):
+
+    """ Builds the parameterized condition selecting the points (or the boxes) overlapping
+        a bounding box, which may cross the antimeridian
+
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param min_latitude: the minimum latitude column
+        :param max_latitude: the maximum latitude column
+        :param min_longitude: the minimum longitude column
+        :param max_longitude: the maximum longitude column
+        :return: a tuple (SQL condition, parameters)
+    """
+
+    conditions = []
+    parameters = []
+
+    for part in split_bbox(bbox):
+        conditions.append(f"{max_latitude} >= ? AND {min_latitude} <= ? AND {max_longitude} >= ? AND {min_longitude} <= ?")
+        parameters.extend([part[0], part[2], part[1], part[3]])
+
+    if len(conditions) == 1:
+        return conditions[0], parameters
+
+    return f"(({') OR ('.join(conditions)}))", parameters
+
+
+def radius_to_bbox(latitude, longitude, radius):
+
+    """ Returns the bounding box of a circle, used to prefilter a radius search. If the
+        circle crosses the antimeridian, the longitudes are wrapped around and the minimum
+        longitude is greater than the maximum one (see split_bbox).
+
+        :param latitude: the latitude of the center, in degrees
+        :param longitude: the longitude of the center, in degrees
+        :param radius: the radius, in meters
+        :return: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+    """
+
+    dlat = math.degrees(radius / geo.EARTH_RADIUS)
+
+    # Near the poles, the circle spans all the longitudes
+    cos_lat = math.cos(math.radians(min(90.0, abs(latitude) + dlat)))
+    dlon = 180.0 if cos_lat < 1e-9 else min(180.0, dlat / cos_lat)
+
+    if dlon >= 180.0:
+        return (max(-90.0, latitude - dlat), -180.0, min(90.0, latitude + dlat), 180.0)
+
+    min_longitude = longitude - dlon
+    max_longitude = longitude + dlon
+
+    if min_longitude < -180.0:
+        min_longitude += 360.0
+    if max_longitude > 180.0:
+        max_longitude -= 360.0
+
+    return (max(-90.0, latitude - dlat), min_longitude, min(90.0, latitude + dlat), max_longitude)
+
+
+def update_spatial_index(connection_handler, location_table_name="location", chunk_size=SPATIAL_INDEX_CHUNK_SIZE):
+
+    """ Adds the locations stored since the last update to the spatial index and moves its
+        watermark. The locations are processed in chunks of identifiers, each chunk in its own
+        transaction.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param chunk_size: the maximum number of location identifiers per transaction
+        :return: the number of location identifiers processed or -1 if an exception arises
+    """
+
+    rtree_table_name = get_rtree_table_name(location_table_name)
+
+    try:
+        last_id = connection_handler.execute(f"SELECT COALESCE(MAX(id), 0) FROM {location_table_name};").fetchone()[0]
+        start = connection_handler.execute(f"SELECT watermark FROM {rtree_table_name}_state;").fetchone()[0]
+
+        watermark = start
+        while watermark < last_id:
+            upto = min(last_id, watermark + chunk_size)
+
+            connection_handler.execute(f"""INSERT OR REPLACE INTO {rtree_table_name}
+                                          SELECT id, latitude, latitude, longitude, longitude FROM {location_table_name}
+                                          WHERE id > ? AND id <= ? AND latitude IS NOT NULL AND longitude IS NOT NULL;""", \
+                (watermark, upto))
+            connection_handler.execute(f"UPDATE {rtree_table_name}_state SET watermark = ?;", (upto,))
+            connection_handler.commit()
+
+            watermark = upto
+
+        return watermark - start
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
+        return -1
+
+
+def iter_locations_in_bbox(connection_handler, bbox, session_id=-1, start_time=None, end_time=None, columns=None, \
+                           location_table_name="location", chunk_size=FETCH_CHUNK_SIZE):
+
+    """ Iterates over the locations within a bounding box, looked up in the spatial index
+
+        :param connection_handler: the connection handler object
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param columns: the selected columns; if None, location objects are yielded
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of location objects or tuples
+        :raises sqlite3.Error: Database error (e.g., no spatial index)
+        :raises ValueError: Unknown column
+    """
+
+    return iter_locations(connection_handler, session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox, \
+        columns=columns, location_table_name=location_table_name, chunk_size=chunk_size, spatial_index=True)
+
+
+def iter_locations_within_radius(connection_handler, latitude, longitude, radius, session_id=-1, start_time=None, end_time=None, \
+                                 columns=None, location_table_name="location", chunk_size=FETCH_CHUNK_SIZE):
+
+    """ Iterates over the locations within a given distance of a point. The candidates are
+        looked up in the spatial index by bounding box, then filtered by great-circle distance.
+
+        :param connection_handler: the connection handler object
+        :param latitude: the latitude of the center, in degrees
+        :param longitude: the longitude of the center, in degrees
+        :param radius: the radius, in meters
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param columns: the selected columns; if None, location objects are yielded
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of location objects or tuples
+        :raises sqlite3.Error: Database error (e.g., no spatial index)
+        :raises ValueError: Unknown column
+    """
+
+    selected = None if columns is None else tuple(columns) + ("latitude", "longitude")
+
+    rows = iter_locations_in_bbox(connection_handler, radius_to_bbox(latitude, longitude, radius), session_id=session_id, \
+        start_time=start_time, end_time=end_time, columns=selected, location_table_name=location_table_name, chunk_size=chunk_size)
+
+    for row in rows:
+        if columns is None:
+            if geo.distance(latitude, longitude, row.latitude, row.longitude) <= radius:
+                yield row
+        elif geo.distance(latitude, longitude, row[-2], row[-1]) <= radius:
+            yield row[:-2]
+
+
+def list_sessions_in_bbox(connection_handler, bbox, location_table_name="location"):
+
+    """ Lists the sessions having at least one location within a bounding box
+
+        :param connection_handler: the connection handler object
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param location_table_name: the location datatable name
+        :return: the list of session identifiers or None if an exception arises
+    """
+
+    try:
+        sql, parameters = build_location_query(bbox=bbox, columns=("session_id",), location_table_name=location_table_name, \
+            spatial_index=True)
+
+        cursor = connection_handler.cursor()
+        cursor.execute(f"SELECT DISTINCT session_id FROM ({sql}) ORDER BY session_id;", parameters)
+        session_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+
+        return session_ids
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        return None
+
+
+def get_rollup_table_name(resolution, location_table_name="location"):
+
+    """ Returns the name of a rollup datatable
+
+        :param resolution: the rollup resolution, in seconds
+        :param location_table_name: the location datatable name
+        :return: the rollup datatable name
+    """
+
+    return f"{location_table_name}_rollup_{resolution}s"
+
+
+def create_rollup_tables(connection_handler, location_table_name="location"):
+
+    """ Creates the rollup datatables, holding one row per session and time bucket, and the
+        datatable of their watermarks (the identifier of the last location rolled up).
+        The sums are stored instead of the averages so that a bucket can be updated
+        incrementally.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :return: 0 if succes, -1 if the connection handler is None
+    """
+
+    if connection_handler is None:
+        return -1
+
+    cursor = connection_handler.cursor()
+
+    for resolution in ROLLUP_RESOLUTIONS:
+        cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {get_rollup_table_name(resolution, location_table_name)} (
+                    session_id INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    point_count INTEGER DEFAULT 0,
+                    sum_latitude FLOAT DEFAULT 0,
+                    sum_longitude FLOAT DEFAULT 0,
+                    sum_altitude FLOAT DEFAULT 0,
+                    altitude_count INTEGER DEFAULT 0,
+                    sum_speed FLOAT DEFAULT 0,
+                    speed_count INTEGER DEFAULT 0,
+                    max_speed FLOAT DEFAULT NULL,
+                    max_mode INTEGER DEFAULT 0,
+                    first_time DATETIME DEFAULT NULL,
+                    last_time DATETIME DEFAULT NULL,
+                    last_id INTEGER DEFAULT NULL,
+                    last_latitude FLOAT DEFAULT NULL,
+                    last_longitude FLOAT DEFAULT NULL,
+                    PRIMARY KEY (session_id, bucket)
+                );
+               """)
+
+    cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {location_table_name}_rollup_state (
+                resolution INTEGER PRIMARY KEY,
+                watermark INTEGER DEFAULT 0
+            );
+           """)
+
+    cursor.close()
+    return 0
+
+
+def get_summary_table_name(session_table_name="session"):
+
+    """ Returns the name of the session summary datatable
+
+        :param session_table_name: the session datatable name
+        :return: the session summary datatable name
+    """
+
+    return f"{session_table_name}_summary"
+
+
+def get_summary_device_table_name(session_table_name="session"):
+
+    """ Returns the name of the datatable holding the last position of every device of a session
+
+        :param session_table_name: the session datatable name
+        :return: the datatable name
+    """
+
+    return f"{session_table_name}_summary_device"
+
+
+def create_summary_table(connection_handler, session_table_name="session"):
+
+    """ Creates the session summary datatable, holding one row per session which is
+        updated every time locations are inserted, and the datatable of the last position
+        of every device of a session (the distance is computed per device)
+
+        :param connection_handler: the connection handler object
+        :param session_table_name: the session datatable name
+        :return: 0 if succes, -1 if the connection handler is None
+    """
+
+    sql = f"""
+            CREATE TABLE IF NOT EXISTS {get_summary_table_name(session_table_name)} (
+                session_id INTEGER PRIMARY KEY,
+                point_count INTEGER DEFAULT 0,
+                first_time DATETIME DEFAULT NULL,
+                last_time DATETIME DEFAULT NULL,
+                min_latitude FLOAT DEFAULT NULL,
+                min_longitude FLOAT DEFAULT NULL,
+                max_latitude FLOAT DEFAULT NULL,
+                max_longitude FLOAT DEFAULT NULL,
+                distance FLOAT DEFAULT 0,
+                max_speed FLOAT DEFAULT NULL,
+                last_latitude FLOAT DEFAULT NULL,
+                last_longitude FLOAT DEFAULT NULL,
+                FOREIGN KEY(session_id) REFERENCES {session_table_name}(id)
+            );
+           """
+
+    device_sql = f"""
+            CREATE TABLE IF NOT EXISTS {get_summary_device_table_name(session_table_name)} (
+                session_id INTEGER NOT NULL,
+                device_id INTEGER NOT NULL,
+                last_latitude FLOAT NOT NULL,
+                last_longitude FLOAT NOT NULL,
+                PRIMARY KEY(session_id, device_id),
+                FOREIGN KEY(session_id) REFERENCES {session_table_name}(id)
+            );
+           """
+
+    if connection_handler is None:
+        return -1
+
+    cursor = connection_handler.cursor()
+    cursor.execute(sql)
+    cursor.execute(device_sql)
+    cursor.close()
+    return 0
+
+
+def update_session_summary(connection_handler, data, session_table_name="session"):
+
+    """ Folds a list of location records into the session summaries. The distance is the
+        sum of the paths of the devices of the session (the locations of several receivers
+        are interleaved), each one continuing from the last position of its device. The
+        caller commits the transaction, so that the summaries stay consistent with the
+        location datatable.
+
+        :param connection_handler: the connection handler object
+        :param data: the list of telemetry records, in insertion order
+                     (session_id, latitude, longitude, altitude, heading, climb, speed, mode, utc_time[, device_id])
+        :param session_table_name: the session datatable name
+        :raises sqlite3.Error: Database error
+    """
+
+    summary_table_name = get_summary_table_name(session_table_name)
+    device_table_name = get_summary_device_table_name(session_table_name)
+
+    # Group the records by session, ignoring the records without position
+    sessions = {}
+    for item in data:
+        if item[1] is not None and item[2] is not None:
+            sessions.setdefault(item[0], []).append(item)
+
+    cursor = connection_handler.cursor()
+
+    for session_id, items in sessions.items():
+
+        latitude = np.array([item[1] for item in items], dtype=np.float64)
+        longitude = np.array([item[2] for item in items], dtype=np.float64)
+        speed = np.array([item[6] for item in items], dtype=np.float64)
+        device = np.array([item[9] if len(item) > 9 and item[9] is not None else -1 for item in items], dtype=np.int64)
+        times = [item[8] for item in items if item[8] is not None]
+
+        cursor.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM {summary_table_name} WHERE session_id = ?;", (session_id,))
+        row = cursor.fetchone()
+
+        if row is None:
+            summary = dict.fromkeys(SUMMARY_COLUMNS)
+            summary.update(session_id=session_id, point_count=0, distance=0.0)
+        else:
+            summary = dict(zip(SUMMARY_COLUMNS, row))
+
+        summary["point_count"] += len(items)
+
+        # The path of each device continues from its last stored position
+        for device_id in np.unique(device).tolist():
+
+            selected = device == device_id
+            latitude_path, longitude_path = latitude[selected], longitude[selected]
+
+            cursor.execute(f"SELECT last_latitude, last_longitude FROM {device_table_name} WHERE session_id = ? AND device_id = ?;", \
+                (session_id, device_id))
+            last = cursor.fetchone()
+
+            if last is not None:
+                latitude_path = np.concatenate(([last[0]], latitude_path))
+                longitude_path = np.concatenate(([last[1]], longitude_path))
+
+            summary["distance"] += float(geo.haversine(latitude_path[:-1], longitude_path[:-1], latitude_path[1:], longitude_path[1:]).sum())
+
+            cursor.execute(f"INSERT OR REPLACE INTO {device_table_name} (session_id, device_id, last_latitude, last_longitude) " \
+                           f"VALUES (?, ?, ?, ?);", (session_id, device_id, float(latitude_path[-1]), float(longitude_path[-1])))
+
+        if times:
+            summary["first_time"] = min([t for t in (summary["first_time"], min(times)) if t is not None])
+            summary["last_time"] = max([t for t in (summary["last_time"], max(times)) if t is not None])
+
+        summary["min_latitude"] = float(latitude.min()) if summary["min_latitude"] is None else min(summary["min_latitude"], float(latitude.min()))
+        summary["min_longitude"] = float(longitude.min()) if summary["min_longitude"] is None else min(summary["min_longitude"], float(longitude.min()))
+        summary["max_latitude"] = float(latitude.max()) if summary["max_latitude"] is None else max(summary["max_latitude"], float(latitude.max()))
+        summary["max_longitude"] = float(longitude.max()) if summary["max_longitude"] is None else max(summary["max_longitude"], float(longitude.max()))
+
+        if not np.isnan(speed).all():
+            max_speed = float(np.nanmax(speed))
+            summary["max_speed"] = max_speed if summary["max_speed"] is None else max(summary["max_speed"], max_speed)
+
+        summary["last_latitude"] = float(latitude[-1])
+        summary["last_longitude"] = float(longitude[-1])
+
+        cursor.execute(f"INSERT OR REPLACE INTO {summary_table_name} ({', '.join(SUMMARY_COLUMNS)}) " \
+                       f"VALUES ({', '.join('?' * len(SUMMARY_COLUMNS))});", [summary[column] for column in SUMMARY_COLUMNS])
+
+    cursor.close()
+
+
+def rebuild_session_summary(connection_handler, session_id, location_table_name="location", session_table_name="session"):
+
+    """ Recomputes the summary of a session from its stored locations (e.g., after the
+        session was compacted). The caller commits the transaction.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the session identifier
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name
+        :raises sqlite3.Error: Database error
+    """
+
+    cursor = connection_handler.cursor()
+    cursor.execute(f"DELETE FROM {get_summary_table_name(session_table_name)} WHERE session_id = ?;", (session_id,))
+    cursor.execute(f"DELETE FROM {get_summary_device_table_name(session_table_name)} WHERE session_id = ?;", (session_id,))
+
+    # The device identifiers are only stored from schema version 7
+    columns = RECORD_COLUMNS
+    if "device_id" not in [row[1] for row in cursor.execute(f"PRAGMA table_info({location_table_name});")]:
+        columns = RECORD_COLUMNS[:-1]
+
+    rows = iter_locations(connection_handler, session_id=session_id, columns=columns, \
+        location_table_name=location_table_name)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= FETCH_CHUNK_SIZE:
+            update_session_summary(connection_handler, chunk, session_table_name=session_table_name)
+            chunk = []
+
+    if chunk:
+        update_session_summary(connection_handler, chunk, session_table_name=session_table_name)
+
+    cursor.close()
+
+
+def get_session_summary(connection_handler, session_id, session_table_name="session"):
+
+    """ Returns the summary of a session
+
+        :param connection_handler: the connection handler object
+        :param session_id: the session identifier
+        :param session_table_name: the session datatable name
+        :return: a dictionary holding the summary (see SUMMARY_COLUMNS), None if the session
+                 has no location or an exception arises
+    """
+
+    try:
+        cursor = connection_handler.cursor()
+        cursor.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM {get_summary_table_name(session_table_name)} WHERE session_id = ?;", \
+            (session_id,))
+        row = cursor.fetchone()
+        cursor.close()
+
+        return None if row is None else dict(zip(SUMMARY_COLUMNS, row))
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        return None
+
+
+def list_session_summaries(connection_handler, session_table_name="session"):
+
+    """ Lists the sessions with their summaries, without scanning the location datatable
+
+        :param connection_handler: the connection handler object
+        :param session_table_name: the session datatable name
+        :return: a list of dictionaries holding the session start/end timestamps and summary
+                 (see SUMMARY_COLUMNS), by session identifier, or None if an exception arises
+    """
+
+    columns = ("start_timestamp", "end_timestamp") + SUMMARY_COLUMNS[1:]
+
+    try:
+        cursor = connection_handler.cursor()
+        cursor.execute(f"""SELECT s.id, s.start_timestamp, s.end_timestamp, {', '.join('m.' + c for c in SUMMARY_COLUMNS[1:])}
+                           FROM {session_table_name} s LEFT JOIN {get_summary_table_name(session_table_name)} m ON m.session_id = s.id
+                           ORDER BY s.id;""")
+
+        summaries = [dict(zip(("session_id",) + columns, row)) for row in cursor.fetchall()]
+        cursor.close()
+
+        return summaries
 
     except sqlite3.Error as error:
         logger.error(f"Exception: {str(error)}")
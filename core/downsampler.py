@@ -0,0 +1,430 @@
+from core import database, location, rollover
+from helpers import generic
+
+from threading import Thread, Event
+
+import heapq
+import os
+import sqlite3
+import time
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of location identifiers rolled up (or deleted) per transaction
+ROLLUP_CHUNK_SIZE = 50000
+
+# Positions of the locations built from the rollups
+AVERAGE = "average"
+LAST = "last"
+
+
+def get_watermark(connection_handler, resolution, location_table_name="location"):
+
+    """ Returns the identifier of the last location rolled up at a given resolution
+
+        :param connection_handler: the connection handler object
+        :param resolution: the rollup resolution, in seconds
+        :param location_table_name: the location datatable name
+        :return: the location identifier (0 if nothing was rolled up yet)
+    """
+
+    row = connection_handler.execute(f"SELECT watermark FROM {location_table_name}_rollup_state WHERE resolution = ?;", \
+        (resolution,)).fetchone()
+
+    return 0 if row is None else row[0]
+
+
+def rollup(connection_handler, resolution, upto, location_table_name="location"):
+
+    """ Folds the locations between the watermark and a given identifier into the rollup
+        datatable of a resolution and moves the watermark. The caller commits the transaction.
+
+        :param connection_handler: the connection handler object
+        :param resolution: the rollup resolution, in seconds
+        :param upto: the identifier of the last location to roll up
+        :param location_table_name: the location datatable name
+        :raises sqlite3.Error: Database error
+    """
+
+    watermark = get_watermark(connection_handler, resolution, location_table_name=location_table_name)
+
+    if upto <= watermark:
+        return
+
+    rollup_table_name = database.get_rollup_table_name(resolution, location_table_name)
+
+    connection_handler.execute(f"""
+            INSERT INTO {rollup_table_name} (session_id, bucket, point_count, sum_latitude, sum_longitude, sum_altitude, altitude_count,
+                                             sum_speed, speed_count, max_speed, max_mode, first_time, last_time, last_id,
+                                             last_latitude, last_longitude)
+            SELECT g.*, l.latitude, l.longitude FROM (
+                SELECT session_id, CAST(strftime('%s', utc_time) AS INTEGER) / {resolution} * {resolution} AS bucket, COUNT(*),
+                       TOTAL(latitude), TOTAL(longitude), TOTAL(altitude), COUNT(altitude), TOTAL(speed), COUNT(speed),
+                       MAX(speed), MAX(mode), MIN(utc_time), MAX(utc_time), MAX(id) AS last_id
+                FROM {location_table_name}
+                WHERE id > ? AND id <= ? AND mode >= 2 AND latitude IS NOT NULL AND longitude IS NOT NULL AND utc_time IS NOT NULL
+                GROUP BY session_id, bucket
+            ) g JOIN {location_table_name} l ON l.id = g.last_id
+            WHERE true
+            ON CONFLICT (session_id, bucket) DO UPDATE SET
+                point_count = point_count + excluded.point_count,
+                sum_latitude = sum_latitude + excluded.sum_latitude,
+                sum_longitude = sum_longitude + excluded.sum_longitude,
+                sum_altitude = sum_altitude + excluded.sum_altitude,
+                altitude_count = altitude_count + excluded.altitude_count,
+                sum_speed = sum_speed + excluded.sum_speed,
+                speed_count = speed_count + excluded.speed_count,
+                max_speed = MAX(COALESCE(max_speed, excluded.max_speed), COALESCE(excluded.max_speed, max_speed)),
+                max_mode = MAX(max_mode, excluded.max_mode),
+                first_time = MIN(first_time, excluded.first_time),
+                last_time = MAX(last_time, excluded.last_time),
+                last_latitude = CASE WHEN excluded.last_id > last_id THEN excluded.last_latitude ELSE last_latitude END,
+                last_longitude = CASE WHEN excluded.last_id > last_id THEN excluded.last_longitude ELSE last_longitude END,
+                last_id = MAX(last_id, excluded.last_id);
+           """, (watermark, upto))
+
+    connection_handler.execute(f"INSERT OR REPLACE INTO {location_table_name}_rollup_state (resolution, watermark) VALUES (?, ?);", \
+        (resolution, upto))
+
+
+def downsample(connection_handler, location_table_name="location", chunk_size=ROLLUP_CHUNK_SIZE):
+
+    """ Rolls up the locations stored since the last run, at every resolution. The locations
+        are processed in chunks of identifiers, each chunk in its own transaction.
+
+        :param connection_handler: the connection handler object
+        :param location_table_name: the location datatable name
+        :param chunk_size: the maximum number of location identifiers per transaction
+        :return: the number of location identifiers processed or -1 if an exception arises
+    """
+
+    try:
+        last_id = connection_handler.execute(f"SELECT COALESCE(MAX(id), 0) FROM {location_table_name};").fetchone()[0]
+        start = min(get_watermark(connection_handler, resolution, location_table_name) for resolution in database.ROLLUP_RESOLUTIONS)
+
+        watermark = start
+        while watermark < last_id:
+            upto = min(last_id, watermark + chunk_size)
+
+            for resolution in database.ROLLUP_RESOLUTIONS:
+                rollup(connection_handler, resolution, upto, location_table_name=location_table_name)
+
+            connection_handler.commit()
+            watermark = upto
+
+        return watermark - start
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
+        return -1
+
+
+def apply_retention(connection_handler, max_age, location_table_name="location", chunk_size=ROLLUP_CHUNK_SIZE):
+
+    """ Deletes the raw locations older than max_age seconds, provided they are rolled up
+        at every resolution
+
+        :param connection_handler: the connection handler object
+        :param max_age: the maximum age of the raw locations, in seconds
+        :param location_table_name: the location datatable name
+        :param chunk_size: the maximum number of locations deleted per transaction
+        :return: the number of deleted locations or -1 if an exception arises
+    """
+
+    try:
+        watermark = min(get_watermark(connection_handler, resolution, location_table_name) for resolution in database.ROLLUP_RESOLUTIONS)
+        cutoff = generic.epoch_ms_to_iso(round((time.time() - max_age) * 1000))
+
+        deleted = 0
+        while True:
+            cursor = connection_handler.execute(f"""DELETE FROM {location_table_name} WHERE id IN
+                                                        (SELECT id FROM {location_table_name} WHERE utc_time < ? AND id <= ? LIMIT ?);""", \
+                (cutoff, watermark, chunk_size))
+            connection_handler.commit()
+
+            if cursor.rowcount <= 0:
+                break
+            deleted += cursor.rowcount
+
+        if deleted > 0:
+            logger.info(f"{deleted} raw locations older than {cutoff} deleted")
+
+        return deleted
+
+    except sqlite3.Error as error:
+        logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
+        return -1
+
+
+def select_resolution(resolution):
+
+    """ Returns the coarsest rollup resolution which satisfies a requested resolution
+
+        :param resolution: the requested resolution, in seconds (None or 0 for the raw locations)
+        :return: the rollup resolution or None if the raw locations are needed
+    """
+
+    if not resolution:
+        return None
+
+    tiers = [tier for tier in database.ROLLUP_RESOLUTIONS if tier <= resolution]
+    return max(tiers) if tiers else None
+
+
+def iter_rollups(connection_handler, resolution, session_id=-1, start_time=None, end_time=None, position=AVERAGE, \
+                 location_table_name="location", chunk_size=database.FETCH_CHUNK_SIZE):
+
+    """ Iterates over the buckets of a rollup datatable as location objects, timestamped
+        with the start of their bucket
+
+        :param connection_handler: the connection handler object
+        :param resolution: the rollup resolution, in seconds (one of ROLLUP_RESOLUTIONS)
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param position: the position of the locations, 'average' or 'last' of their bucket
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of location objects
+        :raises sqlite3.Error: Database error
+    """
+
+    if position == LAST:
+        coordinates = "last_latitude, last_longitude"
+    else:
+        coordinates = "sum_latitude / point_count, sum_longitude / point_count"
+
+    conditions = []
+    parameters = []
+
+    if session_id != -1:
+        conditions.append("session_id = ?")
+        parameters.append(session_id)
+
+    if start_time is not None:
+        conditions.append("last_time >= ?")
+        parameters.append(start_time)
+
+    if end_time is not None:
+        conditions.append("first_time < ?")
+        parameters.append(end_time)
+
+    sql = f"""SELECT {coordinates},
+                     CASE WHEN altitude_count > 0 THEN sum_altitude / altitude_count END,
+                     CASE WHEN speed_count > 0 THEN sum_speed / speed_count END,
+                     max_mode, bucket, session_id
+              FROM {database.get_rollup_table_name(resolution, location_table_name)}"""
+
+    if conditions:
+        sql = f"{sql} WHERE {' AND '.join(conditions)}"
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(f"{sql} ORDER BY session_id, bucket;", parameters)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            for latitude, longitude, altitude, speed, mode, bucket, bucket_session_id in rows:
+                yield location.Location(latitude, longitude, altitude, None, None, speed, mode, \
+                    generic.epoch_ms_to_iso(bucket * 1000), session_id=bucket_session_id)
+
+    finally:
+        cursor.close()
+
+
+def iter_locations_at_resolution(connection_handler, resolution, session_id=-1, start_time=None, end_time=None, position=AVERAGE, \
+                                 location_table_name="location", chunk_size=database.FETCH_CHUNK_SIZE):
+
+    """ Iterates over the location data at a requested resolution, read from the coarsest
+        rollup datatable which satisfies it (or the raw locations). The locations stored
+        after the last downsampling are not rolled up yet, they are merged as raw locations
+        in session and time order, so that every session is a single run of locations.
+
+        :param connection_handler: the connection handler object
+        :param resolution: the requested resolution, in seconds (None or 0 for the raw locations)
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param position: the position of the rolled up locations, 'average' or 'last' of their bucket
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of location objects
+        :raises sqlite3.Error: Database error
+    """
+
+    tier = select_resolution(resolution)
+
+    if tier is None:
+        yield from database.iter_locations(connection_handler, session_id=session_id, start_time=start_time, end_time=end_time, \
+            location_table_name=location_table_name, chunk_size=chunk_size)
+        return
+
+    watermark = get_watermark(connection_handler, tier, location_table_name=location_table_name)
+
+    rollups = iter_rollups(connection_handler, tier, session_id=session_id, start_time=start_time, end_time=end_time, \
+        position=position, location_table_name=location_table_name, chunk_size=chunk_size)
+
+    yield from heapq.merge(rollups, iter_raw_locations(connection_handler, watermark, session_id=session_id, start_time=start_time, \
+        end_time=end_time, location_table_name=location_table_name, chunk_size=chunk_size), \
+        key=lambda loc: (loc.session_id, generic.iso_to_epoch_ms(loc.utc_time)))
+
+
+def iter_raw_locations(connection_handler, watermark, session_id=-1, start_time=None, end_time=None, location_table_name="location", \
+                       chunk_size=database.FETCH_CHUNK_SIZE):
+
+    """ Iterates over the raw locations (with a fix) not rolled up yet
+
+        :param connection_handler: the connection handler object
+        :param watermark: the identifier of the last location rolled up
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of location objects, in session and time order
+        :raises sqlite3.Error: Database error
+    """
+
+    sql, parameters = database.build_location_query(session_id=session_id, start_time=start_time, end_time=end_time, \
+        location_table_name=location_table_name, min_id=watermark, min_mode=2)
+
+    cursor = connection_handler.cursor()
+
+    try:
+        cursor.execute(sql, parameters)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            for row in rows:
+                yield location.Location(*row)
+
+    finally:
+        cursor.close()
+
+
+class Downsampler(Thread):
+
+    """ Rolls up the recorded locations in the background at regular time intervals and
+        deletes the raw locations older than the retention age. It also adds the new locations
+        to the spatial index, if enabled. With the database rollover, every writable database
+        file of the catalog is processed (the compacted files may be read-only).
+
+        :param running: an event controlling the thread operation
+        :param appconfig: the application configuration object
+        :param id: the downsampler thread identifier
+        :param wakeup: an event interrupting the wait between two runs
+    """
+
+    def __init__(self, appconfig, name=""):
+
+        """ Initializes the downsampler object
+
+            :param appconfig: the application configuration object
+            :param name: a name that can be attributed to the downsampler
+        """
+
+        Thread.__init__(self)
+        self.running = Event()
+        self.wakeup = Event()
+        if name != "":
+            self.id = name
+        self.appconfig = appconfig
+
+
+    def start(self):
+
+        """Starts the downsampler thread"""
+
+        self.running.set()
+        super(Downsampler, self).start()
+
+
+    def run(self):
+
+        """ Runs the downsampler loop """
+
+        while self.running.isSet():
+            self.process()
+            self.wakeup.wait(self.appconfig.rollup_interval)
+
+
+    def database_files(self):
+
+        """ Returns the database files to process
+
+            :return: the list of database filenames
+        """
+
+        if self.appconfig.rollover_policy is None:
+            return [self.appconfig.database_filename]
+
+        catalog = rollover.Catalog(rollover.get_catalog_filename(self.appconfig.database_filename))
+
+        if catalog.open() != 0:
+            return []
+
+        filenames = catalog.files()
+        catalog.close()
+
+        # The files made read-only by the compactor cannot be rolled up (their locations stay raw)
+        return [filename for filename in filenames if os.access(filename, os.W_OK)]
+
+
+    def process(self):
+
+        """ Rolls up the new locations of every database file, applies the retention policy
+            and updates the spatial index """
+
+        for filename in self.database_files():
+
+            connection_handler = database.connect(db_filename=filename)
+
+            if connection_handler is None:
+                continue
+
+            try:
+                # The rollup and spatial index datatables are created by the schema migration of the recorder
+                if self.appconfig.rollup_enabled and \
+                   database.check_if_datatable_exists(connection_handler, f"{self.appconfig.location_tablename}_rollup_state"):
+
+                    count = downsample(connection_handler, location_table_name=self.appconfig.location_tablename)
+                    if count > 0:
+                        logger.debug(f"{count} locations rolled up in {filename}")
+
+                    if self.appconfig.rollup_retention_days is not None and count != -1:
+                        apply_retention(connection_handler, self.appconfig.rollup_retention_days * 86400, \
+                            location_table_name=self.appconfig.location_tablename)
+
+                rtree_table_name = database.get_rtree_table_name(self.appconfig.location_tablename)
+                if self.appconfig.spatial_index_enabled and \
+                   database.check_if_datatable_exists(connection_handler, f"{rtree_table_name}_state"):
+
+                    count = database.update_spatial_index(connection_handler, location_table_name=self.appconfig.location_tablename)
+                    if count > 0:
+                        logger.debug(f"{count} locations added to the spatial index of {filename}")
+
+            finally:
+                database.disconnect(connection_handler)
+
+
+    def stop(self):
+
+        """Stops the downsampler thread"""
+
+        self.running.clear()
+        self.wakeup.set()
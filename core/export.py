@@ -1,43 +1,110 @@
 from datetime import datetime
-from core import location
+from core import location, simplify
 
-import simplekml
+from xml.sax.saxutils import escape
+
+import gzip
+import io
 import logging
+import zipfile
 
 
 # Get the current logger object
 logger = logging.getLogger(__name__)
 
 
-def save_as_gpx(filename, data):
-    
+# Number of trackpoints written to the output file at once
+WRITE_CHUNK_SIZE = 1000
+
+# Compression level of the gzip outputs (speed vs. size trade-off)
+GZIP_LEVEL = 6
+
+# Maximum number of points per KML LineString, longer tracks are split
+KML_MAX_LINESTRING_POINTS = 50000
+
+
+def open_output(filename, compress=None):
+
     """
-        Saves location info retrieved from the database as a GPX file
+        Opens an output text file, gzip-compressed if requested
 
-        :param filename: output GPX filename
-        :param data: retrieved location data
+        :param filename: output filename
+        :param compress: a flag indicating if the output is gzip-compressed
+                         (default: None, compressed if the filename ends with '.gz')
+        :return: a writable text file object
+    """
+
+    if compress is None:
+        compress = filename.lower().endswith('.gz')
+
+    if compress:
+        return gzip.open(filename, "wt", compresslevel=GZIP_LEVEL, encoding="utf-8")
+
+    return open(filename, "w", encoding="utf-8")
+
+
+def save_as_gpx(filename, data, compress=None, simplify_tolerance=None, simplify_method=simplify.DOUGLAS_PEUCKER):
+    
+    """
+        Saves location info retrieved from the database as a GPX file. The data is consumed
+        as a stream and written in chunks, so any iterator of location objects (e.g., the
+        one returned by database.iter_locations) is exported in constant memory. Each
+        session is written as its own track segment.
+
+        :param filename: output GPX filename (overwritten if it exists)
+        :param data: retrieved location data (an iterable of location objects or location batches)
+        :param compress: a flag indicating if the output is gzip-compressed
+                         (default: None, compressed if the filename ends with '.gz')
+        :param simplify_tolerance: the tolerance of the track simplification, in meters
+                                   (default: None, no simplification)
+        :param simplify_method: the simplification method, 'douglas_peucker' or 'visvalingam'
         :return: 0 if success and -1 if failure or an exception arises
     """
 
     try:
 
+        if simplify_tolerance:
+            data = simplify.simplify_locations(data, simplify_tolerance, method=simplify_method)
+
         header = f"""<?xml version="1.0" encoding="UTF-8"?>\n""" \
                  f"""<gpx version="1.0">\n"""\
-                 f"""<trk><trkseg>\n"""
-        footer = f"""</trkseg></trk></gpx>\n"""
+                 f"""<trk>\n"""
+        footer = f"""</trk></gpx>\n"""
 
-        with open(filename, "a+") as outfile:
+        with open_output(filename, compress) as outfile:
             
             outfile.write(header)
 
-            for loc in data:
-                trk = ''
-                if loc.mode == 2:
-                    trk = f"""<trkpt lat="{loc.latitude}" lon="{loc.longitude}"><time>{loc.utc_time}</time></trkpt>\n"""
-                elif loc.mode == 3:
-                    trk = f"""<trkpt lat="{loc.latitude}" lon="{loc.longitude}"><ele>{loc.altitude}</ele><time>{loc.utc_time}</time></trkpt>\n"""
-                outfile.write(trk)
-            
+            chunk = []
+            session_id = None
+            segment_open = False
+
+            for loc in location.iter_fixes(data):
+
+                if loc.mode < 2:
+                    continue
+
+                # Start a new track segment for every session
+                if not segment_open or loc.session_id != session_id:
+                    if segment_open:
+                        chunk.append("</trkseg>\n")
+                    chunk.append("<trkseg>\n")
+                    session_id = loc.session_id
+                    segment_open = True
+
+                if loc.mode >= 3 and loc.altitude is not None:
+                    chunk.append(f"""<trkpt lat="{loc.latitude}" lon="{loc.longitude}"><ele>{loc.altitude}</ele><time>{loc.utc_time}</time></trkpt>\n""")
+                else:
+                    chunk.append(f"""<trkpt lat="{loc.latitude}" lon="{loc.longitude}"><time>{loc.utc_time}</time></trkpt>\n""")
+
+                if len(chunk) >= WRITE_CHUNK_SIZE:
+                    outfile.write(''.join(chunk))
+                    chunk = []
+
+            if segment_open:
+                chunk.append("</trkseg>\n")
+
+            outfile.write(''.join(chunk))
             outfile.write(footer)
 
         return 0
@@ -58,28 +125,130 @@ def save_as_kml(filename, data, name="", description=""):
         :param description: a description of the location data
         :return: 0 if success and -1 if failure or an exception arises
     """
-    
-    try:
-        kml = simplekml.Kml()
 
-        coords=[]
-        for loc in data:
-            coords.append((loc.latitude, loc.longitude))
+    outfile = filename
+    n = len(filename)
+    ext = filename[n-4:n]
+    if(ext.lower() != '.kml'):
+        outfile = f"{filename}.kml"
 
-        linestring = kml.newlinestring(name=name, description=description, coords=coords)
-        linestring.altitudemode = simplekml.AltitudeMode.relativetoground
-        linestring.extrude = 1
+    return write_kml(outfile, data, name=name, description=description, kmz=False)
 
-        outfile = filename
-        n = len(filename)
-        ext = filename[n-4:n]
-        if(ext.lower() != '.kml'):
-            outfile = f"{filename}.kml"
 
-        kml.save(outfile)
+def write_kml(filename, data, name="", description="", kmz=None, max_points=KML_MAX_LINESTRING_POINTS, \
+              simplify_tolerance=None, simplify_method=simplify.DOUGLAS_PEUCKER):
+
+    """
+        Saves location info retrieved from the database as a KML or KMZ file. The coordinates
+        are streamed to the output in chunks, so any iterator of location objects is exported
+        in constant memory. A new LineString is started for every session and whenever the
+        current one holds max_points points (consecutive LineStrings share their boundary point).
+
+        :param filename: output KML/KMZ filename (overwritten if it exists)
+        :param data: retrieved location data (an iterable of location objects or location batches)
+        :param name: name given to the location data
+        :param description: a description of the location data
+        :param kmz: a flag indicating if the output is a KMZ archive
+                    (default: None, KMZ if the filename ends with '.kmz')
+        :param max_points: the maximum number of points per LineString
+        :param simplify_tolerance: the tolerance of the track simplification, in meters
+                                   (default: None, no simplification)
+        :param simplify_method: the simplification method, 'douglas_peucker' or 'visvalingam'
+        :return: 0 if success and -1 if failure or an exception arises
+    """
+
+    try:
+
+        if simplify_tolerance:
+            data = simplify.simplify_locations(data, simplify_tolerance, method=simplify_method)
+
+        if kmz is None:
+            kmz = filename.lower().endswith('.kmz')
+
+        if kmz:
+            with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                with archive.open("doc.kml", "w") as entry:
+                    with io.TextIOWrapper(entry, encoding="utf-8") as outfile:
+                        stream_kml(outfile, data, name, description, max_points)
+        else:
+            with open(filename, "w", encoding="utf-8") as outfile:
+                stream_kml(outfile, data, name, description, max_points)
 
         return 0
 
     except Exception as e:
         logger.error(f'Exception: {str(e)}')
         return -1
+
+
+def stream_kml(outfile, data, name="", description="", max_points=KML_MAX_LINESTRING_POINTS):
+
+    """
+        Writes a KML document holding the location data to a text file object
+
+        :param outfile: a writable text file object
+        :param data: retrieved location data (an iterable of location objects or location batches)
+        :param name: name given to the location data
+        :param description: a description of the location data
+        :param max_points: the maximum number of points per LineString
+    """
+
+    name = escape(name)
+    description = escape(description)
+
+    header = f"""<?xml version="1.0" encoding="UTF-8"?>\n""" \
+             f"""<kml xmlns="http://www.opengis.net/kml/2.2">\n""" \
+             f"""<Document>\n<name>{name}</name>\n<description>{description}</description>\n"""
+    footer = f"""</Document>\n</kml>\n"""
+
+    def placemark_start(part):
+        part_name = name if part == 1 else f"{name} ({part})"
+        return f"""<Placemark>\n<name>{part_name}</name>\n<description>{description}</description>\n""" \
+               f"""<LineString>\n<extrude>1</extrude>\n<altitudeMode>relativeToGround</altitudeMode>\n<coordinates>\n"""
+
+    placemark_end = f"""</coordinates>\n</LineString>\n</Placemark>\n"""
+
+    outfile.write(header)
+
+    chunk = []
+    part = 0
+    count = 0
+    session_id = None
+    last_point = None
+
+    for loc in location.iter_fixes(data):
+
+        if loc.mode < 2:
+            continue
+
+        point = f"{loc.longitude},{loc.latitude}\n"
+
+        if part == 0 or loc.session_id != session_id:
+            if part > 0:
+                chunk.append(placemark_end)
+            part += 1
+            chunk.append(placemark_start(part))
+            session_id = loc.session_id
+            count = 0
+
+        elif count >= max_points:
+            # Split the track, the new LineString starts at the last point of the previous one
+            chunk.append(placemark_end)
+            part += 1
+            chunk.append(placemark_start(part))
+            chunk.append(last_point)
+            count = 1
+
+        chunk.append(point)
+        last_point = point
+        count += 1
+
+        if len(chunk) >= WRITE_CHUNK_SIZE:
+            outfile.write(''.join(chunk))
+            chunk = []
+
+    if part > 0:
+        chunk.append(placemark_end)
+
+    outfile.write(''.join(chunk))
+    outfile.write(footer)
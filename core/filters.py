@@ -0,0 +1,155 @@
+from helpers import generic, geo
+
+import time
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+def heading_change(heading1, heading2):
+
+    """ Returns the absolute difference between two headings
+
+        :param heading1: the first heading, in degrees
+        :param heading2: the second heading, in degrees
+        :return: the heading change, in degrees (between 0 and 180)
+    """
+
+    change = abs((heading2 or 0) - (heading1 or 0)) % 360
+    return 360 - change if change > 180 else change
+
+
+def create_filter(appconfig):
+
+    """ Creates the stationary-point filter of a location source, if enabled
+
+        :param appconfig: the application configuration object
+        :return: the filter or None if disabled
+    """
+
+    if not appconfig.filter_enabled:
+        return None
+
+    return StationaryFilter(min_distance=appconfig.filter_min_distance, min_speed=appconfig.filter_min_speed, \
+        min_heading_change=appconfig.filter_min_heading_change, keepalive_interval=appconfig.filter_keepalive_interval)
+
+
+class StationaryFilter():
+
+    """ Suppresses the redundant locations before they are queued. While the device is
+        stationary (speed and distance to the last reported location under their thresholds),
+        only a keep-alive location is reported every keepalive_interval seconds. While moving,
+        a deadband drops the locations which neither moved min_distance meters nor turned
+        min_heading_change degrees since the last reported location. The stop and start
+        transitions are kept exactly: the first stationary location is reported, and so is the
+        last stationary location before the device starts moving again.
+
+        :param min_distance: the minimum distance to the last reported location, in meters
+        :param min_speed: the minimum speed of a moving device, in meters per second
+        :param min_heading_change: the minimum heading change while moving, in degrees
+        :param keepalive_interval: the maximum time between two reported locations, in seconds
+        :param stationary: a flag indicating if the device is stationary
+        :param passed: the number of reported locations
+        :param suppressed: the number of suppressed locations
+    """
+
+    def __init__(self, min_distance=5.0, min_speed=0.5, min_heading_change=10.0, keepalive_interval=60.0):
+
+        """ Initializes the filter
+
+            :param min_distance: the minimum distance to the last reported location, in meters (default: 5.0)
+            :param min_speed: the minimum speed of a moving device, in meters per second (default: 0.5)
+            :param min_heading_change: the minimum heading change while moving, in degrees (default: 10.0)
+            :param keepalive_interval: the maximum time between two reported locations, in seconds (default: 60.0)
+        """
+
+        self.min_distance = min_distance
+        self.min_speed = min_speed
+        self.min_heading_change = min_heading_change
+        self.keepalive_interval = keepalive_interval
+
+        self.stationary = False
+        self.passed = 0
+        self.suppressed = 0
+
+        self.last = None
+        self.last_time = None
+        self.held = None
+
+
+    def timestamp(self, loc):
+
+        """ Returns the time of a location as a UNIX timestamp in seconds, the fix time if
+            known (so that replayed data is filtered like live data) and the system time
+            otherwise, so that both can be compared
+        """
+
+        epoch_ms = generic.iso_to_epoch_ms(loc.utc_time)
+        return time.time() if epoch_ms < 0 else epoch_ms / 1000
+
+
+    def process(self, loc):
+
+        """ Filters a location
+
+            :param loc: the location object
+            :return: the list of location objects to report (possibly empty)
+        """
+
+        # Locations without fix (or position) are not filtered
+        if loc.mode < 2 or loc.latitude is None or loc.longitude is None:
+            return [loc]
+
+        now = self.timestamp(loc)
+
+        if self.last is None:
+            return self._report([loc], now)
+
+        speed = loc.horizontal_speed or 0
+        distance = geo.distance(self.last.latitude, self.last.longitude, loc.latitude, loc.longitude)
+        moving = speed >= self.min_speed or distance >= self.min_distance
+
+        if self.stationary:
+
+            if moving:
+                # Start transition: report the last stationary location, then the moving one
+                self.stationary = False
+                if self.held is None:
+                    return self._report([loc], now)
+
+                self.suppressed -= 1
+                return self._report([self.held, loc], now)
+
+            if now - self.last_time >= self.keepalive_interval:
+                return self._report([loc], now)
+
+            return self._suppress(loc)
+
+        if not moving:
+            # Stop transition: report the first stationary location
+            self.stationary = True
+            return self._report([loc], now)
+
+        if distance >= self.min_distance or heading_change(self.last.heading, loc.heading) >= self.min_heading_change \
+           or now - self.last_time >= self.keepalive_interval:
+            return self._report([loc], now)
+
+        return self._suppress(loc)
+
+
+    def _report(self, locations, now):
+
+        self.last = locations[-1]
+        self.last_time = now
+        self.held = None
+        self.passed += len(locations)
+        return locations
+
+
+    def _suppress(self, loc):
+
+        self.held = loc
+        self.suppressed += 1
+        return []
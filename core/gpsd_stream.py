@@ -0,0 +1,152 @@
+from core import location
+
+import socket
+import json
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# The command subscribing a client to the GPSD JSON report stream
+WATCH_COMMAND = '?WATCH={"enable":true,"json":true};\n'
+
+
+def location_from_tpv(report, device_id=None):
+
+    """ Converts a GPSD TPV (time-position-velocity) report into a Location object
+
+        :param report: the decoded TPV report (dictionary)
+        :param device_id: the identifier of the device (receiver) which reported the location (default: None)
+        :return: a Location object (without position if the report has no fix)
+    """
+
+    mode = report.get('mode', 0)
+
+    altitude = None
+    climb = None
+
+    if mode == 3:
+        altitude = report.get('alt')
+        climb = report.get('climb')
+
+    return location.Location(latitude=report.get('lat'), longitude=report.get('lon'), altitude=altitude, \
+        heading=report.get('track', 0), climb=climb, horizontal_speed=report.get('speed', 0), mode=mode, \
+        utc_time=report.get('time', ''), device_id=device_id)
+
+
+class GPSDStream():
+
+    """ A minimal GPSD client which subscribes to the daemon with a WATCH command
+        and yields the reports as they are pushed by the server
+
+        :param host: the GPSD server IP address (or hostname)
+        :param port: the GPSD server TCP port
+        :param timeout: the socket read timeout, in seconds
+        :param sock: the socket connected to the GPSD server
+    """
+
+    def __init__(self, host="127.0.0.1", port=2947, timeout=1.0):
+
+        """ Initializes the stream object
+
+            :param host: the GPSD server IP address (or hostname)
+            :param port: the GPSD server TCP port
+            :param timeout: the socket read timeout, in seconds (default: 1.0)
+        """
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self._buffer = b''
+
+
+    def connect(self):
+
+        """ Opens the connection to the GPSD server and enables the watcher mode
+
+            :return: 0 if success and -1 if an exception arises
+        """
+
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self.sock.sendall(WATCH_COMMAND.encode())
+            self._buffer = b''
+            return 0
+
+        except Exception as error:
+            logger.error(f"Exception: {str(error)}")
+            self.close()
+            return -1
+
+
+    def close(self):
+
+        """Closes the connection to the GPSD server"""
+
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+    def pending(self):
+
+        """ Checks if a complete report is already buffered and can be read without waiting
+
+            :return: True if a report is buffered, False otherwise
+        """
+
+        return b'\n' in self._buffer
+
+
+    def reports(self, classes=("TPV",)):
+
+        """ Yields the decoded reports pushed by the GPSD server as soon as they arrive.
+            None is yielded whenever the read timeout expires so that callers get a chance
+            to check their stop condition. The generator ends when the server closes the
+            connection or the connection is lost.
+
+            :param classes: the report classes to yield (default: TPV only)
+            :return: a generator of dictionaries
+        """
+
+        while self.sock is not None:
+
+            # Yield every complete line already buffered before reading again
+            newline = self._buffer.find(b'\n')
+            if newline >= 0:
+                line = self._buffer[:newline]
+                self._buffer = self._buffer[newline+1:]
+
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    logger.debug(f"Malformed GPSD report skipped: {line[:80]}")
+                    continue
+
+                if isinstance(report, dict) and report.get('class') in classes:
+                    yield report
+                continue
+
+            try:
+                chunk = self.sock.recv(4096)
+            except socket.timeout:
+                yield None
+                continue
+            except OSError as error:
+                # The connection is lost (e.g., reset by the server)
+                logger.error(f"Exception: {str(error)}")
+                self.close()
+                return
+
+            if not chunk:
+                # The server has closed the connection
+                self.close()
+                return
+
+            self._buffer += chunk
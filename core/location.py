@@ -1,8 +1,17 @@
+from array import array
+
+import math
 
 
 class Location():
 
-    def __init__(self, latitude, longitude, altitude, heading, climb, horizontal_speed, mode, utc_time):
+    """ A location (fix) reported by the GPS device. The attributes are stored in slots,
+        so that the objects are compact and cheap to create.
+    """
+
+    __slots__ = ("latitude", "longitude", "altitude", "heading", "climb", "horizontal_speed", "mode", "utc_time", "session_id", "device_id")
+
+    def __init__(self, latitude, longitude, altitude, heading, climb, horizontal_speed, mode, utc_time, session_id=None, device_id=None):
         self.latitude = latitude
         self.longitude = longitude
         self.altitude = altitude
@@ -11,10 +20,181 @@ class Location():
         self.horizontal_speed = horizontal_speed
         self.mode = mode
         self.utc_time = utc_time
+        self.session_id = session_id
+        self.device_id = device_id
 
 
     def __repr__(self):
 
         return f"{self.utc_time} [{self.mode}] :: ({self.latitude}, {self.longitude}, {self.altitude}), " \
                f"({self.heading}, {self.horizontal_speed}, {self.heading})"
-    
\ No newline at end of file
+
+
+def _to_float(value):
+
+    """ Converts an optional value to a float, None being stored as NaN """
+
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value):
+
+    """ Converts a stored float back to an optional value, NaN being returned as None """
+
+    return None if math.isnan(value) else value
+
+
+class LocationBatch():
+
+    """ A columnar container of location data. Every numeric attribute is stored in a typed
+        array (missing values as NaN or -1), so that a batch takes a fraction of the memory of
+        the equivalent location objects and is pickled as a handful of contiguous buffers.
+        The UTC times are kept as reported by the GPSD (the stored value is not rewritten);
+        they are only converted where a numeric time is needed (see helpers.generic.iso_to_epoch_ms).
+
+        :param latitude: latitudes, in degrees (NaN if unknown)
+        :param longitude: longitudes, in degrees (NaN if unknown)
+        :param altitude: altitudes, in meters (NaN if unknown)
+        :param heading: courses over ground, in degrees (NaN if unknown)
+        :param climb: vertical speeds, in meters per second (NaN if unknown)
+        :param horizontal_speed: ground speeds, in meters per second (NaN if unknown)
+        :param mode: GPS reception status (0: None, 1: No-fix, 2: 2D-Fix, 3: 3D-Fix)
+        :param utc_time: UTC times, as ISO 8601 strings (empty if unknown)
+        :param session_id: session identifiers (-1 if unknown)
+        :param device_id: identifiers of the devices (receivers) which reported the locations (-1 if unknown)
+        :param seq: spool sequence numbers (-1 if not spooled)
+    """
+
+    __slots__ = ("latitude", "longitude", "altitude", "heading", "climb", "horizontal_speed", "mode", "utc_time", "session_id", "device_id", "seq")
+
+    def __init__(self, locations=None):
+
+        """ Initializes the batch
+
+            :param locations: an optional iterable of location objects to append
+        """
+
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.altitude = array('d')
+        self.heading = array('d')
+        self.climb = array('d')
+        self.horizontal_speed = array('d')
+        self.mode = array('b')
+        self.utc_time = []
+        self.session_id = array('q')
+        self.device_id = array('q')
+        self.seq = array('q')
+
+        if locations is not None:
+            for loc in locations:
+                self.append(loc)
+
+
+    def __len__(self):
+
+        return len(self.mode)
+
+
+    def __iter__(self):
+
+        """ Iterates over the batch as location objects """
+
+        for i in range(len(self.mode)):
+            yield self[i]
+
+
+    def __getitem__(self, i):
+
+        """ Returns the i-th location of the batch as a location object """
+
+        session_id = self.session_id[i]
+        device_id = self.device_id[i]
+
+        return Location(_from_float(self.latitude[i]), _from_float(self.longitude[i]), _from_float(self.altitude[i]), _from_float(self.heading[i]), \
+            _from_float(self.climb[i]), _from_float(self.horizontal_speed[i]), self.mode[i], \
+            self.utc_time[i], None if session_id < 0 else session_id, None if device_id < 0 else device_id)
+
+
+    def __repr__(self):
+
+        return f"LocationBatch({len(self)} locations)"
+
+
+    def append(self, loc):
+
+        """ Appends a location object to the batch
+
+            :param loc: the location object
+        """
+
+        self.latitude.append(_to_float(loc.latitude))
+        self.longitude.append(_to_float(loc.longitude))
+        self.altitude.append(_to_float(loc.altitude))
+        self.heading.append(_to_float(loc.heading))
+        self.climb.append(_to_float(loc.climb))
+        self.horizontal_speed.append(_to_float(loc.horizontal_speed))
+        self.mode.append(loc.mode)
+        self.utc_time.append('' if loc.utc_time is None else loc.utc_time)
+        self.session_id.append(-1 if loc.session_id is None else loc.session_id)
+        self.device_id.append(-1 if loc.device_id is None else loc.device_id)
+        self.seq.append(-1)
+
+
+    def extend(self, batch):
+
+        """ Appends the content of another batch (or of an iterable of location objects)
+
+            :param batch: the location batch or the iterable of location objects
+        """
+
+        if isinstance(batch, LocationBatch):
+            for column in LocationBatch.__slots__:
+                getattr(self, column).extend(getattr(batch, column))
+        else:
+            for loc in batch:
+                self.append(loc)
+
+
+    def rows(self, session_id):
+
+        """ Yields the location datatable records of the batch. Locations without fix are
+            skipped and altitude and climb are only kept for 3D fixes.
+
+            :param session_id: the identifier of the session the records belong to
+            :return: a generator of tuples of column values
+        """
+
+        for i in range(len(self.mode)):
+
+            mode = self.mode[i]
+
+            if mode < 2:
+                continue
+
+            if mode == 2:
+                altitude = None
+                climb = None
+            else:
+                altitude = _from_float(self.altitude[i])
+                climb = _from_float(self.climb[i])
+
+            device_id = self.device_id[i]
+
+            yield (session_id, _from_float(self.latitude[i]), _from_float(self.longitude[i]), altitude, _from_float(self.heading[i]), climb, \
+                   _from_float(self.horizontal_speed[i]), mode, self.utc_time[i], None if device_id < 0 else device_id)
+
+
+def iter_fixes(data):
+
+    """ Iterates over location data given either as location objects or as location batches
+
+        :param data: an iterable of location objects and/or location batches
+        :return: a generator of location objects
+    """
+
+    for item in data:
+        if isinstance(item, LocationBatch):
+            yield from item
+        else:
+            yield item
@@ -1,5 +1,5 @@
 
-from core import location
+from core import location, gpsd_stream, filters
 
 from threading import Thread, Event, currentThread
 
@@ -22,15 +22,20 @@ class Monitor(Thread):
         :param q: the telemetry data queue
         :param id: the monitor thread identifier
         :param enabled: a flag indicating if the monitor is enabled
+        :param spool: the spool of the locations not yet committed (optional)
+        :param filter: the stationary-point filter (None if disabled)
+        :param source: the monitored GPSD source (see AppConfig.gpsd_sources)
     """
 
-    def __init__(self, q, appconfig, name=""):
+    def __init__(self, q, appconfig, name="", spool=None, source=None):
 
         """ Initializes the monitor object
 
         :param q: the telemetry data queue
         :param appconfig: the application configuration object
         :param name: a name that can be attributed to the monitor
+        :param spool: the spool of the locations not yet committed (default: None)
+        :param source: the monitored GPSD source (default: None, the first configured source)
         """
 
         Thread.__init__(self)
@@ -40,6 +45,11 @@ class Monitor(Thread):
         self.q = q
         self.appconfig = appconfig
         self.enabled = False
+        self.spool = spool
+        self.source = source if source is not None else appconfig.get_gpsd_sources()[0]
+
+        # Suppress the redundant locations before they are queued
+        self.filter = filters.create_filter(appconfig)
 
 
     def init_connection(self):
@@ -49,7 +59,7 @@ class Monitor(Thread):
         try:
             
             # Attempts to create a connection to the GPSD server
-            gpsd.connect(self.appconfig.gpsd_ip_address, self.appconfig.gpsd_port)
+            gpsd.connect(self.source["gpsd_ip_address"], self.source["gpsd_port"])
 
             return 0
 
@@ -71,6 +81,16 @@ class Monitor(Thread):
 
         """ Runs the monitor infinite loop """
 
+        if self.appconfig.monitor_mode == "stream":
+            self.run_stream()
+        else:
+            self.run_poll()
+
+
+    def run_poll(self):
+
+        """ Polls the GPSD for the current location every monitor_delay seconds """
+
         # Opens database connection
         rcode = self.init_connection()
 
@@ -86,6 +106,47 @@ class Monitor(Thread):
             logger.error("Failed to connect to the GPS deamon")
 
 
+    def run_stream(self):
+
+        """ Subscribes to the GPSD report stream and reports every TPV report
+            as soon as it arrives. The reports already buffered are grouped in a
+            single batch (up to monitor_batch_size locations). If the connection
+            is lost, the monitor attempts to reconnect every monitor_delay seconds
+            until stopped.
+        """
+
+        stream = gpsd_stream.GPSDStream(self.source["gpsd_ip_address"], self.source["gpsd_port"])
+
+        while (self.running.isSet()):
+
+            if stream.connect() != 0:
+                logger.error(f"Failed to connect to the GPS deamon ({self.source['name']})")
+                time.sleep(self.appconfig.monitor_delay)
+                continue
+
+            batch = location.LocationBatch()
+
+            for report in stream.reports():
+
+                if not self.running.isSet():
+                    break
+
+                # The read timeout expired without any new report
+                if report is not None:
+                    for loc in self.filter_location(gpsd_stream.location_from_tpv(report, device_id=self.source["device_id"])):
+                        batch.append(loc)
+
+                # Report the batch as soon as no other report is immediately available
+                if len(batch) > 0 and (report is None or not stream.pending() or len(batch) >= self.appconfig.monitor_batch_size):
+                    self.report_batch(batch)
+                    batch = location.LocationBatch()
+
+            if len(batch) > 0:
+                self.report_batch(batch)
+
+            stream.close()
+
+
     def report_current_location(self):
 
         """ Gets the current location data from the GPSD and reports it to
@@ -115,12 +176,66 @@ class Monitor(Thread):
                 climb = packet.climb
 
             loc = location.Location(latitude=latitude, longitude=longitude, altitude=altitude, heading=track, \
-                climb=climb, horizontal_speed=hspeed, mode=mode, utc_time=utc_time)
-            
-            logger.debug(str(loc))         # TODO: remove after DEBUG
-            
-            # Put the location instance in the shared queue
-            self.q.put(loc)
+                climb=climb, horizontal_speed=hspeed, mode=mode, utc_time=utc_time, device_id=self.source["device_id"])
+
+            return self.report_location(loc)
+
+        except Exception as inst:
+            logger.error(f'Type: {type(inst)} -- Args: {inst.args} -- Instance: {inst}')
+            return -1
+
+
+    def report_location(self, loc):
+
+        """ Reports a location object to the shared queue
+
+            :param loc: the location object
+            :return: 0 if success or -1 if an exception arises
+        """
+
+        logger.debug(str(loc))         # TODO: remove after DEBUG
+
+        locations = self.filter_location(loc)
+        if not locations:
+            return 0
+
+        return self.report_batch(location.LocationBatch(locations))
+
+
+    def filter_location(self, loc):
+
+        """ Applies the stationary-point filter to a location object, if enabled
+
+            :param loc: the location object
+            :return: the list of location objects to report
+        """
+
+        if self.filter is None:
+            return [loc]
+
+        return self.filter.process(loc)
+
+
+    def report_batch(self, batch):
+
+        """ Reports a batch of locations to the shared queue
+
+            :param batch: the location batch
+            :return: 0 if success or -1 if an exception arises
+        """
+
+        try:
+
+            # Persist the locations until the recorder commits them (the monitors of a worker share its
+            # spool, the batches may be queued in a different order than they are spooled)
+            if self.spool is not None:
+                self.spool.append(batch)
+
+            # Put the location batch in the shared queue, the dropped locations will never be committed
+            if self.spool is not None:
+                self.q.put(batch, on_drop=self.release_dropped)
+            else:
+                self.q.put(batch)
 
             return 0
 
@@ -129,6 +244,18 @@ class Monitor(Thread):
             return -1
 
 
+    def release_dropped(self, item):
+
+        """ Releases the locations dropped by the queue from the spool, so that its checkpoint
+            is not held back and they are not replayed at the next startup
+
+            :param item: the dropped location batch
+        """
+
+        if isinstance(item, location.LocationBatch) and len(item) > 0:
+            self.spool.release(item.seq)
+
+
     def stop(self):
 
         """Stops the monitor thread"""
@@ -137,3 +264,6 @@ class Monitor(Thread):
 
         # disable the monitor
         self.enabled = False
+
+        if self.filter is not None:
+            logger.info(f"Stationary filter: {self.filter.passed} locations reported, {self.filter.suppressed} suppressed")
@@ -0,0 +1,330 @@
+from core import database, filters, gpsd_stream, location, recorder, ring_buffer, rollover
+
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import json
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# The maximum length of a GPSD report line
+STREAM_LIMIT = 1048576
+
+# Returned by the buffering stage when no location arrived before the batch deadline
+TIMEOUT = object()
+
+
+async def put_location(appconfig, fixes, loc):
+
+    """ Puts a location object to the bounded fixes queue, applying the overflow policy
+        when it is full ('spill' waits for a free place like 'block')
+
+        :param appconfig: the application configuration object
+        :param fixes: the asyncio queue receiving the location objects
+        :param loc: the location object
+        :return: True if the location was queued, False if it was dropped
+    """
+
+    if not fixes.full() or appconfig.queue_overflow_policy not in (ring_buffer.DROP_OLDEST, ring_buffer.DROP_NEWEST):
+        await fixes.put(loc)
+        return True
+
+    if appconfig.queue_overflow_policy == ring_buffer.DROP_NEWEST:
+        return False
+
+    fixes.get_nowait()
+    fixes.put_nowait(loc)
+    return True
+
+
+async def read_gpsd(appconfig, fixes, source=None):
+
+    """ Subscribes to the GPSD report stream and puts every TPV report to the fixes queue
+        as a Location object, through the stationary-point filter if enabled. If the
+        connection is lost, the reader attempts to reconnect every monitor_delay seconds
+        until cancelled.
+
+        :param appconfig: the application configuration object
+        :param fixes: the asyncio queue receiving the location objects
+        :param source: the GPSD source (default: None, the first configured source)
+    """
+
+    if source is None:
+        source = appconfig.get_gpsd_sources()[0]
+
+    stationary_filter = filters.create_filter(appconfig)
+
+    while True:
+
+        try:
+            reader, writer = await asyncio.open_connection(source["gpsd_ip_address"], source["gpsd_port"], limit=STREAM_LIMIT)
+        except OSError as error:
+            logger.error(f"Failed to connect to the GPS deamon ({source['name']}): {str(error)}")
+            await asyncio.sleep(appconfig.monitor_delay)
+            continue
+
+        try:
+            writer.write(gpsd_stream.WATCH_COMMAND.encode())
+            await writer.drain()
+
+            while True:
+                line = await reader.readline()
+
+                # The server has closed the connection
+                if not line:
+                    break
+
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    logger.debug(f"Malformed GPSD report skipped: {line[:80]}")
+                    continue
+
+                if isinstance(report, dict) and report.get('class') == 'TPV':
+                    loc = gpsd_stream.location_from_tpv(report, device_id=source["device_id"])
+
+                    for loc in ([loc] if stationary_filter is None else stationary_filter.process(loc)):
+                        if not await put_location(appconfig, fixes, loc):
+                            logger.debug(f"Location dropped, the queue is full ({source['name']})")
+
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as error:
+            logger.error(f"Exception: {str(error)}")
+
+        finally:
+            writer.close()
+
+        await asyncio.sleep(appconfig.monitor_delay)
+
+
+async def buffer_locations(appconfig, fixes, batches):
+
+    """ Groups the location objects of the fixes queue into batches. A batch is released
+        to the batches queue as soon as it holds recorder_batch_size locations or its first
+        location is older than recorder_interval seconds. A None item ends the stage
+        after the pending batch is released.
+
+        :param appconfig: the application configuration object
+        :param fixes: the asyncio queue of location objects
+        :param batches: the asyncio queue receiving the location batches
+    """
+
+    loop = asyncio.get_running_loop()
+    batch = location.LocationBatch()
+    deadline = None
+
+    while True:
+
+        try:
+            if deadline is None:
+                loc = await fixes.get()
+            else:
+                loc = await asyncio.wait_for(fixes.get(), max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            loc = TIMEOUT
+
+        if loc is None:
+            if len(batch) > 0:
+                await batches.put(batch)
+            await batches.put(None)
+            return
+
+        if loc is not TIMEOUT:
+            if len(batch) == 0:
+                deadline = loop.time() + appconfig.recorder_interval
+            batch.append(loc)
+
+        if len(batch) > 0 and (len(batch) >= appconfig.recorder_batch_size or loop.time() >= deadline):
+            await batches.put(batch)
+            batch = location.LocationBatch()
+            deadline = None
+
+
+class AsyncRecorder():
+
+    """ Stores the batches of location objects to the database. The blocking SQLite calls
+        run in a single-thread executor so that the connection is always used from the
+        same thread.
+
+        :param appconfig: the application configuration object
+        :param executor: the executor running the database calls
+        :param connection_handler: the connection handler object
+        :param session_id: the identifier of the current session
+        :param rollover: the rollover of the database files (if enabled)
+        :param blocks: the open block held in memory ('blocks' storage layout, None otherwise)
+    """
+
+    def __init__(self, appconfig):
+
+        """ Initializes the recorder object
+
+            :param appconfig: the application configuration object
+        """
+
+        self.appconfig = appconfig
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.connection_handler = None
+        self.session_id = 1
+        self.rollover = None
+        self.blocks = None
+        if appconfig.storage_layout == database.BLOCKS:
+            self.blocks = recorder.BlockBuffer(appconfig.storage_block_size, appconfig.storage_block_interval)
+
+
+    def open(self):
+
+        """ Opens the database connection, creates the datatables and the new session
+
+            :return: 0 if success, -1 if the connection or the schema migration fails
+        """
+
+        if self.appconfig.rollover_policy is not None:
+            self.rollover = rollover.Rollover(self.appconfig.database_filename, self.appconfig.rollover_policy, \
+                max_rows=self.appconfig.rollover_rows, read_only=self.appconfig.rollover_read_only, \
+                storage_profile=self.appconfig.storage_profile, session_table_name=self.appconfig.session_tablename, \
+                location_table_name=self.appconfig.location_tablename)
+            self.connection_handler = self.rollover.open()
+
+            if self.connection_handler is None:
+                return -1
+
+        else:
+            self.connection_handler = database.connect(db_filename=self.appconfig.database_filename, storage_profile=self.appconfig.storage_profile)
+
+            if self.connection_handler is None:
+                return -1
+
+            database.create_tables(self.connection_handler, session_table_name=self.appconfig.session_tablename, \
+                location_table_name=self.appconfig.location_tablename)
+
+            if database.migrate(self.connection_handler, location_table_name=self.appconfig.location_tablename, \
+                session_table_name=self.appconfig.session_tablename) == -1:
+                return -1
+
+        if self.appconfig.enable_new_session:
+            database.create_new_session(self.connection_handler, session_tablename=self.appconfig.session_tablename)
+
+        self.session_id = database.get_newest_session_id(self.connection_handler, session_tablename=self.appconfig.session_tablename)
+        return 0
+
+
+    def write(self, batch, flush=False):
+
+        """ Inserts a batch of locations into the location datatable (with the 'blocks' layout,
+            the locations are held in the open block until it is full or due)
+
+            :param batch: the location batch
+            :param flush: a flag forcing the write of the open block (default: False)
+            :return: the list of inserted records
+        """
+
+        if self.blocks is not None:
+            batch = self.blocks.add(batch, flush=flush)
+            if batch is None:
+                return []
+
+        data = list(batch.rows(self.session_id))
+
+        if data:
+            if self.appconfig.storage_layout == database.BLOCKS:
+                count = database.insert_location_blocks(self.connection_handler, data, location_table_name=self.appconfig.location_tablename, \
+                    session_table_name=self.appconfig.session_tablename, block_size=self.appconfig.storage_block_size)
+            else:
+                count = database.insert_location_data(self.connection_handler, data, location_table_name=self.appconfig.location_tablename, \
+                    method=self.appconfig.insert_method, session_table_name=self.appconfig.session_tablename)
+
+            if self.rollover is not None and count > 0:
+                self.connection_handler = self.rollover.after_insert(self.connection_handler, count)
+
+        return data
+
+
+    def close(self):
+
+        """Reports the end of the current session and closes the database connection"""
+
+        try:
+            if self.blocks is not None:
+                self.write(location.LocationBatch(), flush=True)
+
+        finally:
+            database.update_session_end_timestamp(self.connection_handler, self.session_id, session_tablename=self.appconfig.session_tablename)
+
+            if self.rollover is not None:
+                self.rollover.close(self.connection_handler)
+            else:
+                database.disconnect(self.connection_handler)
+
+
+    async def run(self, batches):
+
+        """ Runs the recorder until a None item is received from the batches queue
+
+            :param batches: the asyncio queue of location batches
+        """
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            rcode = await loop.run_in_executor(self.executor, self.open)
+
+            if rcode != 0:
+                logger.error("Failed to initialize database connection")
+                return
+
+            # The session is closed even if a write fails or the recorder is cancelled
+            try:
+                while True:
+                    batch = await batches.get()
+
+                    if batch is None:
+                        break
+
+                    await loop.run_in_executor(self.executor, self.write, batch)
+
+            finally:
+                await loop.run_in_executor(self.executor, self.close)
+
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+async def run(appconfig):
+
+    """ Runs the GPSD readers (one per source), the buffering stage and the database writer
+        on the current event loop. When cancelled, the readers are stopped first and the
+        buffered locations are stored before the coroutine returns.
+
+        :param appconfig: the application configuration object
+    """
+
+    # Bounded like the ring buffer of the threads: queue_capacity locations, as locations then as batches
+    fixes = asyncio.Queue(maxsize=appconfig.queue_capacity)
+    batches = asyncio.Queue(maxsize=max(1, appconfig.queue_capacity // appconfig.recorder_batch_size))
+
+    arecorder = AsyncRecorder(appconfig)
+
+    readers = [asyncio.create_task(read_gpsd(appconfig, fixes, source)) for source in appconfig.get_gpsd_sources()]
+    buffer = asyncio.create_task(buffer_locations(appconfig, fixes, batches))
+    writer = asyncio.create_task(arecorder.run(batches))
+
+    try:
+        await asyncio.wait(readers + [writer], return_when=asyncio.FIRST_COMPLETED)
+
+    finally:
+        logger.info("Stopping the asyncio pipeline... (This may take few seconds)")
+
+        # Stop the readers, then drain the buffer and the writer
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+        # The writer has stopped (e.g., the database cannot be opened), the bounded queues are not drained anymore
+        if writer.done():
+            buffer.cancel()
+        else:
+            await fixes.put(None)
+        await asyncio.gather(buffer, writer, return_exceptions=True)
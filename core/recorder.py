@@ -1,8 +1,9 @@
 
-from core import database
+from core import database, location, rollover
 
 from threading import Thread, Event, currentThread
 
+import queue
 import time
 import logging
 
@@ -11,6 +12,127 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class FlushPolicy():
+
+    """ Decides how many locations the recorder commits at once. A batch is committed as soon
+        as it holds batch_size locations or its first location waited max_latency seconds.
+        In adaptive mode, the batch size follows the observed arrival rate and commit time:
+        it is the number of locations expected within max_latency, and it grows when the
+        commits get slower so that the recorder never spends more than half its time committing.
+
+        :param min_batch_size: the minimum batch size
+        :param max_batch_size: the maximum batch size
+        :param max_latency: the maximum time a location waits before being committed, in seconds
+        :param adaptive: a flag indicating if the batch size adapts to the observed load
+        :param smoothing: the smoothing factor of the arrival rate and commit time averages
+        :param batch_size: the current batch size
+        :param arrival_rate: the average arrival rate, in locations per second
+        :param commit_time: the average commit time, in seconds
+    """
+
+    def __init__(self, max_batch_size, max_latency, min_batch_size=1, adaptive=True, smoothing=0.2):
+
+        """ Initializes the flush policy
+
+            :param max_batch_size: the maximum batch size
+            :param max_latency: the maximum time a location waits before being committed, in seconds
+            :param min_batch_size: the minimum batch size (default: 1)
+            :param adaptive: a flag indicating if the batch size adapts to the observed load (default: True)
+            :param smoothing: the smoothing factor of the averages (default: 0.2)
+        """
+
+        self.min_batch_size = max(1, min(min_batch_size, max_batch_size))
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.adaptive = adaptive
+        self.smoothing = smoothing
+        self.batch_size = max_batch_size
+        self.arrival_rate = None
+        self.commit_time = None
+
+
+    def _average(self, average, value):
+
+        return value if average is None else (1 - self.smoothing) * average + self.smoothing * value
+
+
+    def update(self, count, elapsed, commit_time):
+
+        """ Updates the statistics after a commit and computes the next batch size
+
+            :param count: the number of committed locations
+            :param elapsed: the time the batch took to collect, from its first location, in seconds
+                            (the idle time before the first location does not lower the arrival rate)
+            :param commit_time: the duration of the commit, in seconds
+            :return: the next batch size
+        """
+
+        if not self.adaptive or elapsed <= 0:
+            return self.batch_size
+
+        self.arrival_rate = self._average(self.arrival_rate, count / elapsed)
+        self.commit_time = self._average(self.commit_time, commit_time)
+
+        target = max(self.arrival_rate * self.max_latency, 2 * self.arrival_rate * self.commit_time)
+        self.batch_size = int(min(self.max_batch_size, max(self.min_batch_size, round(target))))
+
+        return self.batch_size
+
+
+class BlockBuffer():
+
+    """ Holds the open block of the 'blocks' storage layout in memory. The locations are
+        written at once when they fill a block or when the oldest one was held for
+        flush_interval seconds, instead of decoding and rewriting the last block of the
+        session on every commit. The held locations are not committed yet (they are only
+        released from the spool once written).
+
+        :param block_size: the number of locations of a full block
+        :param flush_interval: the maximum time a location is held, in seconds
+        :param batch: the held locations
+        :param opened: the time the first held location was added
+    """
+
+    def __init__(self, block_size, flush_interval):
+
+        """ Initializes the block buffer
+
+            :param block_size: the number of locations of a full block
+            :param flush_interval: the maximum time a location is held, in seconds
+        """
+
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.batch = location.LocationBatch()
+        self.opened = None
+
+
+    def add(self, batch, flush=False):
+
+        """ Adds locations to the open block and releases the held locations if the block is
+            full or due
+
+            :param batch: the location batch (possibly empty, to check if the block is due)
+            :param flush: a flag forcing the release of the held locations
+            :return: the location batch to write or None if the block stays open
+        """
+
+        if len(batch) > 0:
+            if len(self.batch) == 0:
+                self.opened = time.monotonic()
+            self.batch.extend(batch)
+
+        if len(self.batch) == 0:
+            return None
+
+        if not flush and len(self.batch) < self.block_size and time.monotonic() - self.opened < self.flush_interval:
+            return None
+
+        batch = self.batch
+        self.batch = location.LocationBatch()
+        return batch
+
+
 class Recorder(Thread):
 
     """ Initiates a connection to the database to store telemetry data
@@ -21,15 +143,25 @@ class Recorder(Thread):
         :param q: the telemetry data queue
         :param id: the recorder thread identifier
         :param enabled: a flag indicating if the monitor is enabled
+        :param spool: the spool of the locations not yet committed (optional)
+        :param rollover: the rollover of the database files (if enabled)
+        :param primary: a flag indicating if the recorder creates the session (the first one of the workers)
+        :param session_ready: an event set by the primary recorder once the session is created (None if single worker)
+        :param failed: the locations of a failed insert, retried before the new ones
+        :param first_arrival: the time the first location of the last collected batch was dequeued
+        :param blocks: the open block held in memory ('blocks' storage layout, None otherwise)
     """
 
-    def __init__(self, q, appconfig, name=""):
+    def __init__(self, q, appconfig, name="", spool=None, primary=True, session_ready=None):
 
         """ Initializes the recorder object
 
         :param q: the telemetry data queue
         :param appconfig: the application configuration object
         :param name: a name that can be attributed to the monitor
+        :param spool: the spool of the locations not yet committed (default: None)
+        :param primary: a flag indicating if the recorder creates the session (default: True)
+        :param session_ready: an event shared by the recorder workers, set once the session is created (default: None)
         """
 
         Thread.__init__(self)
@@ -39,6 +171,15 @@ class Recorder(Thread):
         self.q = q
         self.appconfig = appconfig
         self.enabled = False
+        self.spool = spool
+        self.rollover = None
+        self.primary = primary
+        self.session_ready = session_ready
+        self.failed = location.LocationBatch()
+        self.first_arrival = None
+        self.blocks = None
+        if appconfig.storage_layout == database.BLOCKS:
+            self.blocks = BlockBuffer(appconfig.storage_block_size, appconfig.storage_block_interval)
 
 
     def init_connection(self):
@@ -46,25 +187,30 @@ class Recorder(Thread):
         """Initializes the database connection"""
 
         try:
+            # open the active database file of the rollover, which creates and upgrades it
+            if self.appconfig.rollover_policy is not None:
+                self.rollover = rollover.Rollover(self.appconfig.database_filename, self.appconfig.rollover_policy, \
+                    max_rows=self.appconfig.rollover_rows, read_only=self.appconfig.rollover_read_only, \
+                    storage_profile=self.appconfig.storage_profile, session_table_name=self.appconfig.session_tablename, \
+                    location_table_name=self.appconfig.location_tablename)
+                self.connection_handler = self.rollover.open()
+                return 0 if self.connection_handler is not None else -1
+
             # attempt to connect to database (create database if does not already exist)
-            self.connection_handler = database.connect(db_filename=self.appconfig.database_filename)
+            self.connection_handler = database.connect(db_filename=self.appconfig.database_filename, storage_profile=self.appconfig.storage_profile)
 
             # if no connection handler, then give up
             if self.connection_handler is None:
                 return -1
             else:
                 # create the datatables if they do not already exist
-                # session table
-                if not database.check_if_datatable_exists(connection_handler=self.connection_handler, table_name=self.appconfig.session_tablename):
-                
-                    # create the session datatable structure
-                    database.create_session_table(connection_handler=self.connection_handler, session_table_name=self.appconfig.session_tablename)
-                
-                # location table
-                if not database.check_if_datatable_exists(connection_handler=self.connection_handler, table_name=self.appconfig.location_tablename):
-                
-                    # create the location datatable structure
-                    database.create_location_table(connection_handler=self.connection_handler, location_table_name=self.appconfig.location_tablename, session_table_name=self.appconfig.session_tablename)
+                database.create_tables(self.connection_handler, session_table_name=self.appconfig.session_tablename, \
+                    location_table_name=self.appconfig.location_tablename)
+
+                # upgrade the database schema if needed
+                if database.migrate(self.connection_handler, location_table_name=self.appconfig.location_tablename, \
+                    session_table_name=self.appconfig.session_tablename) == -1:
+                    return -3
 
             return 0
 
@@ -86,65 +232,208 @@ class Recorder(Thread):
 
         """ Runs the recorder infinite loop """
 
+        # the other workers wait until the primary one has upgraded the database and created the session
+        if not self.primary and self.session_ready is not None:
+            while self.running.isSet() and not self.session_ready.wait(timeout=0.5):
+                pass
+
         # opens database connection
         rcode = self.init_connection()
 
         if rcode == 0:
 
+            # store the locations spooled but not committed by the previous run
+            if self.spool is not None:
+                self.replay_spool()
+
             self.session_id = 1
-            if self.appconfig.enable_new_session:
+            if self.appconfig.enable_new_session and self.primary:
                 database.create_new_session(self.connection_handler, session_tablename=self.appconfig.session_tablename)
             
             self.session_id = database.get_newest_session_id(self.connection_handler, session_tablename=self.appconfig.session_tablename)
 
+            if self.primary and self.session_ready is not None:
+                self.session_ready.set()
+
+            policy = FlushPolicy(self.appconfig.recorder_batch_size, self.appconfig.recorder_interval, \
+                min_batch_size=self.appconfig.recorder_min_batch_size, adaptive=self.appconfig.recorder_adaptive)
+
             # insert data in database
             while (self.running.isSet()):
-                self.insert_batch(self.appconfig.recorder_batch_size)
-                time.sleep(self.appconfig.recorder_interval)
+
+                # retry the locations of a failed insert before taking new ones
+                retry = len(self.failed) > 0
+                if retry:
+                    time.sleep(policy.max_latency)
+                    batch = self.failed
+                    self.failed = location.LocationBatch()
+                else:
+                    batch = self.collect_batch(policy.batch_size, policy.max_latency)
+
+                # sync the last spooled locations to disk, even if no new location is appended
+                if self.spool is not None:
+                    self.spool.sync()
+
+                if len(batch) == 0:
+                    # write the open block when it is due, even if no new location arrives
+                    if self.blocks is not None:
+                        self.write_batch(batch)
+                    continue
+
+                start = time.monotonic()
+                self.write_batch(batch)
+                end = time.monotonic()
+
+                # the arrival rate is measured over the collection of the batch
+                if not retry:
+                    policy.update(len(batch), start - self.first_arrival, end - start)
 
             # store the remaning telemetry records in queue before
-            # closing connection
-            if(self.enabled and not self.q.empty()):
-                self.insert_batch(1000)
+            # closing connection (the monitors are stopped first)
+            if len(self.failed) > 0:
+                batch = self.failed
+                self.failed = location.LocationBatch()
+                self.write_batch(batch)
+
+            while(not self.q.empty()):
+                self.insert_batch(self.appconfig.recorder_batch_size)
+
+            if self.blocks is not None:
+                self.write_batch(location.LocationBatch(), flush=True)
+
+            if len(self.failed) > 0:
+                logger.error(f"{len(self.failed)} locations could not be stored")
 
             # report the timestamp of the current session end
-            database.update_session_end_timestamp(self.connection_handler, self.session_id, session_tablename=self.appconfig.session_tablename)
+            if self.primary:
+                database.update_session_end_timestamp(self.connection_handler, self.session_id, session_tablename=self.appconfig.session_tablename)
 
             # close data connection
-            database.disconnect(self.connection_handler)
+            if self.rollover is not None:
+                self.rollover.close(self.connection_handler)
+            else:
+                database.disconnect(self.connection_handler)
             
         else:
             logger.error("Failed to initialize database connection")
 
+            # do not leave the other workers waiting
+            if self.primary and self.session_ready is not None:
+                self.session_ready.set()
+
 
     def insert_batch(self, size):
 
         """ Checks if it is possible to establish a connection to the database
 
-        :param size: maximum number of items to save in the database at once
+        :param size: maximum number of locations to save in the database at once
         :return: list of telemetry records to insert in the database
                  if success or None if failure or an exception arises
         """
 
         try:
-            i = 0
-            data = []
-            while(i < size and not self.q.empty()):
-                loc = self.q.get()
-                
-                arr = []
-                if loc.mode == 2:
-                    arr = (self.session_id, loc.latitude, loc.longitude, 'NULL', loc.heading, 'NULL', loc.horizontal_speed, loc.mode, loc.utc_time)
-                elif loc.mode >= 3:
-                    arr = (self.session_id, loc.latitude, loc.longitude, loc.altitude, loc.heading, loc.climb, loc.horizontal_speed, loc.mode, loc.utc_time)
-
-                if arr != []:
-                    data.append(arr)
-                
-                i += 1
-
-            if data != []:
-                database.insert_location_data(self.connection_handler, data, location_table_name=self.appconfig.location_tablename)
+            batch = location.LocationBatch()
+            while(len(batch) < size and not self.q.empty()):
+                self.add_to_batch(batch, self.q.get())
+
+            return self.write_batch(batch)
+
+        except Exception as inst:
+            logger.error(f'Type: {type(inst)} -- Args: {inst.args} -- Instance: {inst}')
+            return []
+
+
+    def add_to_batch(self, batch, item):
+
+        """ Appends a queue item to a location batch
+
+            :param batch: the location batch
+            :param item: the queue item, a location batch (or a single location object)
+        """
+
+        if isinstance(item, location.LocationBatch):
+            batch.extend(item)
+        else:
+            batch.append(item)
+
+
+    def collect_batch(self, size, max_latency):
+
+        """ Blocks on the queue until size locations are collected or the first collected
+            location waited max_latency seconds. If the queue stays empty, an empty batch
+            is returned after max_latency seconds so that the caller can check its stop condition.
+
+            :param size: the number of locations that triggers the commit
+            :param max_latency: the maximum waiting time of a location, in seconds
+            :return: the location batch
+        """
+
+        batch = location.LocationBatch()
+        deadline = time.monotonic() + max_latency
+
+        while len(batch) < size:
+
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                if hasattr(self.q, "get_many"):
+                    items = self.q.get_many(size - len(batch), timeout=timeout)
+                else:
+                    items = [self.q.get(timeout=timeout)]
+            except queue.Empty:
+                break
+
+            # The deadline starts with the first collected location
+            if len(batch) == 0:
+                self.first_arrival = time.monotonic()
+                deadline = self.first_arrival + max_latency
+
+            for item in items:
+                self.add_to_batch(batch, item)
+
+        return batch
+
+
+    def write_batch(self, batch, flush=False):
+
+        """ Inserts a location batch into the location datatable. With the 'blocks' layout,
+            the locations are held in the open block until it is full or due.
+
+            :param batch: the location batch
+            :param flush: a flag forcing the write of the open block (default: False)
+            :return: list of telemetry records inserted in the database
+                     or an empty list if an exception arises (or if the locations are held)
+        """
+
+        count = 0
+
+        if self.blocks is not None:
+            batch = self.blocks.add(batch, flush=flush)
+            if batch is None:
+                return []
+
+        try:
+            data = list(batch.rows(self.session_id))
+
+            if data != [] and self.appconfig.storage_layout == database.BLOCKS:
+                count = database.insert_location_blocks(self.connection_handler, data, location_table_name=self.appconfig.location_tablename, \
+                    session_table_name=self.appconfig.session_tablename, block_size=self.appconfig.storage_block_size)
+            elif data != []:
+                count = database.insert_location_data(self.connection_handler, data, location_table_name=self.appconfig.location_tablename, \
+                    method=self.appconfig.insert_method, session_table_name=self.appconfig.session_tablename)
+
+            # keep the locations of a failed insert for a retry (they are not released from the spool),
+            # the spooled locations are committed otherwise, release them
+            if count == -1:
+                self.failed.extend(batch)
+            elif self.spool is not None and len(batch) > 0:
+                self.spool.release(batch.seq)
+
+            # switch to a new database file if the active one is full
+            if self.rollover is not None and count > 0:
+                self.connection_handler = self.rollover.after_insert(self.connection_handler, count)
 
             # TODO: remove when debugging is done
             logger.debug(f'Current queue size: {self.q.qsize()}')
@@ -152,9 +441,38 @@ class Recorder(Thread):
 
         except Exception as inst:
             logger.error(f'Type: {type(inst)} -- Args: {inst.args} -- Instance: {inst}')
+
+            # the locations cannot be stored (e.g., malformed), do not hold the spool checkpoint back
+            if self.spool is not None and count != -1 and len(batch) > 0:
+                self.spool.release(batch.seq)
+
             return []
 
 
+    def replay_spool(self):
+
+        """ Stores the locations left in the spool by the previous run into the latest session
+
+            :return: the number of replayed locations
+        """
+
+        count = 0
+        self.session_id = database.get_newest_session_id(self.connection_handler, session_tablename=self.appconfig.session_tablename)
+
+        for batch in self.spool.replay(batch_size=self.appconfig.recorder_batch_size):
+            self.write_batch(batch)
+            count += len(batch)
+
+        # the replayed locations belong to the latest session, do not hold them until the new one
+        if self.blocks is not None:
+            self.write_batch(location.LocationBatch(), flush=True)
+
+        if count > 0:
+            logger.info(f"{count} spooled locations replayed into session {self.session_id}")
+
+        return count
+
+
     def stop(self):
 
         """Stops the recorder thread"""
@@ -0,0 +1,372 @@
+from core import location, gpsd_stream, monitor
+from helpers import generic
+
+from datetime import datetime, timezone
+
+import gzip
+import itertools
+import json
+import time
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Location sources of the application
+GPSD = "gpsd"
+REPLAY = "replay"
+
+SOURCES = (GPSD, REPLAY)
+
+# Replay log formats: GPSD JSON reports (e.g., recorded with 'gpspipe -w') or NMEA 0183 sentences
+GPSD_JSON = "json"
+NMEA = "nmea"
+
+# Replay speed sending the locations as fast as the recorder stores them
+MAX_SPEED = "max"
+
+# Magic bytes of a gzip file
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Knots to meters per second
+KNOTS_TO_MPS = 0.514444
+
+# Maximum time the replay sleeps before checking its stop condition, in seconds
+SLEEP_INTERVAL = 0.5
+
+
+def open_log(filename):
+
+    """ Opens a replay log for reading as text, decompressing it if it is gzip-compressed
+
+        :param filename: the log filename
+        :return: the text file object
+        :raises OSError: Missing or unreadable file
+    """
+
+    with open(filename, "rb") as f:
+        magic = f.read(len(GZIP_MAGIC))
+
+    if magic == GZIP_MAGIC:
+        return gzip.open(filename, "rt", encoding="ascii", errors="replace")
+
+    return open(filename, "r", encoding="ascii", errors="replace")
+
+
+def detect_format(line):
+
+    """ Detects the format of a replay log from its first line
+
+        :param line: the first non-empty line
+        :return: 'json' or 'nmea'
+        :raises ValueError: Unknown format
+    """
+
+    if line.startswith("{"):
+        return GPSD_JSON
+    elif line.startswith("$") or line.startswith("!"):
+        return NMEA
+
+    raise ValueError(f"Unknown replay log format: {line[:40]}")
+
+
+def iter_gpsd_locations(lines, device_id=None):
+
+    """ Parses GPSD JSON reports, one per line, into location objects (TPV reports only)
+
+        :param lines: an iterable of lines
+        :param device_id: the identifier given to the locations (default: None)
+        :return: a generator of location objects
+    """
+
+    for line in lines:
+
+        try:
+            report = json.loads(line)
+        except ValueError:
+            continue
+
+        if isinstance(report, dict) and report.get('class') == 'TPV':
+            yield gpsd_stream.location_from_tpv(report, device_id=device_id)
+
+
+def nmea_fields(line):
+
+    """ Checks an NMEA sentence and splits it into fields
+
+        :param line: the NMEA sentence
+        :return: the list of fields (the first one is the talker and sentence identifier)
+                 or None if the sentence is malformed or its checksum does not match
+    """
+
+    line = line.strip()
+
+    if len(line) < 6 or line[0] not in "$!":
+        return None
+
+    body, _, checksum = line[1:].partition("*")
+
+    if checksum:
+        value = 0
+        for c in body:
+            value ^= ord(c)
+        try:
+            if value != int(checksum[:2], 16):
+                return None
+        except ValueError:
+            return None
+
+    return body.split(",")
+
+
+def nmea_coordinate(value, hemisphere):
+
+    """ Converts an NMEA coordinate ((d)ddmm.mmmm and hemisphere) into decimal degrees
+
+        :return: the coordinate or None if missing
+    """
+
+    if not value or not hemisphere:
+        return None
+
+    point = value.index(".") if "." in value else len(value)
+    degrees = float(value[:point - 2]) + float(value[point - 2:]) / 60
+
+    return -degrees if hemisphere in "SW" else degrees
+
+
+def nmea_float(value):
+
+    return float(value) if value else None
+
+
+def iter_nmea_locations(lines, device_id=None):
+
+    """ Parses NMEA RMC and GGA sentences into location objects. The sentences of the same
+        epoch (UTC time) are merged: RMC provides the date, speed and heading, GGA the
+        altitude and fix quality. The epochs before the first date are skipped.
+
+        :param lines: an iterable of lines
+        :param device_id: the identifier given to the locations (default: None)
+        :return: a generator of location objects
+    """
+
+    date = None
+    epoch = None
+    fix = {}
+
+    def make_location():
+
+        if date is None or fix.get("latitude") is None or fix.get("longitude") is None:
+            return None
+
+        hours, minutes, seconds = int(epoch[0:2]), int(epoch[2:4]), float(epoch[4:])
+        dt = datetime(date[0], date[1], date[2], hours, minutes, int(seconds), tzinfo=timezone.utc)
+        utc_time = generic.epoch_ms_to_iso(round(dt.timestamp() * 1000 + (seconds % 1) * 1000))
+
+        if not fix.get("valid", True):
+            mode = 1
+        elif fix.get("altitude") is not None:
+            mode = 3
+        else:
+            mode = 2
+
+        return location.Location(latitude=fix["latitude"], longitude=fix["longitude"], altitude=fix.get("altitude"), \
+            heading=fix.get("heading"), climb=None, horizontal_speed=fix.get("speed"), mode=mode, utc_time=utc_time, \
+            device_id=device_id)
+
+    for line in lines:
+
+        fields = nmea_fields(line)
+
+        if fields is None or len(fields[0]) < 5:
+            continue
+
+        sentence = fields[0][-3:]
+
+        if sentence not in ("RMC", "GGA") or len(fields) < 10 or not fields[1]:
+            continue
+
+        time_field = fields[1]
+
+        try:
+            # A new epoch starts: emit the previous one
+            if time_field != epoch:
+                if epoch is not None:
+                    loc = make_location()
+                    if loc is not None:
+                        yield loc
+                epoch = time_field
+                fix = {}
+
+            if sentence == "RMC":
+                if fields[9]:
+                    year = int(fields[9][4:6])
+                    date = (2000 + year if year < 80 else 1900 + year, int(fields[9][2:4]), int(fields[9][0:2]))
+                fix["valid"] = fix.get("valid", True) and fields[2] == "A"
+                fix["latitude"] = nmea_coordinate(fields[3], fields[4])
+                fix["longitude"] = nmea_coordinate(fields[5], fields[6])
+                speed = nmea_float(fields[7])
+                fix["speed"] = None if speed is None else speed * KNOTS_TO_MPS
+                fix["heading"] = nmea_float(fields[8])
+
+            else:
+                quality = int(fields[6] or 0)
+                fix["valid"] = fix.get("valid", True) and quality > 0
+                fix.setdefault("latitude", nmea_coordinate(fields[2], fields[3]))
+                fix.setdefault("longitude", nmea_coordinate(fields[4], fields[5]))
+                fix["altitude"] = nmea_float(fields[9]) if quality > 0 else None
+
+        except ValueError:
+            logger.debug(f"Malformed NMEA sentence skipped: {line[:80]}")
+
+    if epoch is not None:
+        loc = make_location()
+        if loc is not None:
+            yield loc
+
+
+def iter_log_locations(filename, log_format=None, device_id=None):
+
+    """ Streams the locations of a GPSD JSON or NMEA log (optionally gzip-compressed)
+
+        :param filename: the log filename
+        :param log_format: 'json' or 'nmea' (default: None, detected from the first line)
+        :param device_id: the identifier given to the locations (default: None)
+        :return: a generator of location objects
+        :raises OSError: Missing or unreadable file
+        :raises ValueError: Unknown format
+    """
+
+    with open_log(filename) as log:
+
+        # The format is detected from the first non-empty line, which is parsed as well
+        first = ""
+        for first in log:
+            if first.strip():
+                break
+
+        if log_format is None:
+            log_format = detect_format(first.strip())
+
+        lines = itertools.chain([first], log)
+
+        if log_format == GPSD_JSON:
+            yield from iter_gpsd_locations(lines, device_id=device_id)
+        elif log_format == NMEA:
+            yield from iter_nmea_locations(lines, device_id=device_id)
+        else:
+            raise ValueError(f"Unknown replay log format: {log_format}")
+
+
+def parse_speed(speed):
+
+    """ Parses a replay speed
+
+        :param speed: a speed factor (1 for real time, N for N times faster) or 'max'
+        :return: the speed factor or None for the maximum speed
+        :raises ValueError: Invalid speed
+    """
+
+    if speed is None or speed == MAX_SPEED:
+        return None
+
+    speed = float(speed)
+
+    if speed <= 0:
+        raise ValueError(f"Invalid replay speed: {speed}")
+
+    return speed
+
+
+class ReplaySource(monitor.Monitor):
+
+    """ Replays a recorded GPSD JSON or NMEA log in place of the GPSD monitor: the locations
+        go through the same filter, spool and queue as the live ones. The locations are
+        reported at their recorded pace divided by the replay speed; at the maximum speed,
+        they are reported in batches of recorder_batch_size locations. The thread ends with
+        the log.
+
+        :param filename: the replayed log filename
+        :param speed: the speed factor (None for the maximum speed)
+        :param replayed: the number of replayed locations
+    """
+
+    def __init__(self, q, appconfig, name="", spool=None, source=None):
+
+        """ Initializes the replay source
+
+        :param q: the telemetry data queue
+        :param appconfig: the application configuration object
+        :param name: a name that can be attributed to the source
+        :param spool: the spool of the locations not yet committed (default: None)
+        :param source: the replayed source, for its device identifier (default: None, the first configured source)
+        """
+
+        monitor.Monitor.__init__(self, q, appconfig, name=name, spool=spool, source=source)
+        self.filename = appconfig.replay_file
+        self.speed = parse_speed(appconfig.replay_speed)
+        self.replayed = 0
+
+
+    def run(self):
+
+        """ Runs the replay until the end of the log or until stopped """
+
+        try:
+            self.replay(iter_log_locations(self.filename, device_id=self.source["device_id"]))
+
+        except (OSError, ValueError) as error:
+            logger.error(f"Exception: {str(error)}")
+
+        logger.info(f"{self.replayed} locations replayed from {self.filename}")
+
+
+    def replay(self, locations):
+
+        """ Reports the locations at the replay speed
+
+            :param locations: an iterable of location objects
+        """
+
+        batch = location.LocationBatch()
+        max_batch_size = self.appconfig.recorder_batch_size
+
+        start_time = None
+        start_clock = None
+
+        for loc in locations:
+
+            if not self.running.isSet():
+                break
+
+            # Wait until the location is due (the late locations are reported at once)
+            if self.speed is not None:
+                utc_time = generic.iso_to_epoch_ms(loc.utc_time)
+
+                if utc_time >= 0:
+                    if start_time is None:
+                        start_time = utc_time
+                        start_clock = time.monotonic()
+
+                    due = start_clock + (utc_time - start_time) / 1000 / self.speed
+                    if due > time.monotonic() and len(batch) > 0:
+                        self.report_batch(batch)
+                        batch = location.LocationBatch()
+
+                    while self.running.isSet() and due > time.monotonic():
+                        time.sleep(min(SLEEP_INTERVAL, due - time.monotonic()))
+
+            for filtered in self.filter_location(loc):
+                batch.append(filtered)
+
+            self.replayed += 1
+
+            if len(batch) >= max_batch_size:
+                self.report_batch(batch)
+                batch = location.LocationBatch()
+
+        if len(batch) > 0:
+            self.report_batch(batch)
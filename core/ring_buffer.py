@@ -0,0 +1,315 @@
+from core import location
+
+from collections import deque
+from threading import Condition
+
+import os
+import pickle
+import queue
+import struct
+import tempfile
+import time
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Overflow policies
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+SPILL = "spill"
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, SPILL)
+
+# Header of a spilled item: the length of the pickled item
+SPILL_HEADER = struct.Struct("<I")
+
+
+def item_size(item):
+
+    """ Returns the number of locations held by a queue item
+
+        :param item: a location batch or a single location object
+        :return: the number of locations
+    """
+
+    if isinstance(item, location.LocationBatch):
+        return len(item)
+
+    return 1
+
+
+class RingBuffer():
+
+    """ A bounded in-process queue between the monitor and the recorder. Unlike a
+        multiprocessing queue, the items are neither pickled nor sent through a pipe.
+        The capacity is expressed in locations (a location batch counts for its length).
+        When the buffer is full, the overflow policy decides what happens to new items:
+
+        - block: the producer waits until there is enough room
+        - drop_oldest: the oldest items are dropped to make room
+        - drop_newest: the new item is dropped
+        - spill: the new items are appended to a spill file and read back in order
+
+        :param capacity: the maximum number of buffered locations
+        :param overflow_policy: the overflow policy
+        :param size: the number of buffered locations
+        :param dropped: the number of dropped locations
+        :param spilled: the number of locations written to the spill file
+        :param high_water: the highest number of buffered locations (including the spilled ones)
+    """
+
+    def __init__(self, capacity=100000, overflow_policy=BLOCK, spill_directory=None):
+
+        """ Initializes the ring buffer
+
+            :param capacity: the maximum number of buffered locations (default: 100000)
+            :param overflow_policy: 'block', 'drop_oldest', 'drop_newest' or 'spill' (default: 'block')
+            :param spill_directory: the directory of the spill file (default: the temporary directory)
+        """
+
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.capacity = max(1, capacity)
+        self.overflow_policy = overflow_policy
+        self.spill_directory = spill_directory
+
+        self.items = deque()
+        self.size = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+
+        # Spill file state
+        self.spill_file = None
+        self.spill_items = 0
+        self.spill_locations = 0
+        self.spill_read_offset = 0
+
+        self.lock = Condition()
+
+
+    def put(self, item, block=True, timeout=None, on_drop=None):
+
+        """ Puts an item (a location batch or a location object) into the buffer
+
+            :param item: the item
+            :param block: a flag indicating if the producer may wait for room ('block' policy)
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :param on_drop: a function called with each dropped item, the new one ('drop_newest'
+                            policy) or the oldest ones ('drop_oldest' policy) (default: None)
+            :return: True if the item was buffered (or spilled), False if it was dropped
+            :raises queue.Full: No room left before the timeout expired ('block' policy)
+        """
+
+        count = item_size(item)
+
+        with self.lock:
+
+            if self.spill_items > 0 or (self.size + count > self.capacity and self.size > 0):
+
+                if self.overflow_policy == SPILL:
+                    self._spill(item, count)
+                    self.lock.notify_all()
+                    return True
+
+                elif self.overflow_policy == DROP_NEWEST:
+                    self.dropped += count
+                    if on_drop is not None:
+                        on_drop(item)
+                    return False
+
+                elif self.overflow_policy == DROP_OLDEST:
+                    while self.items and self.size + count > self.capacity:
+                        oldest = self.items.popleft()
+                        self.dropped += item_size(oldest)
+                        self.size -= item_size(oldest)
+                        if on_drop is not None:
+                            on_drop(oldest)
+
+                else:
+                    if not block:
+                        raise queue.Full
+
+                    deadline = None if timeout is None else time.monotonic() + timeout
+
+                    while self.size > 0 and self.size + count > self.capacity:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise queue.Full
+                        self.lock.wait(remaining)
+
+            self.items.append(item)
+            self.size += count
+            self.high_water = max(self.high_water, self.size)
+            self.lock.notify_all()
+            return True
+
+
+    def get(self, block=True, timeout=None):
+
+        """ Removes and returns the oldest item of the buffer
+
+            :param block: a flag indicating if the consumer may wait for an item
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :return: the oldest item
+            :raises queue.Empty: No item available before the timeout expired
+        """
+
+        with self.lock:
+
+            if not self._wait_for_items(block, timeout):
+                raise queue.Empty
+
+            return self._pop()
+
+
+    def get_many(self, max_locations, block=True, timeout=None):
+
+        """ Removes and returns the oldest items, up to max_locations locations
+            (at least one item is returned, whatever its size)
+
+            :param max_locations: the maximum number of locations to dequeue
+            :param block: a flag indicating if the consumer may wait for an item
+            :param timeout: the maximum waiting time, in seconds (default: None, no limit)
+            :return: the list of dequeued items
+            :raises queue.Empty: No item available before the timeout expired
+        """
+
+        with self.lock:
+
+            if not self._wait_for_items(block, timeout):
+                raise queue.Empty
+
+            items = [self._pop()]
+            count = item_size(items[0])
+
+            while self.items and count + item_size(self.items[0]) <= max_locations:
+                items.append(self._pop())
+                count += item_size(items[-1])
+
+            return items
+
+
+    def qsize(self):
+
+        """ Returns the number of buffered locations, including the spilled ones """
+
+        with self.lock:
+            return self.size + self.spill_locations
+
+
+    def empty(self):
+
+        """ Checks if the buffer (and its spill file) is empty """
+
+        with self.lock:
+            return self.size == 0 and self.spill_items == 0
+
+
+    def stats(self):
+
+        """ Returns the buffer counters
+
+            :return: a dictionary holding the counters
+        """
+
+        with self.lock:
+            return {
+                "size": self.size + self.spill_locations,
+                "capacity": self.capacity,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "high_water": self.high_water
+            }
+
+
+    def close(self):
+
+        """Removes the spill file, if any"""
+
+        with self.lock:
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+
+
+    def _wait_for_items(self, block, timeout):
+
+        if not block:
+            timeout = 0
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not self.items:
+
+            if self.spill_items > 0:
+                self._unspill()
+                continue
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self.lock.wait(remaining)
+
+        return True
+
+
+    def _pop(self):
+
+        item = self.items.popleft()
+        self.size -= item_size(item)
+
+        # Refill the buffer from the spill file, in order
+        if self.spill_items > 0 and self.size < self.capacity // 2:
+            self._unspill()
+
+        self.lock.notify_all()
+        return item
+
+
+    def _spill(self, item, count):
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="gps_logger_spill_", dir=self.spill_directory)
+            self.spill_read_offset = 0
+
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(SPILL_HEADER.pack(len(data)))
+        self.spill_file.write(data)
+
+        self.spill_items += 1
+        self.spill_locations += count
+        self.spilled += count
+        self.high_water = max(self.high_water, self.size + self.spill_locations)
+
+
+    def _unspill(self):
+
+        self.spill_file.seek(self.spill_read_offset)
+
+        while self.spill_items > 0 and (self.size < self.capacity or not self.items):
+
+            header = self.spill_file.read(SPILL_HEADER.size)
+            length = SPILL_HEADER.unpack(header)[0]
+            item = pickle.loads(self.spill_file.read(length))
+
+            count = item_size(item)
+            self.items.append(item)
+            self.size += count
+            self.spill_items -= 1
+            self.spill_locations -= count
+
+        self.spill_read_offset = self.spill_file.tell()
+
+        # The spill file is empty, reclaim its space
+        if self.spill_items == 0:
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+            self.spill_read_offset = 0
@@ -0,0 +1,766 @@
+from core import database
+
+from datetime import datetime, timezone
+from threading import Thread
+
+import os
+import queue
+import sqlite3
+import stat
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Rollover policies
+DAILY = "daily"
+ROWS = "rows"
+
+ROLLOVER_POLICIES = (DAILY, ROWS)
+
+# Database file states
+ACTIVE = "active"
+CLOSED = "closed"
+COMPACTED = "compacted"
+
+
+def get_catalog_filename(database_filename):
+
+    """ Returns the catalog filename of a database filename (e.g., gps_logger.db -> gps_logger_catalog.db)
+
+        :param database_filename: the database filename
+        :return: the catalog filename
+    """
+
+    root, ext = os.path.splitext(database_filename)
+    return f"{root}_catalog{ext or '.db'}"
+
+
+class Catalog():
+
+    """ A small SQLite database mapping the sessions and time ranges to the database files
+        created by the rollover. The active file is the one the recorder writes to; the
+        session ranges of a file are indexed when it is closed.
+
+        :param catalog_filename: the catalog filename
+        :param connection_handler: the catalog connection handler
+    """
+
+    def __init__(self, catalog_filename):
+
+        """ Initializes the catalog
+
+            :param catalog_filename: the catalog filename
+        """
+
+        self.catalog_filename = catalog_filename
+        self.connection_handler = None
+
+
+    def open(self):
+
+        """ Opens the catalog and creates its datatables if they do not already exist
+
+            :return: 0 if success and -1 if an exception arises
+        """
+
+        try:
+            self.connection_handler = sqlite3.connect(self.catalog_filename, timeout=database.BUSY_TIMEOUT/1000)
+
+            self.connection_handler.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT UNIQUE NOT NULL,
+                    state TEXT DEFAULT 'active',
+                    opened_timestamp DATETIME DEFAULT (DATETIME(CURRENT_TIMESTAMP)),
+                    closed_timestamp DATETIME DEFAULT NULL,
+                    first_time DATETIME DEFAULT NULL,
+                    last_time DATETIME DEFAULT NULL,
+                    point_count INTEGER DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS file_sessions (
+                    file_id INTEGER NOT NULL,
+                    session_id INTEGER NOT NULL,
+                    first_time DATETIME DEFAULT NULL,
+                    last_time DATETIME DEFAULT NULL,
+                    point_count INTEGER DEFAULT 0,
+                    min_latitude FLOAT DEFAULT NULL,
+                    min_longitude FLOAT DEFAULT NULL,
+                    max_latitude FLOAT DEFAULT NULL,
+                    max_longitude FLOAT DEFAULT NULL,
+                    PRIMARY KEY (file_id, session_id),
+                    FOREIGN KEY(file_id) REFERENCES files(id)
+                );
+                """)
+            return 0
+
+        except sqlite3.Error as error:
+            logger.error(f"Exception: {str(error)}")
+            return -1
+
+
+    def close(self):
+
+        """Closes the catalog"""
+
+        database.disconnect(self.connection_handler)
+        self.connection_handler = None
+
+
+    def add_file(self, filename, state=ACTIVE):
+
+        """ Registers a database file
+
+            :param filename: the database filename
+            :param state: the file state (default: 'active')
+        """
+
+        self.connection_handler.execute("INSERT OR IGNORE INTO files (filename, state) VALUES (?, ?);", (filename, state))
+        self.connection_handler.commit()
+
+
+    def set_state(self, filename, state):
+
+        """ Updates the state of a database file
+
+            :param filename: the database filename
+            :param state: the file state, 'active', 'closed' or 'compacted'
+        """
+
+        if state == CLOSED:
+            self.connection_handler.execute("UPDATE files SET state = ?, closed_timestamp = DATETIME(CURRENT_TIMESTAMP) WHERE filename = ?;", \
+                (state, filename))
+        else:
+            self.connection_handler.execute("UPDATE files SET state = ? WHERE filename = ?;", (state, filename))
+
+        self.connection_handler.commit()
+
+
+    def files(self, state=None):
+
+        """ Returns the registered database files, in creation order
+
+            :param state: the state of the returned files (default: None, all the files)
+            :return: the list of filenames
+        """
+
+        if state is None:
+            rows = self.connection_handler.execute("SELECT filename FROM files ORDER BY id;")
+        else:
+            rows = self.connection_handler.execute("SELECT filename FROM files WHERE state = ? ORDER BY id;", (state,))
+
+        return [row[0] for row in rows]
+
+
+    def active_file(self):
+
+        """ Returns the active database file
+
+            :return: a tuple (filename, opened timestamp) or None if there is no active file
+        """
+
+        return self.connection_handler.execute("SELECT filename, opened_timestamp FROM files WHERE state = ? ORDER BY id DESC LIMIT 1;", \
+            (ACTIVE,)).fetchone()
+
+
+    def index_file(self, filename, session_table_name="session"):
+
+        """ Stores the session ranges of a database file, read from its session summaries
+
+            :param filename: the database filename
+            :param session_table_name: the session datatable name
+            :return: 0 if success and -1 if the database file cannot be read
+        """
+
+        connection_handler = database.connect_reader(filename)
+
+        if connection_handler is None:
+            return -1
+
+        summaries = database.list_session_summaries(connection_handler, session_table_name=session_table_name)
+        database.disconnect(connection_handler)
+
+        if summaries is None:
+            return -1
+
+        file_id = self.connection_handler.execute("SELECT id FROM files WHERE filename = ?;", (filename,)).fetchone()[0]
+
+        self.connection_handler.execute("DELETE FROM file_sessions WHERE file_id = ?;", (file_id,))
+        self.connection_handler.executemany("""INSERT INTO file_sessions (file_id, session_id, first_time, last_time, point_count,
+                                                   min_latitude, min_longitude, max_latitude, max_longitude)
+                                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""",
+            [(file_id, s["session_id"], s["first_time"], s["last_time"], s["point_count"], s["min_latitude"], \
+              s["min_longitude"], s["max_latitude"], s["max_longitude"]) for s in summaries if s["point_count"]])
+
+        self.connection_handler.execute("""UPDATE files SET
+                                               first_time = (SELECT MIN(first_time) FROM file_sessions WHERE file_id = ?),
+                                               last_time = (SELECT MAX(last_time) FROM file_sessions WHERE file_id = ?),
+                                               point_count = (SELECT COALESCE(SUM(point_count), 0) FROM file_sessions WHERE file_id = ?)
+                                           WHERE id = ?;""", (file_id, file_id, file_id, file_id))
+        self.connection_handler.commit()
+
+        return 0
+
+
+    def find_files(self, session_id=-1, start_time=None, end_time=None, bbox=None):
+
+        """ Returns the database files which may hold locations matching the filters.
+            The active file is always returned, its ranges being unknown until it is closed.
+
+            :param session_id: the identifier of the related session (-1 for all sessions)
+            :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+            :param end_time: the latest UTC time (exclusive), in ISO8601 format
+            :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+            :return: the list of filenames, in creation order
+        """
+
+        conditions = ["s.file_id = f.id"]
+        parameters = []
+
+        if session_id != -1:
+            conditions.append("s.session_id = ?")
+            parameters.append(session_id)
+
+        if start_time is not None:
+            conditions.append("s.last_time >= ?")
+            parameters.append(start_time)
+
+        if end_time is not None:
+            conditions.append("s.first_time < ?")
+            parameters.append(end_time)
+
+        if bbox is not None:
+            condition, condition_parameters = database.build_bbox_condition(bbox, "s.min_latitude", "s.max_latitude", \
+                "s.min_longitude", "s.max_longitude")
+            conditions.append(condition)
+            parameters.extend(condition_parameters)
+
+        sql = f"""SELECT f.filename FROM files f
+                  WHERE f.state = ? OR EXISTS (SELECT 1 FROM file_sessions s WHERE {' AND '.join(conditions)})
+                  ORDER BY f.id;"""
+
+        return [row[0] for row in self.connection_handler.execute(sql, [ACTIVE] + parameters)]
+
+
+class Compactor(Thread):
+
+    """ Compacts the closed database files in the background: the write-ahead log is
+        merged, the file is vacuumed and, optionally, made read-only
+
+        :param catalog_filename: the catalog filename
+        :param read_only: a flag indicating if the compacted files are made read-only
+        :param pending: the queue of the files to compact
+    """
+
+    def __init__(self, catalog_filename, read_only=False):
+
+        """ Initializes the compactor thread
+
+            :param catalog_filename: the catalog filename
+            :param read_only: a flag indicating if the compacted files are made read-only (default: False)
+        """
+
+        Thread.__init__(self, daemon=True)
+        self.catalog_filename = catalog_filename
+        self.read_only = read_only
+        self.pending = queue.Queue()
+
+
+    def enqueue(self, filename):
+
+        """ Schedules the compaction of a closed database file
+
+            :param filename: the database filename
+        """
+
+        self.pending.put(filename)
+
+
+    def run(self):
+
+        """ Compacts the scheduled files until stopped """
+
+        catalog = Catalog(self.catalog_filename)
+
+        if catalog.open() != 0:
+            return
+
+        while True:
+            filename = self.pending.get()
+
+            if filename is None:
+                break
+
+            if self.compact(filename) == 0:
+                catalog.set_state(filename, COMPACTED)
+
+        catalog.close()
+
+
+    def compact(self, filename):
+
+        """ Compacts a closed database file
+
+            :param filename: the database filename
+            :return: 0 if success and -1 if an exception arises
+        """
+
+        try:
+            connection_handler = sqlite3.connect(filename, timeout=database.BUSY_TIMEOUT/1000, isolation_level=None)
+            connection_handler.execute("PRAGMA journal_mode=DELETE;")
+            connection_handler.execute("VACUUM;")
+            connection_handler.execute("PRAGMA optimize;")
+            connection_handler.close()
+
+            if self.read_only:
+                os.chmod(filename, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+            logger.info(f"Database file compacted: {filename}")
+            return 0
+
+        except (sqlite3.Error, OSError) as error:
+            logger.error(f"Exception: {str(error)}")
+            return -1
+
+
+    def stop(self):
+
+        """Stops the compactor once the current compaction is done (the pending files are compacted at the next start)"""
+
+        while True:
+            try:
+                self.pending.get_nowait()
+            except queue.Empty:
+                break
+
+        self.pending.put(None)
+
+
+class Rollover():
+
+    """ Rolls the recorder over to a new database file every day or every max_rows locations.
+        The files are named after the database filename and their creation time, and
+        registered in the catalog. The current session is carried over to the new file
+        so that the session identifiers keep increasing across files. The closed files
+        are indexed in the catalog and compacted in the background.
+
+        :param database_filename: the database filename, used as the base of the file names
+        :param policy: the rollover policy, 'daily' or 'rows'
+        :param max_rows: the maximum number of locations per file ('rows' policy)
+        :param catalog: the catalog
+        :param compactor: the compactor thread
+        :param filename: the active database filename
+        :param rows: the number of locations stored in the active file
+    """
+
+    def __init__(self, database_filename, policy, max_rows=1000000, read_only=False, storage_profile=None, \
+                 session_table_name="session", location_table_name="location"):
+
+        """ Initializes the rollover
+
+            :param database_filename: the database filename
+            :param policy: the rollover policy, 'daily' or 'rows'
+            :param max_rows: the maximum number of locations per file (default: 1000000)
+            :param read_only: a flag indicating if the compacted files are made read-only (default: False)
+            :param storage_profile: the storage profile of the database connections (default: None)
+            :param session_table_name: the session datatable name
+            :param location_table_name: the location datatable name
+        """
+
+        if policy not in ROLLOVER_POLICIES:
+            raise ValueError(f"Unknown rollover policy: {policy}")
+
+        self.database_filename = database_filename
+        self.policy = policy
+        self.max_rows = max_rows
+        self.storage_profile = storage_profile
+        self.session_table_name = session_table_name
+        self.location_table_name = location_table_name
+
+        self.catalog = Catalog(get_catalog_filename(database_filename))
+        self.compactor = Compactor(self.catalog.catalog_filename, read_only=read_only)
+
+        self.filename = None
+        self.opened_date = None
+        self.rows = 0
+
+
+    def open(self):
+
+        """ Opens the catalog and the active database file (a new one if there is none or
+            if it must be rolled over), and starts the compactor
+
+            :return: the connection handler of the active file or None if failure
+        """
+
+        try:
+            if self.catalog.open() != 0:
+                return None
+
+            # The database file written before the rollover was enabled is the first closed file
+            if not self.catalog.files() and os.path.exists(self.database_filename):
+                connection_handler = self.open_file(self.database_filename)
+                if connection_handler is None:
+                    return None
+                database.disconnect(connection_handler)
+                self.catalog.add_file(self.database_filename, state=CLOSED)
+                self.catalog.index_file(self.database_filename, session_table_name=self.session_table_name)
+
+            active = self.catalog.active_file()
+
+            if active is not None:
+                self.filename = active[0]
+                self.opened_date = datetime.strptime(active[1], "%Y-%m-%d %H:%M:%S").date()
+                connection_handler = self.open_file(self.filename)
+
+                if connection_handler is None:
+                    return None
+
+                cursor = connection_handler.execute(f"SELECT COALESCE(SUM(point_count), 0) FROM {database.get_summary_table_name(self.session_table_name)};")
+                self.rows = cursor.fetchone()[0]
+
+                if self.should_roll():
+                    connection_handler = self.roll(connection_handler)
+
+            else:
+                # Carry the newest session of the previous file, if any
+                previous = self.catalog.files()
+                connection_handler = self.roll(None, previous[-1] if previous else None)
+
+            for filename in self.catalog.files(state=CLOSED):
+                self.compactor.enqueue(filename)
+            self.compactor.start()
+
+            return connection_handler
+
+        except (sqlite3.Error, ValueError) as error:
+            logger.error(f"Exception: {str(error)}")
+            return None
+
+
+    def open_file(self, filename):
+
+        """ Opens a database file, creates its datatables and upgrades its schema
+
+            :param filename: the database filename
+            :return: the connection handler or None if failure
+        """
+
+        connection_handler = database.connect(db_filename=filename, storage_profile=self.storage_profile)
+
+        if connection_handler is None:
+            return None
+
+        database.create_tables(connection_handler, session_table_name=self.session_table_name, location_table_name=self.location_table_name)
+
+        if database.migrate(connection_handler, location_table_name=self.location_table_name, session_table_name=self.session_table_name) == -1:
+            database.disconnect(connection_handler)
+            return None
+
+        return connection_handler
+
+
+    def next_filename(self):
+
+        """ Returns the name of the next database file
+
+            :return: the database filename
+        """
+
+        root, ext = os.path.splitext(self.database_filename)
+        filename = f"{root}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}{ext or '.db'}"
+
+        count = 1
+        while os.path.exists(filename):
+            filename = f"{root}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}_{count}{ext or '.db'}"
+            count += 1
+
+        return filename
+
+
+    def should_roll(self):
+
+        """ Checks if the active file must be rolled over
+
+            :return: True if a new file must be opened
+        """
+
+        if self.policy == ROWS:
+            return self.rows >= self.max_rows
+
+        return datetime.now(timezone.utc).date() != self.opened_date
+
+
+    def after_insert(self, connection_handler, count):
+
+        """ Accounts for inserted locations and rolls the active file over if needed
+
+            :param connection_handler: the connection handler of the active file
+            :param count: the number of inserted locations
+            :return: the connection handler of the (possibly new) active file
+        """
+
+        self.rows += max(0, count)
+
+        if not self.should_roll():
+            return connection_handler
+
+        return self.roll(connection_handler)
+
+
+    def roll(self, connection_handler, previous_filename=None):
+
+        """ Opens a new database file, carrying over the newest session, then closes the active
+            one. If the new file cannot be opened, the active file is kept and the rollover is
+            tried again after the next insert.
+
+            :param connection_handler: the connection handler of the active file (None if there is none)
+            :param previous_filename: the file holding the session to carry over, if there is no active file
+            :return: the connection handler of the active file (the new one if success)
+            :raises sqlite3.Error: The new file cannot be opened and there is no active file
+        """
+
+        session = None
+
+        if connection_handler is not None:
+            session = self.newest_session(connection_handler)
+
+        elif previous_filename is not None:
+            reader = database.connect_reader(previous_filename)
+            if reader is not None:
+                session = self.newest_session(reader)
+                database.disconnect(reader)
+
+        filename = self.next_filename()
+        new_connection_handler = None
+
+        try:
+            new_connection_handler = self.open_file(filename)
+
+            if new_connection_handler is None:
+                raise sqlite3.OperationalError(f"unable to open database file {filename}")
+
+            if session is not None:
+                new_connection_handler.execute(f"INSERT OR IGNORE INTO {self.session_table_name} (id, start_timestamp, end_timestamp) VALUES (?, ?, ?);", \
+                    session)
+                new_connection_handler.commit()
+
+            self.catalog.add_file(filename)
+
+        except sqlite3.Error as error:
+            database.disconnect(new_connection_handler)
+            self.remove_file(filename)
+
+            if connection_handler is None:
+                raise
+
+            logger.error(f"Rollover failed, the recorder keeps writing to {self.filename}: {str(error)}")
+            return connection_handler
+
+        # The new file is registered, close the previous one
+        if connection_handler is not None:
+            database.disconnect(connection_handler)
+
+            try:
+                self.catalog.set_state(self.filename, CLOSED)
+                self.catalog.index_file(self.filename, session_table_name=self.session_table_name)
+                if self.compactor.is_alive():
+                    self.compactor.enqueue(self.filename)
+
+            # The file stays active in the catalog, so it is still read by the queries
+            except sqlite3.Error as error:
+                logger.error(f"Exception: {str(error)}")
+
+        self.filename = filename
+        self.opened_date = datetime.now(timezone.utc).date()
+        self.rows = 0
+
+        logger.info(f"Database rolled over to {self.filename}")
+        return new_connection_handler
+
+
+    def remove_file(self, filename):
+
+        """ Removes a database file which could not be opened as the active file,
+            with its write-ahead log
+
+            :param filename: the database filename
+        """
+
+        for path in (filename, f"{filename}-wal", f"{filename}-shm"):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as error:
+                logger.error(f"Exception: {str(error)}")
+
+
+    def newest_session(self, connection_handler):
+
+        """ Returns the newest session record of a database file
+
+            :param connection_handler: the connection handler
+            :return: a tuple (id, start_timestamp, end_timestamp) or None if there is no session
+        """
+
+        try:
+            return connection_handler.execute(f"SELECT id, start_timestamp, end_timestamp FROM {self.session_table_name} ORDER BY id DESC LIMIT 1;").fetchone()
+
+        except sqlite3.Error:
+            return None
+
+
+    def close(self, connection_handler):
+
+        """ Closes the active file (which stays active in the catalog), the catalog and stops the compactor
+
+            :param connection_handler: the connection handler of the active file
+        """
+
+        database.disconnect(connection_handler)
+
+        if self.compactor.is_alive():
+            self.compactor.stop()
+            self.compactor.join()
+
+        self.catalog.close()
+
+
+def find_files(catalog_filename, session_id=-1, start_time=None, end_time=None, bbox=None):
+
+    """ Returns the database files of a catalog which may hold locations matching the filters
+
+        :param catalog_filename: the catalog filename
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :return: the list of filenames, in creation order
+        :raises sqlite3.Error: Database error (e.g., the catalog cannot be opened)
+    """
+
+    catalog = Catalog(catalog_filename)
+
+    if catalog.open() != 0:
+        raise sqlite3.OperationalError(f"unable to open the catalog {catalog_filename}")
+
+    try:
+        return catalog.find_files(session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox)
+
+    finally:
+        catalog.close()
+
+
+def list_session_ids(catalog_filename, location_table_name="location"):
+
+    """ Returns the identifiers of the sessions holding locations across the database files of a catalog
+
+        :param catalog_filename: the catalog filename
+        :param location_table_name: the location datatable name
+        :return: the sorted list of session identifiers
+        :raises sqlite3.Error: Database error
+    """
+
+    session_ids = set()
+
+    for filename in find_files(catalog_filename):
+
+        connection_handler = database.connect_reader(filename)
+
+        if connection_handler is None:
+            continue
+
+        try:
+            session_ids.update(database.list_session_ids(connection_handler, location_table_name))
+
+        finally:
+            database.disconnect(connection_handler)
+
+    return sorted(session_ids)
+
+
+def iter_locations(catalog_filename, session_id=-1, start_time=None, end_time=None, bbox=None, columns=None, \
+                   location_table_name="location", chunk_size=database.FETCH_CHUNK_SIZE):
+
+    """ Iterates over the location data stored across the database files of a catalog.
+        Only the files which may hold matching locations are read, in creation order.
+
+        :param catalog_filename: the catalog filename
+        :param session_id: the identifier of the related session (-1 for all sessions)
+        :param start_time: the earliest UTC time (inclusive), in ISO8601 format
+        :param end_time: the latest UTC time (exclusive), in ISO8601 format
+        :param bbox: the bounding box (min_latitude, min_longitude, max_latitude, max_longitude)
+        :param columns: the selected columns; if None, location objects are yielded
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of location objects or tuples
+        :raises sqlite3.Error: Database error
+        :raises ValueError: Unknown column
+    """
+
+    for filename in find_files(catalog_filename, session_id=session_id, start_time=start_time, end_time=end_time, bbox=bbox):
+
+        connection_handler = database.connect_reader(filename)
+
+        if connection_handler is None:
+            continue
+
+        try:
+            yield from database.iter_locations(connection_handler, session_id=session_id, start_time=start_time, end_time=end_time, \
+                bbox=bbox, columns=columns, location_table_name=location_table_name, chunk_size=chunk_size)
+
+        finally:
+            database.disconnect(connection_handler)
+
+
+def iter_session_arrays(catalog_filename, session_id, columns=tuple(database.ARRAY_COLUMNS), location_table_name="location", \
+                        chunk_size=database.FETCH_CHUNK_SIZE):
+
+    """ Iterates over the locations of a session stored across the database files of a
+        catalog as chunks of NumPy arrays (see database.iter_session_arrays), in time order
+
+        :param catalog_filename: the catalog filename
+        :param session_id: the session identifier
+        :param columns: the selected columns (see database.ARRAY_COLUMNS)
+        :param location_table_name: the location datatable name
+        :param chunk_size: the number of rows fetched at once
+        :return: a generator of dictionaries of arrays, by column
+        :raises sqlite3.Error: Database error
+        :raises ValueError: Unknown column
+    """
+
+    for filename in find_files(catalog_filename, session_id=session_id):
+
+        connection_handler = database.connect_reader(filename)
+
+        if connection_handler is None:
+            continue
+
+        try:
+            yield from database.iter_session_arrays(connection_handler, session_id, columns=columns, \
+                location_table_name=location_table_name, chunk_size=chunk_size)
+
+        finally:
+            database.disconnect(connection_handler)
+
+
+def retrieve_data(catalog_filename, session_id=-1, location_table_name="location", **filters):
+
+    """ Retrieves the location data stored across the database files of a catalog
+
+        :param catalog_filename: the catalog filename
+        :param session_id: the identifier of the related session
+        :param location_table_name: the location datatable name (default: location)
+        :param filters: the other filters accepted by iter_locations (e.g., start_time, end_time, bbox)
+        :return: A list of location objects and None if an exception arises
+    """
+
+    try:
+
+        return list(iter_locations(catalog_filename, session_id=session_id, location_table_name=location_table_name, **filters))
+
+    except (sqlite3.Error, ValueError) as error:
+        logger.error(f"Exception: {str(error)}")
+        return None
@@ -0,0 +1,266 @@
+from core import database, location
+from helpers import geo
+
+import numpy as np
+import sqlite3
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# Simplification methods
+DOUGLAS_PEUCKER = "douglas_peucker"
+VISVALINGAM = "visvalingam"
+
+# Number of points simplified at once, consecutive windows share their boundary point
+WINDOW_SIZE = 10000
+
+# Number of kept row ids recorded at once when compacting a session
+KEPT_CHUNK_SIZE = 10000
+
+
+def douglas_peucker(x, y, tolerance):
+
+    """ Simplifies a polyline with the Douglas-Peucker algorithm. The distances of the
+        points of every segment are computed at once with NumPy.
+
+        :param x: the x coordinates, in meters
+        :param y: the y coordinates, in meters
+        :param tolerance: the maximum distance between a removed point and the simplified line, in meters
+        :return: a boolean array, True for the points to keep
+    """
+
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+
+    if n == 0:
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        start, end = stack.pop()
+
+        if end - start < 2:
+            continue
+
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start+1:end] - x[start]
+        py = y[start+1:end] - y[start]
+
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / norm
+
+        i = int(np.argmax(distances))
+
+        if distances[i] > tolerance:
+            index = start + 1 + i
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return keep
+
+
+def visvalingam(x, y, tolerance):
+
+    """ Simplifies a polyline with the Visvalingam-Whyatt algorithm: the points whose
+        triangle (formed with their neighbours) has an area smaller than tolerance squared
+        are removed. At every pass, all the non-adjacent local minima are removed at once,
+        so that the number of passes grows with the logarithm of the number of points.
+
+        :param x: the x coordinates, in meters
+        :param y: the y coordinates, in meters
+        :param tolerance: the tolerance, in meters (area threshold: tolerance squared)
+        :return: a boolean array, True for the points to keep
+    """
+
+    n = len(x)
+    keep = np.ones(n, dtype=bool)
+
+    if n < 3:
+        return keep
+
+    threshold = tolerance ** 2
+    index = np.arange(n)
+
+    while len(index) >= 3:
+        xs = x[index]
+        ys = y[index]
+
+        # Areas of the triangles of the interior points
+        area = 0.5 * np.abs(xs[:-2] * (ys[1:-1] - ys[2:]) + xs[1:-1] * (ys[2:] - ys[:-2]) + xs[2:] * (ys[:-2] - ys[1:-1]))
+
+        left = np.concatenate(([np.inf], area[:-1]))
+        right = np.concatenate((area[1:], [np.inf]))
+
+        candidates = (area < threshold) & (area <= left) & (area <= right)
+        if not candidates.any():
+            break
+
+        # Never remove two adjacent points in the same pass
+        candidates &= ~np.concatenate(([False], candidates[:-1]))
+
+        removed = index[1:-1][candidates]
+        keep[removed] = False
+        index = index[keep[index]]
+
+    return keep
+
+
+def simplify(latitude, longitude, tolerance, method=DOUGLAS_PEUCKER):
+
+    """ Simplifies a track given by its coordinates
+
+        :param latitude: the latitudes, in degrees
+        :param longitude: the longitudes, in degrees
+        :param tolerance: the tolerance, in meters
+        :param method: the simplification method, 'douglas_peucker' or 'visvalingam'
+        :return: a boolean array, True for the points to keep
+        :raises ValueError: Unknown simplification method
+    """
+
+    x, y = geo.project_local(latitude, longitude)
+
+    if method == DOUGLAS_PEUCKER:
+        return douglas_peucker(x, y, tolerance)
+    elif method == VISVALINGAM:
+        return visvalingam(x, y, tolerance)
+
+    raise ValueError(f"Unknown simplification method: {method}")
+
+
+def simplify_windows(points, tolerance, method=DOUGLAS_PEUCKER, window=WINDOW_SIZE, key=None):
+
+    """ Simplifies a stream of points in windows of (at most) window points, so that
+        the memory usage is bounded whatever the length of the track. Consecutive windows
+        share their boundary point, which is always kept, and the windows never span
+        two tracks (i.e., two consecutive points with different keys).
+
+        :param points: an iterable of (latitude, longitude, item) tuples
+        :param tolerance: the tolerance, in meters
+        :param method: the simplification method, 'douglas_peucker' or 'visvalingam'
+        :param window: the maximum number of points per window
+        :param key: a function returning the track key of an item (default: None, single track)
+        :return: a generator of the kept items
+    """
+
+    window = max(3, window)
+    pending = []
+    track = None
+
+    def flush(final):
+        latitude = np.fromiter((p[0] for p in pending), dtype=np.float64, count=len(pending))
+        longitude = np.fromiter((p[1] for p in pending), dtype=np.float64, count=len(pending))
+        keep = simplify(latitude, longitude, tolerance, method)
+        last = len(pending) if final else len(pending) - 1
+        for i in range(last):
+            if keep[i]:
+                yield pending[i][2]
+
+    for point in points:
+
+        current = key(point[2]) if key is not None else None
+
+        if pending and current != track:
+            yield from flush(True)
+            pending = []
+
+        track = current
+        pending.append(point)
+
+        if len(pending) >= window:
+            yield from flush(False)
+            pending = [pending[-1]]
+
+    if pending:
+        yield from flush(True)
+
+
+def simplify_locations(data, tolerance, method=DOUGLAS_PEUCKER, window=WINDOW_SIZE):
+
+    """ Simplifies location data on the fly (e.g., before exporting it). The locations
+        without fix are skipped and every session is simplified separately.
+
+        :param data: an iterable of location objects and/or location batches
+        :param tolerance: the tolerance, in meters
+        :param method: the simplification method, 'douglas_peucker' or 'visvalingam'
+        :param window: the maximum number of points simplified at once
+        :return: a generator of the kept location objects
+    """
+
+    points = ((loc.latitude, loc.longitude, loc) for loc in location.iter_fixes(data) if loc.mode >= 2)
+
+    return simplify_windows(points, tolerance, method=method, window=window, key=lambda loc: loc.session_id)
+
+
+def compact_session(connection_handler, session_id, tolerance, method=DOUGLAS_PEUCKER, window=WINDOW_SIZE, \
+                    location_table_name="location", session_table_name="session"):
+
+    """ Compacts a session stored in the database by deleting the locations removed by
+        the simplification of its track. The kept row ids are streamed into a temporary
+        datatable, so that the memory usage is bounded whatever the length of the session.
+        The sessions stored as blocks ('blocks' storage layout) have no row ids and are not
+        compacted.
+
+        :param connection_handler: the connection handler object
+        :param session_id: the session identifier
+        :param tolerance: the tolerance, in meters
+        :param method: the simplification method, 'douglas_peucker' or 'visvalingam'
+        :param window: the maximum number of points simplified at once
+        :param location_table_name: the location datatable name
+        :param session_table_name: the session datatable name (its summary is recomputed)
+        :return: the number of deleted locations or -1 if the session is stored as blocks or an exception arises
+    """
+
+    try:
+        if database.has_blocks(connection_handler, location_table_name) and connection_handler.execute( \
+                f"SELECT 1 FROM {database.get_block_table_name(location_table_name)} WHERE session_id = ? LIMIT 1;", \
+                (session_id,)).fetchone() is not None:
+            logger.error(f"Session {session_id} is stored as blocks and cannot be compacted")
+            return -1
+
+        rows = database.iter_locations(connection_handler, session_id=session_id, columns=("latitude", "longitude", "id"), \
+            location_table_name=location_table_name)
+
+        cursor = connection_handler.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS compact_kept (id INTEGER PRIMARY KEY);")
+        cursor.execute("DELETE FROM compact_kept;")
+
+        chunk = []
+        for row_id in simplify_windows(rows, tolerance, method=method, window=window):
+            chunk.append((row_id,))
+
+            if len(chunk) >= KEPT_CHUNK_SIZE:
+                cursor.executemany("INSERT INTO compact_kept (id) VALUES (?);", chunk)
+                chunk = []
+
+        if chunk:
+            cursor.executemany("INSERT INTO compact_kept (id) VALUES (?);", chunk)
+
+        cursor.execute(f"DELETE FROM {location_table_name} WHERE session_id = ? AND id NOT IN (SELECT id FROM compact_kept);", \
+            (session_id,))
+        deleted = cursor.rowcount
+
+        cursor.execute("DELETE FROM compact_kept;")
+
+        database.rebuild_session_summary(connection_handler, session_id, location_table_name=location_table_name, \
+            session_table_name=session_table_name)
+
+        connection_handler.commit()
+        cursor.close()
+
+        logger.info(f"Session {session_id} compacted: {deleted} locations deleted")
+        return deleted
+
+    except (sqlite3.Error, ValueError) as error:
+        logger.error(f"Exception: {str(error)}")
+        connection_handler.rollback()
+        return -1
@@ -0,0 +1,385 @@
+from core import location
+from helpers import generic
+
+from threading import Lock
+
+import glob
+import heapq
+import os
+import struct
+import time
+import zlib
+import logging
+
+
+# Get the current logger object
+logger = logging.getLogger(__name__)
+
+
+# A spooled location: sequence number, latitude, longitude, altitude, heading, climb,
+# horizontal speed, mode, UTC time (UNIX timestamp in milliseconds) and device identifier,
+# followed by the CRC32 of the packed fields
+RECORD = struct.Struct("<Q6dbqq")
+CHECKSUM = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + CHECKSUM.size
+
+# The location batch columns of the record fields
+SPOOLED_COLUMNS = ("seq", "latitude", "longitude", "altitude", "heading", "climb", "horizontal_speed", "mode", "utc_time", "device_id")
+
+# The checkpoint holds the sequence number of the last committed location
+CHECKPOINT = struct.Struct("<QI")
+CHECKPOINT_FILENAME = "spool.checkpoint"
+
+SEGMENT_PREFIX = "spool_"
+SEGMENT_SUFFIX = ".seg"
+
+
+def pack_record(seq, batch, i):
+
+    """ Packs the i-th location of a batch as a checksummed spool record
+
+        :param seq: the sequence number of the location
+        :param batch: the location batch
+        :param i: the index of the location in the batch
+        :return: the record bytes
+    """
+
+    data = RECORD.pack(seq, batch.latitude[i], batch.longitude[i], batch.altitude[i], batch.heading[i], batch.climb[i], \
+                       batch.horizontal_speed[i], batch.mode[i], generic.iso_to_epoch_ms(batch.utc_time[i]), batch.device_id[i])
+
+    return data + CHECKSUM.pack(zlib.crc32(data))
+
+
+class Spool():
+
+    """ A crash-safe, append-only spool of the locations not yet committed to the database.
+        The monitor appends every location to the current segment file (cheap sequential
+        writes, synced to disk at most every fsync_interval seconds), and the recorder
+        releases the locations once they are committed. The checkpoint only moves past
+        the locations released without gap, so that a location queued late (e.g., by
+        another monitor sharing the spool) or a batch whose insert failed is never
+        skipped. The segments holding only released locations are deleted. At startup,
+        the locations left in the segments are replayed.
+
+        :param directory: the spool directory
+        :param segment_size: the maximum size of a segment file, in bytes
+        :param fsync_interval: the maximum time between two syncs to disk, in seconds
+        :param next_seq: the sequence number of the next appended location
+        :param committed_seq: the sequence number of the last committed location
+        :param replay_end: the first sequence number appended by the current run
+        :param pending: the sequence numbers not released yet (heap)
+        :param released: the sequence numbers released after a pending one
+    """
+
+    def __init__(self, directory, segment_size=4194304, fsync_interval=1.0):
+
+        """ Initializes the spool
+
+            :param directory: the spool directory
+            :param segment_size: the maximum size of a segment file, in bytes (default: 4 MB)
+            :param fsync_interval: the maximum time between two syncs to disk, in seconds (default: 1.0)
+        """
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+
+        self.next_seq = 1
+        self.committed_seq = 0
+        self.replay_end = 1
+
+        self.segment = None
+        self.segment_bytes = 0
+        self.last_fsync = 0
+        self.unsynced = False
+
+        self.pending = []
+        self.released = set()
+
+        self.lock = Lock()
+
+
+    def open(self):
+
+        """ Opens the spool: reads the checkpoint and finds the next sequence number
+
+            :return: 0 if success and -1 if an exception arises
+        """
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            self.committed_seq = self.read_checkpoint()
+
+            # The locations left by the previous runs stay pending until they are replayed
+            last_seq = self.committed_seq
+            pending = set()
+            for path in self.segments():
+                for fields in self.read_segment(path):
+                    last_seq = max(last_seq, fields[0])
+                    if fields[0] > self.committed_seq:
+                        pending.add(fields[0])
+
+            self.pending = sorted(pending)
+            self.released = set()
+            self.next_seq = last_seq + 1
+            self.replay_end = self.next_seq
+
+            return 0
+
+        except OSError as error:
+            logger.error(f"Exception: {str(error)}")
+            return -1
+
+
+    def close(self):
+
+        """Syncs and closes the current segment"""
+
+        with self.lock:
+            self._close_segment()
+
+
+    def segments(self):
+
+        """ Returns the segment files, in sequence order
+
+            :return: the list of segment paths
+        """
+
+        return sorted(glob.glob(os.path.join(self.directory, f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")))
+
+
+    def append(self, batch):
+
+        """ Appends the locations of a batch to the spool and assigns their sequence numbers
+            (stored in the seq column of the batch)
+
+            :param batch: the location batch
+            :return: the sequence number of the last appended location, -1 if an exception arises
+        """
+
+        try:
+            with self.lock:
+
+                if self.segment is None or self.segment_bytes >= self.segment_size:
+                    self._open_segment()
+
+                records = []
+                for i in range(len(batch)):
+                    batch.seq[i] = self.next_seq
+                    records.append(pack_record(self.next_seq, batch, i))
+                    heapq.heappush(self.pending, self.next_seq)
+                    self.next_seq += 1
+
+                data = b''.join(records)
+                self.segment.write(data)
+                self.segment.flush()
+                self.segment_bytes += len(data)
+                self.unsynced = True
+
+                # Group the syncs to disk
+                self._sync()
+
+                return self.next_seq - 1
+
+        except OSError as error:
+            logger.error(f"Exception: {str(error)}")
+            return -1
+
+
+    def sync(self):
+
+        """ Syncs the appended locations to disk if the last sync is older than fsync_interval
+            seconds (called periodically, so that the last locations of a burst are synced)
+
+            :return: 0 if success and -1 if an exception arises
+        """
+
+        try:
+            with self.lock:
+                self._sync()
+
+            return 0
+
+        except OSError as error:
+            logger.error(f"Exception: {str(error)}")
+            return -1
+
+
+    def release(self, seqs):
+
+        """ Releases the locations committed to the database. The checkpoint moves up to the
+            last location released without gap and the fully released segments are deleted.
+
+            :param seqs: the sequence numbers of the committed locations (the ones below 0 are ignored)
+            :return: 0 if success and -1 if an exception arises
+        """
+
+        try:
+            with self.lock:
+
+                self.released.update(seq for seq in seqs if self.committed_seq < seq < self.next_seq)
+
+                while self.pending and self.pending[0] in self.released:
+                    self.released.discard(heapq.heappop(self.pending))
+
+                seq = self.pending[0] - 1 if self.pending else self.next_seq - 1
+
+                if seq <= self.committed_seq:
+                    return 0
+
+                self.write_checkpoint(seq)
+                self.committed_seq = seq
+
+                # A segment is released if the next one starts after the checkpoint
+                segments = self.segments()
+                active = self.segment.name if self.segment is not None else None
+
+                for path, next_path in zip(segments, segments[1:]):
+                    if path != active and self.segment_first_seq(next_path) - 1 <= seq:
+                        os.remove(path)
+
+                return 0
+
+        except OSError as error:
+            logger.error(f"Exception: {str(error)}")
+            return -1
+
+
+    def replay(self, batch_size=1000):
+
+        """ Yields the locations left by the previous runs which were never committed
+
+            :param batch_size: the maximum number of locations per batch
+            :return: a generator of location batches
+        """
+
+        batch = location.LocationBatch()
+
+        for path in self.segments():
+
+            if self.segment_first_seq(path) >= self.replay_end:
+                break
+
+            for fields in self.read_segment(path):
+
+                seq = fields[0]
+                if seq <= self.committed_seq or seq >= self.replay_end:
+                    continue
+
+                for column, value in zip(SPOOLED_COLUMNS, fields):
+                    getattr(batch, column).append(generic.epoch_ms_to_iso(value) if column == "utc_time" else value)
+                batch.session_id.append(-1)
+
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = location.LocationBatch()
+
+        if len(batch) > 0:
+            yield batch
+
+
+    def read_segment(self, path):
+
+        """ Reads the valid records of a segment file. The reading stops at the first
+            truncated or corrupted record (e.g., a write torn by a power failure).
+
+            :param path: the segment path
+            :return: a generator of tuples of record fields (see SPOOLED_COLUMNS)
+        """
+
+        with open(path, "rb") as segment:
+
+            while True:
+                record = segment.read(RECORD_SIZE)
+
+                if len(record) < RECORD_SIZE:
+                    break
+
+                data = record[:RECORD.size]
+                if CHECKSUM.unpack(record[RECORD.size:])[0] != zlib.crc32(data):
+                    logger.warning(f"Corrupted spool record in {path}, the rest of the segment is ignored")
+                    break
+
+                yield RECORD.unpack(data)
+
+
+    def segment_first_seq(self, path):
+
+        """ Returns the first sequence number of a segment, encoded in its filename """
+
+        name = os.path.basename(path)
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+    def read_checkpoint(self):
+
+        """ Reads the sequence number of the last committed location
+
+            :return: the sequence number (0 if there is no valid checkpoint)
+        """
+
+        path = os.path.join(self.directory, CHECKPOINT_FILENAME)
+
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, "rb") as checkpoint:
+            data = checkpoint.read(CHECKPOINT.size)
+
+        if len(data) < CHECKPOINT.size:
+            return 0
+
+        seq, checksum = CHECKPOINT.unpack(data)
+        if checksum != zlib.crc32(data[:8]):
+            logger.warning("Corrupted spool checkpoint ignored")
+            return 0
+
+        return seq
+
+
+    def write_checkpoint(self, seq):
+
+        """ Atomically writes the sequence number of the last committed location
+
+            :param seq: the sequence number
+        """
+
+        path = os.path.join(self.directory, CHECKPOINT_FILENAME)
+        data = struct.pack("<Q", seq)
+
+        with open(f"{path}.tmp", "wb") as checkpoint:
+            checkpoint.write(CHECKPOINT.pack(seq, zlib.crc32(data)))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+        os.replace(f"{path}.tmp", path)
+
+
+    def _open_segment(self):
+
+        self._close_segment()
+
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self.next_seq:020d}{SEGMENT_SUFFIX}")
+        self.segment = open(path, "ab")
+        self.segment_bytes = 0
+
+
+    def _sync(self):
+
+        now = time.monotonic()
+        if self.segment is not None and self.unsynced and now - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.segment.fileno())
+            self.last_fsync = now
+            self.unsynced = False
+
+
+    def _close_segment(self):
+
+        if self.segment is not None:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.segment.close()
+            self.segment = None
+            self.unsynced = False
@@ -1,5 +1,5 @@
 from os import system, name
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 def clear_console():
@@ -43,3 +43,41 @@ def get_anterior_datetime(offset = 300):
     else:
         raise Exception("Invalid time offset.")
 
+
+def iso_to_epoch_ms(utc_time):
+
+    """ Converts an ISO8601 UTC date/time string (e.g., as reported by the GPSD) into
+        a UNIX timestamp in milliseconds
+
+        :param utc_time: the date/time string ('%Y-%m-%dT%H:%M:%S[.fraction][Z]', any number of fraction digits)
+        :return: the UNIX timestamp in milliseconds or -1 if the string is empty or invalid
+    """
+
+    try:
+        if utc_time.endswith('Z'):
+            utc_time = utc_time[:-1]
+
+        # datetime.fromisoformat (Python 3.7) only accepts 3 or 6 fraction digits, the GPSD reports 0 to 9
+        seconds, _, fraction = utc_time.partition('.')
+        dt = datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+        return int(dt.timestamp()) * 1000 + (round(float(f"0.{fraction}") * 1000) if fraction else 0)
+
+    except (AttributeError, ValueError):
+        return -1
+
+
+def epoch_ms_to_iso(epoch_ms):
+
+    """ Converts a UNIX timestamp in milliseconds into an ISO8601 UTC date/time string
+
+        :param epoch_ms: the UNIX timestamp in milliseconds
+        :return: the date/time string ('%Y-%m-%dT%H:%M:%S.%fZ', millisecond precision)
+                 or an empty string if the timestamp is negative
+    """
+
+    if epoch_ms < 0:
+        return ''
+
+    dt = datetime.fromtimestamp(epoch_ms / 1000, timezone.utc)
+    return f"{dt.isoformat(timespec='milliseconds')[:-6]}Z"
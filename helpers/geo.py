@@ -0,0 +1,71 @@
+import numpy as np
+import math
+
+
+# Mean Earth radius, in meters
+EARTH_RADIUS = 6371008.8
+
+
+def haversine(lat1, lon1, lat2, lon2):
+
+    """ Computes the great-circle distances between two sets of points (vectorized)
+
+        :param lat1: latitudes of the first points, in degrees
+        :param lon1: longitudes of the first points, in degrees
+        :param lat2: latitudes of the second points, in degrees
+        :param lon2: longitudes of the second points, in degrees
+        :return: the distances, in meters
+    """
+
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def project_local(latitude, longitude, lat0=None, lon0=None):
+
+    """ Projects geographic coordinates onto a local plane (equirectangular projection
+        centered on a reference point), accurate enough over a few tens of kilometers
+
+        :param latitude: latitudes, in degrees
+        :param longitude: longitudes, in degrees
+        :param lat0: the reference latitude (default: the mean latitude)
+        :param lon0: the reference longitude (default: the first longitude)
+        :return: a tuple (x, y) of coordinate arrays, in meters
+    """
+
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+
+    if lat0 is None:
+        lat0 = float(np.mean(latitude)) if latitude.size else 0.0
+    if lon0 is None:
+        lon0 = float(longitude[0]) if longitude.size else 0.0
+
+    # Wrap the longitude differences around the antimeridian
+    dlon = (longitude - lon0 + 180.0) % 360.0 - 180.0
+
+    x = np.radians(dlon) * EARTH_RADIUS * np.cos(np.radians(lat0))
+    y = np.radians(latitude - lat0) * EARTH_RADIUS
+
+    return x, y
+
+
+def distance(lat1, lon1, lat2, lon2):
+
+    """ Computes the great-circle distance between two points (scalar version of haversine,
+        cheaper than NumPy for a single pair of points)
+
+        :param lat1: latitude of the first point, in degrees
+        :param lon1: longitude of the first point, in degrees
+        :param lat2: latitude of the second point, in degrees
+        :param lon2: longitude of the second point, in degrees
+        :return: the distance, in meters
+    """
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(1.0, max(0.0, a))))
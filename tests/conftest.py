@@ -0,0 +1,21 @@
+from config import config
+
+import os
+import pytest
+
+
+CONFIG_FILENAME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "config.json")
+
+
+@pytest.fixture
+def appconfig(tmp_path):
+
+    """ The shipped application configuration, writing to a temporary database """
+
+    appconfig = config.AppConfig(CONFIG_FILENAME)
+    assert appconfig.load_app_config() == 0
+
+    appconfig.database_filename = str(tmp_path / "test.db")
+    appconfig.spool_directory = None
+
+    return appconfig
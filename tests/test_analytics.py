@@ -0,0 +1,94 @@
+from core import analytics, database
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def connection_handler(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "analytics.db"))
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def interleaved_records(count=10):
+
+    """ Two receivers moving north along parallel tracks 1 degree apart, reported alternately """
+
+    records = []
+    for i in range(count):
+        for device_id, longitude in ((0, 0.0), (1, 1.0)):
+            records.append((1, i * 0.001, longitude, None, None, None, 1.0, 2, f"2020-01-01T00:00:{i:02d}.000Z", device_id))
+
+    return records
+
+
+def test_summary_distance_per_device(connection_handler):
+
+    records = interleaved_records()
+
+    # The records are inserted in several batches, the path of each device continues across them
+    assert database.insert_location_data(connection_handler, records[:7], session_table_name="session") == 7
+    assert database.insert_location_data(connection_handler, records[7:], session_table_name="session") == 13
+
+    summary = database.get_session_summary(connection_handler, 1)
+    track = 2 * 9 * 111.19
+    assert summary["point_count"] == 20
+    assert summary["distance"] == pytest.approx(track, rel=0.01)
+
+    # The rebuilt summary is the same
+    database.rebuild_session_summary(connection_handler, 1)
+    assert database.get_session_summary(connection_handler, 1)["distance"] == pytest.approx(summary["distance"])
+
+
+def test_statistics_per_device(connection_handler):
+
+    database.insert_location_data(connection_handler, interleaved_records())
+
+    stats = analytics.session_statistics(analytics.load_session_arrays(connection_handler, 1))
+    assert stats["points"] == 20
+    assert stats["distance"] == pytest.approx(2 * 9 * 111.19, rel=0.01)
+    assert stats["moving_time"] == pytest.approx(18.0)
+
+    # Without device column, the locations are a single path
+    arrays = analytics.load_session_arrays(connection_handler, 1)
+    del arrays["device_id"]
+    assert analytics.session_statistics(arrays)["distance"] > 19 * 100000
+
+
+def test_statistics_of_a_single_device():
+
+    arrays = {
+        "time": np.array([0, 1000, 2000], dtype=np.int64),
+        "latitude": np.array([0.0, 0.001, 0.002]),
+        "longitude": np.zeros(3),
+        "altitude": np.array([10.0, np.nan, 15.0]),
+        "speed": np.array([np.nan, np.nan, np.nan]),
+        "climb": np.array([np.nan, np.nan, np.nan]),
+        "mode": np.array([3, 3, 3], dtype=np.int8),
+        "device_id": np.array([-1, -1, -1], dtype=np.int64)
+    }
+
+    stats = analytics.session_statistics(arrays)
+    assert stats["distance"] == pytest.approx(222.4, rel=0.01)
+    assert stats["elevation_gain"] == 5.0
+    assert stats["duration"] == 2.0 and stats["moving_time"] == 2.0
+
+
+def test_analyze_sessions_stored_as_blocks(tmp_path, connection_handler):
+
+    database.insert_location_data(connection_handler, interleaved_records())
+    database.create_new_session(connection_handler)
+    records = [(2,) + record[1:] for record in interleaved_records(5)]
+    assert database.insert_location_blocks(connection_handler, records) == 10
+
+    assert analytics.list_session_ids(connection_handler) == [1, 2]
+
+    results = analytics.analyze_sessions(str(tmp_path / "analytics.db"), processes=1)
+    assert sorted(results) == [1, 2]
+    assert results[2]["points"] == 10
+    assert results[2]["distance"] == pytest.approx(2 * 4 * 111.19, rel=0.01)
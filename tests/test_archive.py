@@ -0,0 +1,78 @@
+from core import archive, database
+
+import os
+import pytest
+
+
+@pytest.fixture
+def connection_handler(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "archive.db"))
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def insert(connection_handler, count, mode=3):
+
+    records = [(1, 45.5 + i * 1e-4, -73.6, 30.0, 0.0, 0.0, 1.0, mode, f"2020-01-01T00:00:{i:02d}.000Z", None) for i in range(count)]
+    assert database.insert_location_data(connection_handler, records) == count
+
+
+def test_archive_holds_the_locations_with_a_fix(connection_handler, tmp_path):
+
+    insert(connection_handler, 10)
+    insert(connection_handler, 5, mode=1)
+
+    assert archive.write_session_archive(connection_handler, 1, str(tmp_path)) == 10
+    assert len(list(archive.iter_archive_locations(archive.get_session_path(str(tmp_path), 1)))) == 10
+
+
+def test_archive_is_replaced(connection_handler, tmp_path):
+
+    insert(connection_handler, 10)
+    assert archive.write_session_archive(connection_handler, 1, str(tmp_path)) == 10
+
+    insert(connection_handler, 10)
+    assert archive.write_session_archive(connection_handler, 1, str(tmp_path)) == 20
+
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith("session_")] == ["session_000001"]
+    assert archive.read_header(archive.get_session_path(str(tmp_path), 1))["count"] == 20
+
+
+def test_failed_swap_keeps_the_previous_archive(connection_handler, tmp_path, monkeypatch):
+
+    insert(connection_handler, 10)
+    assert archive.write_session_archive(connection_handler, 1, str(tmp_path)) == 10
+    path = archive.get_session_path(str(tmp_path), 1)
+
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if src.endswith(".tmp"):
+            raise OSError("rename failed")
+        replace(src, dst)
+
+    insert(connection_handler, 10)
+    monkeypatch.setattr(os, "replace", failing_replace)
+    assert archive.write_session_archive(connection_handler, 1, str(tmp_path)) == -1
+    monkeypatch.undo()
+
+    assert archive.read_header(path)["count"] == 10
+    assert not os.path.exists(f"{path}.old") and not os.path.exists(f"{path}.tmp")
+
+
+def test_interrupted_swap_is_recovered(connection_handler, tmp_path):
+
+    insert(connection_handler, 10)
+    assert archive.write_session_archive(connection_handler, 1, str(tmp_path)) == 10
+    path = archive.get_session_path(str(tmp_path), 1)
+
+    # Stopped after the previous archive was renamed aside
+    os.replace(path, f"{path}.old")
+
+    archive.recover_session_archive(path)
+    assert archive.read_header(path)["count"] == 10
+    assert not os.path.exists(f"{path}.old")
@@ -0,0 +1,140 @@
+from core import backends, location, ring_buffer
+
+import multiprocessing
+import pytest
+import queue
+
+
+def make_batch(start, count=1):
+
+    return location.LocationBatch([location.Location(45.5, -73.6 + i * 1e-4, 30.0 if i % 2 else None, 90.0, 0.0, 15.0, 3, \
+        f"2020-01-01T00:00:{i % 60:02d}.{i % 1000:03d}456Z", device_id=i % 3) for i in range(start, start + count)])
+
+
+def drain(q, timeout=1.0):
+
+    batches = []
+    while not q.empty():
+        batches.extend(q.get_many(100000, timeout=timeout))
+
+    return [loc for batch in batches for loc in batch]
+
+
+def longitudes(locations):
+
+    return [round((loc.longitude + 73.6) * 1e4) for loc in locations]
+
+
+def test_round_trip_preserves_columns():
+
+    q = backends.SharedBatchQueue(slots=4, slot_size=10)
+    batch = make_batch(0, 25)
+    assert q.put(batch)
+
+    received = drain(q)
+
+    assert [(loc.altitude, loc.utc_time, loc.device_id, loc.mode) for loc in received] == \
+           [(loc.altitude, loc.utc_time, loc.device_id, loc.mode) for loc in batch]
+    assert q.stats()["dropped"] == 0
+    q.close()
+
+
+def test_small_batches_are_coalesced():
+
+    q = backends.SharedBatchQueue(slots=3, slot_size=100)
+
+    # The first location is published at once, the next ones share the open slot
+    for i in range(150):
+        assert q.put(make_batch(i), timeout=1.0)
+
+    assert q.qsize() == 150
+    assert longitudes(drain(q)) == list(range(150))
+    q.close()
+
+
+def test_drop_newest():
+
+    q = backends.SharedBatchQueue(slots=2, slot_size=5, overflow_policy=ring_buffer.DROP_NEWEST)
+
+    results = [q.put(make_batch(i)) for i in range(10)]
+
+    assert results == [True] * 6 + [False] * 4
+    assert q.stats()["dropped"] == 4
+    assert longitudes(drain(q)) == list(range(6))
+    q.close()
+
+
+def test_drop_oldest():
+
+    q = backends.SharedBatchQueue(slots=2, slot_size=2, overflow_policy=ring_buffer.DROP_OLDEST)
+
+    for i in range(6):
+        assert q.put(make_batch(i))
+
+    assert longitudes(drain(q)) == [3, 4, 5]
+    assert q.stats()["dropped"] == 3
+    q.close()
+
+
+def test_block_timeout_drops():
+
+    q = backends.SharedBatchQueue(slots=1, slot_size=1)
+
+    assert q.put(make_batch(0))
+    assert not q.put(make_batch(1), timeout=0.05)
+    assert q.stats()["dropped"] == 1
+    q.close()
+
+
+def test_spill_blocks():
+
+    q = backends.SharedBatchQueue(slots=1, slot_size=1, overflow_policy=ring_buffer.SPILL)
+    assert q.overflow_policy == ring_buffer.BLOCK
+    q.close()
+
+
+def test_unknown_policy():
+
+    with pytest.raises(ValueError):
+        backends.SharedBatchQueue(overflow_policy="unknown")
+
+
+def test_get_empty():
+
+    q = backends.SharedBatchQueue(slots=1, slot_size=1)
+
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.05)
+    q.close()
+
+
+def produce(q, start, count):
+
+    for i in range(start, start + count):
+        q.put(make_batch(i))
+
+
+def test_producer_processes():
+
+    q = backends.SharedBatchQueue(slots=8, slot_size=64)
+    producers = [multiprocessing.Process(target=produce, args=(q, i * 1000, 1000)) for i in range(2)]
+
+    for producer in producers:
+        producer.start()
+
+    received = []
+    while len(received) < 2000:
+        for batch in q.get_many(500, timeout=5.0):
+            received.extend(batch)
+
+    for producer in producers:
+        producer.join()
+
+    values = longitudes(received)
+
+    # Every producer's locations arrive complete and in order
+    assert sorted(values) == list(range(2000))
+    assert [v for v in values if v < 1000] == list(range(1000))
+    assert [v for v in values if v >= 1000] == list(range(1000, 2000))
+    assert received[values.index(1)].utc_time == "2020-01-01T00:00:01.001456Z"
+    q.close()
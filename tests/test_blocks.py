@@ -0,0 +1,177 @@
+from core import blocks, database, location, recorder, ring_buffer
+
+import numpy as np
+import pytest
+
+
+def make_arrays(count, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    return {
+        "time": 1577836800000 + np.cumsum(rng.integers(0, 2000, count)),
+        "latitude": np.round(45.5 + np.cumsum(rng.normal(0, 1e-4, count)), 7),
+        "longitude": np.round(-73.6 + np.cumsum(rng.normal(0, 1e-4, count)), 7),
+        "altitude": np.round(rng.normal(30, 5, count), 2),
+        "heading": np.round(rng.uniform(0, 360, count), 2),
+        "climb": np.round(rng.normal(0, 1, count), 2),
+        "speed": np.round(rng.uniform(0, 40, count), 2),
+        "mode": rng.integers(2, 4, count).astype(np.int8)
+    }
+
+
+def assert_arrays_equal(decoded, arrays):
+
+    for column, _ in blocks.BLOCK_COLUMNS:
+        np.testing.assert_array_equal(decoded[column], arrays[column])
+
+
+@pytest.mark.parametrize("values", [
+    [0],
+    [0, 1, 127, 128, 16383, 16384, 2 ** 35, 2 ** 63 - 1, 2 ** 64 - 1],
+    list(range(1000))
+])
+def test_varint_round_trip(values):
+
+    values = np.array(values, dtype=np.uint64)
+    data = blocks.varint_encode(values)
+    decoded, size = blocks.varint_decode(data + b"\x05", len(values))
+
+    assert size == len(data)
+    np.testing.assert_array_equal(decoded, values)
+
+
+def test_varint_truncated():
+
+    data = blocks.varint_encode(np.array([300, 300], dtype=np.uint64))
+
+    with pytest.raises(ValueError):
+        blocks.varint_decode(data[:-1], 2)
+
+
+def test_zigzag_round_trip():
+
+    values = np.array([0, -1, 1, -2, 2, 2 ** 62, -2 ** 62], dtype=np.int64)
+    codes = blocks.zigzag_encode(values)
+
+    np.testing.assert_array_equal(codes[:5], [0, 1, 2, 3, 4])
+    np.testing.assert_array_equal(blocks.zigzag_decode(codes), values)
+
+
+def test_block_round_trip():
+
+    arrays = make_arrays(1000)
+    assert_arrays_equal(blocks.decode_block(blocks.encode_block(arrays)), arrays)
+
+
+def test_block_missing_values():
+
+    arrays = make_arrays(19)
+    arrays["altitude"][::3] = np.nan
+    arrays["heading"][:] = np.nan
+    arrays["speed"][-1] = np.nan
+
+    decoded = blocks.decode_block(blocks.encode_block(arrays))
+
+    assert_arrays_equal(decoded, arrays)
+    assert np.isnan(decoded["heading"]).all()
+
+
+def test_empty_block():
+
+    arrays = {column: np.array([], dtype=np.int8 if column == "mode" else np.float64) for column, _ in blocks.BLOCK_COLUMNS}
+    decoded = blocks.decode_block(blocks.encode_block(arrays))
+
+    assert all(len(values) == 0 for values in decoded.values())
+
+
+def test_block_extreme_values():
+
+    arrays = make_arrays(4)
+    arrays["time"] = np.array([0, 2 ** 41, 1, 2 ** 41], dtype=np.int64)
+    arrays["latitude"] = np.array([-90.0, 90.0, -90.0, 90.0])
+    arrays["longitude"] = np.array([-180.0, 180.0, 179.9999999, -179.9999999])
+    arrays["altitude"] = np.array([-10000.0, 100000.0, 0.0, -0.01])
+
+    assert_arrays_equal(blocks.decode_block(blocks.encode_block(arrays)), arrays)
+
+
+def test_unsupported_version():
+
+    data = bytearray(blocks.encode_block(make_arrays(2)))
+    data[0] = blocks.BLOCK_VERSION + 1
+
+    with pytest.raises(ValueError):
+        blocks.decode_block(bytes(data))
+
+
+@pytest.fixture
+def connection_handler(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "blocks.db"))
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def make_records(modes):
+
+    return [(1, 45.5, -73.6 + i * 0.001, 30.0, 90.0, 0.0, 5.0, mode, f"2020-01-01T00:00:{i:02d}.000Z") for i, mode in enumerate(modes)]
+
+
+def test_layouts_return_the_same_modes(connection_handler, tmp_path):
+
+    records = make_records([1, 3])
+    assert database.insert_location_blocks(connection_handler, records) == 2
+
+    other = database.connect(str(tmp_path / "rows.db"))
+    database.create_tables(other)
+    database.migrate(other)
+    database.create_new_session(other)
+    assert database.insert_location_data(other, records) == 2
+
+    rows = [loc.mode for loc in database.iter_locations(other, session_id=1)]
+    stored = [loc.mode for loc in database.iter_locations(connection_handler, session_id=1)]
+    database.disconnect(other)
+
+    assert rows == stored == [1, 3]
+
+    # The session arrays only hold the fixes, whatever the layout
+    assert [chunk["mode"].tolist() for chunk in database.iter_session_arrays(connection_handler, 1)] == [[3]]
+
+
+def test_missing_mode_is_stored(connection_handler):
+
+    assert database.insert_location_blocks(connection_handler, make_records([None, 3])) == 2
+    assert database.insert_location_blocks(connection_handler, [(1, "a", -73.6, None, None, None, None, 3, "")]) == -1
+
+
+def test_recorder_holds_the_open_block(appconfig):
+
+    appconfig.storage_layout = database.BLOCKS
+    appconfig.storage_block_size = 10
+    appconfig.storage_block_interval = 3600
+
+    worker = recorder.Recorder(ring_buffer.RingBuffer(), appconfig)
+    assert worker.init_connection() == 0
+    worker.session_id = 1
+    block_table_name = database.get_block_table_name()
+
+    def count_blocks():
+        return worker.connection_handler.execute(f"SELECT COUNT(*), COALESCE(SUM(point_count), 0) FROM {block_table_name};").fetchone()
+
+    for i in range(9):
+        worker.write_batch(location.LocationBatch([location.Location(45.5, -73.6 + i * 0.001, 30.0, 90.0, 0.0, 5.0, 3, \
+            f"2020-01-01T00:00:{i:02d}.000Z")]))
+    assert count_blocks() == (0, 0)
+
+    worker.write_batch(location.LocationBatch([location.Location(45.5, -73.5, 30.0, 90.0, 0.0, 5.0, 3, "2020-01-01T00:00:09.000Z")]))
+    assert count_blocks() == (1, 10)
+
+    worker.write_batch(location.LocationBatch([location.Location(45.5, -73.4, 30.0, 90.0, 0.0, 5.0, 3, "2020-01-01T00:00:10.000Z")]))
+    worker.write_batch(location.LocationBatch(), flush=True)
+    assert count_blocks() == (2, 11)
+
+    database.disconnect(worker.connection_handler)
@@ -0,0 +1,51 @@
+from core import database, downsampler
+
+import itertools
+import pytest
+
+
+@pytest.fixture
+def connection_handler(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "rollup.db"))
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def make_records(session_id, start, count, mode=3):
+
+    return [(session_id, 45.5 + i * 1e-4, -73.6, 30.0, 0.0, 0.0, 1.0, mode, f"2020-01-01T00:{i // 60:02d}:{i % 60:02d}.000Z", None) \
+            for i in range(start, start + count)]
+
+
+def test_build_location_query_min_id_and_mode():
+
+    sql, parameters = database.build_location_query(session_id=1, min_id=10, min_mode=2)
+
+    assert "id > ?" in sql and "mode >= ?" in sql
+    assert sql.index("WHERE") < sql.index("ORDER BY")
+    assert parameters == [1, 10, 2]
+
+
+def test_raw_locations_are_merged_with_the_rollups(connection_handler):
+
+    for session_id in (1, 2):
+        database.create_new_session(connection_handler)
+        database.insert_location_data(connection_handler, make_records(session_id, 0, 120))
+
+    assert downsampler.downsample(connection_handler) == 240
+
+    # Stored after the downsampling: raw locations, except the ones without a fix
+    for session_id in (1, 2):
+        database.insert_location_data(connection_handler, make_records(session_id, 120, 30) + make_records(session_id, 150, 5, mode=1))
+
+    locations = list(downsampler.iter_locations_at_resolution(connection_handler, 10))
+
+    # Every session is a single run of locations, in time order
+    assert [session_id for session_id, _ in itertools.groupby(loc.session_id for loc in locations)] == [1, 2]
+    for session_id in (1, 2):
+        times = [loc.utc_time for loc in locations if loc.session_id == session_id]
+        assert times == sorted(times)
+        assert len(times) == 12 + 30
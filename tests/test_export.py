@@ -0,0 +1,121 @@
+from core import export, location
+
+import gzip
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+
+KML = "{http://www.opengis.net/kml/2.2}"
+
+
+def make_locations(count, session_id=1, mode=3):
+
+    return [location.Location(45.5 + i * 0.001, -73.6, 30.0 + i, 90.0, 0.0, 1.0, mode, f"2020-01-01T00:00:{i % 60:02d}.000Z", \
+        session_id=session_id) for i in range(count)]
+
+
+def parse_gpx(root):
+
+    # The GPX root is written without namespace
+    return [[(float(point.get("lat")), point.find("ele")) for point in segment.iter("trkpt")] for segment in root.iter("trkseg")]
+
+
+def test_gpx_segments_per_session(tmp_path):
+
+    filename = str(tmp_path / "track.gpx")
+    data = make_locations(3) + [location.LocationBatch(make_locations(2, session_id=2, mode=2))] + make_locations(1, mode=1)
+
+    assert export.save_as_gpx(filename, data) == 0
+
+    segments = parse_gpx(ElementTree.parse(filename).getroot())
+    assert [len(segment) for segment in segments] == [3, 2]
+    assert segments[0][0][0] == 45.5
+    assert segments[0][0][1].text == "30.0"
+    assert segments[1][0][1] is None
+
+
+def test_gpx_chunks_and_gzip(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(export, "WRITE_CHUNK_SIZE", 7)
+    filename = str(tmp_path / "track.gpx.gz")
+
+    assert export.save_as_gpx(filename, iter(make_locations(50))) == 0
+
+    with gzip.open(filename, "rt", encoding="utf-8") as infile:
+        segments = parse_gpx(ElementTree.fromstring(infile.read()))
+
+    assert [len(segment) for segment in segments] == [50]
+
+    # The compression is forced off regardless of the extension
+    plain = str(tmp_path / "plain.gpx.gz")
+    assert export.save_as_gpx(plain, make_locations(2), compress=False) == 0
+    assert len(parse_gpx(ElementTree.parse(plain).getroot())[0]) == 2
+
+
+def test_gpx_empty_and_simplified(tmp_path):
+
+    filename = str(tmp_path / "empty.gpx")
+    assert export.save_as_gpx(filename, []) == 0
+    assert parse_gpx(ElementTree.parse(filename).getroot()) == []
+
+    # A straight track is simplified to its end points
+    assert export.save_as_gpx(filename, make_locations(20), simplify_tolerance=1.0) == 0
+    assert len(parse_gpx(ElementTree.parse(filename).getroot())[0]) == 2
+
+
+def parse_kml(root):
+
+    placemarks = []
+    for placemark in root.iter(f"{KML}Placemark"):
+        coordinates = placemark.find(f"{KML}LineString/{KML}coordinates").text.split()
+        placemarks.append((placemark.find(f"{KML}name").text, [float(point.split(",")[1]) for point in coordinates]))
+
+    return placemarks
+
+
+def test_kml_placemarks_per_session(tmp_path):
+
+    filename = str(tmp_path / "track")
+    data = make_locations(3) + [location.LocationBatch(make_locations(2, session_id=2))] + make_locations(1, mode=1)
+
+    assert export.save_as_kml(filename, data, name="Trip <1> & co") == 0
+
+    root = ElementTree.parse(f"{filename}.kml").getroot()
+    assert root.find(f"{KML}Document/{KML}name").text == "Trip <1> & co"
+
+    placemarks = parse_kml(root)
+    assert [name for name, _ in placemarks] == ["Trip <1> & co", "Trip <1> & co (2)"]
+    assert [len(latitudes) for _, latitudes in placemarks] == [3, 2]
+
+
+def test_kml_linestrings_are_split(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(export, "WRITE_CHUNK_SIZE", 7)
+    filename = str(tmp_path / "track.kml")
+
+    assert export.write_kml(filename, iter(make_locations(10)), max_points=4) == 0
+
+    placemarks = [latitudes for _, latitudes in parse_kml(ElementTree.parse(filename).getroot())]
+    assert [len(latitudes) for latitudes in placemarks] == [4, 4, 4]
+
+    # Consecutive LineStrings share their boundary point
+    assert placemarks[0][-1] == placemarks[1][0] and placemarks[1][-1] == placemarks[2][0]
+    assert sorted(set(sum(placemarks, []))) == [loc.latitude for loc in make_locations(10)]
+
+
+def test_kmz_round_trip(tmp_path):
+
+    filename = str(tmp_path / "track.kmz")
+
+    assert export.write_kml(filename, make_locations(5), name="Trip") == 0
+
+    with zipfile.ZipFile(filename) as archive:
+        assert archive.namelist() == ["doc.kml"]
+        placemarks = parse_kml(ElementTree.fromstring(archive.read("doc.kml")))
+
+    assert placemarks == [("Trip", [loc.latitude for loc in make_locations(5)])]
+
+    # An empty document is still well-formed
+    assert export.write_kml(filename, []) == 0
+    with zipfile.ZipFile(filename) as archive:
+        assert parse_kml(ElementTree.fromstring(archive.read("doc.kml"))) == []
@@ -0,0 +1,72 @@
+from core import filters, location, pipeline
+from helpers import generic
+
+import asyncio
+import json
+import time
+
+
+def make_location(longitude, utc_time, speed=0.0, mode=3):
+
+    return location.Location(45.5, longitude, 30.0, 90.0, 0.0, speed, mode, utc_time)
+
+
+def test_stationary_locations_are_suppressed():
+
+    stationary_filter = filters.StationaryFilter(keepalive_interval=60.0)
+
+    reported = []
+    for i in range(120):
+        reported += stationary_filter.process(make_location(-73.6, f"2020-01-01T00:{i // 60:02d}:{i % 60:02d}.000Z"))
+
+    # The first location, the stop transition and a keep-alive location a minute later
+    assert [loc.utc_time for loc in reported] == ["2020-01-01T00:00:00.000Z", "2020-01-01T00:00:01.000Z", "2020-01-01T00:01:01.000Z"]
+
+
+def test_fix_without_time_uses_the_system_time():
+
+    stationary_filter = filters.StationaryFilter(keepalive_interval=60.0)
+
+    assert len(stationary_filter.process(make_location(-73.6, None))) == 1
+    assert len(stationary_filter.process(make_location(-73.6, None))) == 1
+
+    # The fix times are compared with the system time of the fixes without time
+    recent = generic.epoch_ms_to_iso(round((time.time() - 10) * 1000))
+    assert stationary_filter.process(make_location(-73.6, recent)) == []
+
+
+def test_disabled_filter(appconfig):
+
+    appconfig.filter_enabled = False
+    assert filters.create_filter(appconfig) is None
+
+    appconfig.filter_enabled = True
+    assert isinstance(filters.create_filter(appconfig), filters.StationaryFilter)
+
+
+def test_asyncio_reader_applies_the_filter(appconfig):
+
+    async def serve(reader, writer):
+        await reader.readline()
+        for i in range(10):
+            report = {"class": "TPV", "mode": 3, "lat": 45.5, "lon": -73.6, "speed": 0.0, "time": f"2020-01-01T00:00:{i:02d}.000Z"}
+            writer.write(f"{json.dumps(report)}\n[]\n".encode())
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        source = {"name": "test", "gpsd_ip_address": "127.0.0.1", "gpsd_port": server.sockets[0].getsockname()[1], "device_id": 0}
+
+        fixes = asyncio.Queue()
+        reader = asyncio.ensure_future(pipeline.read_gpsd(appconfig, fixes, source=source))
+        await asyncio.sleep(0.5)
+        reader.cancel()
+        server.close()
+
+        return [fixes.get_nowait().utc_time for _ in range(fixes.qsize())]
+
+    appconfig.filter_enabled = True
+    appconfig.monitor_delay = 10.0
+
+    assert asyncio.run(run()) == ["2020-01-01T00:00:00.000Z", "2020-01-01T00:00:01.000Z"]
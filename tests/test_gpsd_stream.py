@@ -0,0 +1,63 @@
+from core import gpsd_stream, location
+
+import json
+import socket
+
+
+TPV = {"class": "TPV", "mode": 3, "lat": 45.5, "lon": -73.6, "alt": 30.0, "track": 90.0, "climb": 0.5, "speed": 1.5, \
+       "time": "2020-01-01T00:00:00.000Z"}
+
+
+def connected_stream(timeout=0.05):
+
+    stream = gpsd_stream.GPSDStream(timeout=timeout)
+    stream.sock, server = socket.socketpair()
+    stream.sock.settimeout(timeout)
+    return stream, server
+
+
+def test_location_from_tpv():
+
+    loc = gpsd_stream.location_from_tpv(TPV, device_id=2)
+    assert (loc.latitude, loc.longitude, loc.altitude, loc.climb, loc.mode, loc.device_id) == (45.5, -73.6, 30.0, 0.5, 3, 2)
+
+    # Altitude and climb are only kept for 3D fixes
+    loc = gpsd_stream.location_from_tpv(dict(TPV, mode=2))
+    assert (loc.altitude, loc.climb) == (None, None)
+
+    # A report without fix has no position (not 0,0)
+    loc = gpsd_stream.location_from_tpv({"class": "TPV", "mode": 1})
+    assert (loc.latitude, loc.longitude) == (None, None)
+
+    batch = location.LocationBatch([loc])
+    assert (batch[0].latitude, batch[0].longitude) == (None, None)
+    assert list(batch.rows(1)) == []
+
+
+def test_reports_split_the_stream():
+
+    stream, server = connected_stream()
+    lines = [json.dumps({"class": "VERSION"}), json.dumps(TPV), "not json", json.dumps([TPV]), json.dumps(dict(TPV, lat=46.0))]
+    data = ("\n".join(lines) + "\n").encode()
+
+    # The reports are split over several reads
+    server.sendall(data[:20])
+    reports = stream.reports()
+    assert next(reports) is None
+    server.sendall(data[20:])
+    server.close()
+
+    assert [report["lat"] for report in reports if report is not None] == [45.5, 46.0]
+    assert stream.sock is None
+
+
+def test_reports_end_when_the_connection_is_lost():
+
+    def reset(*args):
+        raise ConnectionResetError("Connection reset by peer")
+
+    stream = gpsd_stream.GPSDStream()
+    stream.sock = type("ResetSocket", (), {"recv": reset, "close": lambda self: None})()
+
+    assert list(stream.reports()) == []
+    assert stream.sock is None
@@ -0,0 +1,60 @@
+from core import location
+from helpers import generic
+
+import math
+import pytest
+
+
+def make_location(utc_time, mode=3, altitude=30.0):
+
+    return location.Location(45.5, -73.6, altitude, 90.0, 0.5, 15.0, mode, utc_time, device_id=2)
+
+
+@pytest.mark.parametrize("utc_time, expected", [
+    ("2020-01-01T00:00:00Z", 1577836800000),
+    ("2020-01-01T00:00:00.5Z", 1577836800500),
+    ("2020-01-01T00:00:00.123Z", 1577836800123),
+    ("2020-01-01T00:00:00.12345Z", 1577836800123),
+    ("2020-01-01T00:00:00.123456789Z", 1577836800123),
+    ("2020-01-01T00:00:00.123", 1577836800123),
+    ("", -1),
+    (None, -1),
+    ("not a time", -1)
+])
+def test_iso_to_epoch_ms(utc_time, expected):
+
+    assert generic.iso_to_epoch_ms(utc_time) == expected
+
+
+def test_rows_keep_reported_time():
+
+    batch = location.LocationBatch([make_location("2020-01-01T00:00:00.12345Z"), make_location(None)])
+    rows = list(batch.rows(7))
+
+    assert rows[0] == (7, 45.5, -73.6, 30.0, 90.0, 0.5, 15.0, 3, "2020-01-01T00:00:00.12345Z", 2)
+    assert rows[1][8] == ''
+
+
+def test_rows_skip_no_fix_and_2d_altitude():
+
+    batch = location.LocationBatch([make_location("t0", mode=1), make_location("t1", mode=2), make_location("t2", altitude=None)])
+    rows = list(batch.rows(1))
+
+    assert [row[8] for row in rows] == ["t1", "t2"]
+    assert rows[0][3] is None and rows[0][5] is None
+    assert rows[1][3] is None
+
+
+def test_batch_round_trip():
+
+    batch = location.LocationBatch([make_location("2020-01-01T00:00:01Z", altitude=None)])
+    batch.extend(location.LocationBatch([make_location("2020-01-01T00:00:02Z")]))
+
+    assert len(batch) == 2
+    assert math.isnan(batch.altitude[0])
+
+    first = batch[0]
+    assert first.altitude is None
+    assert first.utc_time == "2020-01-01T00:00:01Z"
+    assert first.device_id == 2
+    assert first.session_id is None
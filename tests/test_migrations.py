@@ -0,0 +1,107 @@
+from core import database
+
+import sqlite3
+import pytest
+
+
+LEGACY_SCHEMA = """
+    CREATE TABLE session (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        start_timestamp DATETIME DEFAULT (DATETIME(CURRENT_TIMESTAMP)),
+        end_timestamp DATETIME DEFAULT NULL
+    );
+    CREATE TABLE location (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        latitude FLOAT DEFAULT NULL,
+        longitude FLOAT DEFAULT NULL,
+        altitude FLOAT DEFAULT NULL,
+        heading FLOAT DEFAULT NULL,
+        climb FLOAT DEFAULT NULL,
+        speed INTEGER DEFAULT NULL,
+        mode NTEGER DEFAULT 0,
+        utc_time DATETIME DEFAULT NULL,
+        db_timestamp DATETIME DEFAULT (DATETIME(CURRENT_TIMESTAMP)),
+        FOREIGN KEY(session_id) REFERENCES session(id)
+    );
+    INSERT INTO session (id) VALUES (1);
+    INSERT INTO location (session_id, latitude, longitude, altitude, heading, climb, speed, mode, utc_time) VALUES
+        (1, 45.0, 9.0, 'NULL', 90.0, 'NULL', 1.5, 2, '2020-01-01T00:00:00.000Z'),
+        (1, 45.1, 9.1, 120.0, 90.0, 0.5, 2.5, 3, '2020-01-01T00:00:01.000Z');
+"""
+
+
+@pytest.fixture
+def legacy_database(tmp_path):
+
+    """ A database created by the versions storing the 'NULL' strings, without schema version """
+
+    filename = str(tmp_path / "legacy.db")
+
+    legacy = sqlite3.connect(filename)
+    legacy.executescript(LEGACY_SCHEMA)
+    legacy.close()
+
+    connection_handler = database.connect(filename)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def test_migrate_legacy_database(legacy_database):
+
+    latest = database.MIGRATIONS[-1][0]
+
+    assert database.get_schema_version(legacy_database) == 0
+    assert database.migrate(legacy_database) == latest
+    assert database.get_schema_version(legacy_database) == latest
+
+    columns = {row[1]: row[2] for row in legacy_database.execute("PRAGMA table_info(location);")}
+    assert (columns["speed"], columns["mode"], columns["device_id"]) == ("FLOAT", "INTEGER", "INTEGER")
+
+    rows = legacy_database.execute("SELECT altitude, climb, speed, mode FROM location ORDER BY id;").fetchall()
+    assert rows == [(None, None, 1.5, 2), (120.0, 0.5, 2.5, 3)]
+
+    assert database.get_session_summary(legacy_database, 1)["point_count"] == 2
+
+
+def test_migrate_keeps_the_spatial_index(legacy_database):
+
+    assert database.migrate(legacy_database) == database.MIGRATIONS[-1][0]
+
+    rtree_table_name = database.get_rtree_table_name()
+    if not database.check_if_datatable_exists(legacy_database, rtree_table_name):
+        pytest.skip("SQLite built without the R*Tree module")
+
+    assert legacy_database.execute(f"SELECT COUNT(*) FROM {rtree_table_name};").fetchone()[0] == 2
+    assert legacy_database.execute(f"SELECT watermark FROM {rtree_table_name}_state;").fetchone()[0] == 2
+    assert legacy_database.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name = ?;", \
+        (f"{rtree_table_name}_insert",)).fetchone() is None
+
+
+def test_migrate_is_idempotent(legacy_database):
+
+    latest = database.migrate(legacy_database)
+
+    assert database.migrate(legacy_database) == latest
+    assert legacy_database.execute("SELECT COUNT(*) FROM location;").fetchone()[0] == 2
+
+
+def test_new_database_is_created_at_the_latest_version(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "new.db"))
+    assert database.create_tables(connection_handler) == 0
+    assert database.migrate(connection_handler) == database.MIGRATIONS[-1][0]
+    database.disconnect(connection_handler)
+
+
+def test_failed_migration_is_rolled_back(legacy_database, monkeypatch):
+
+    def broken_migration(connection_handler, location_table_name="location", session_table_name="session"):
+        connection_handler.execute("CREATE TABLE partial (id INTEGER);")
+        connection_handler.execute("SELECT * FROM missing;")
+
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS[:2] + [(3, broken_migration)])
+
+    assert database.migrate(legacy_database) == -1
+    assert database.get_schema_version(legacy_database) == 2
+    assert not database.check_if_datatable_exists(legacy_database, "partial")
@@ -0,0 +1,88 @@
+from core import database, location, pipeline, ring_buffer
+
+import asyncio
+import pytest
+
+
+def make_location(i):
+
+    return location.Location(45.5, -73.6 + i * 1e-4, 30.0, 90.0, 0.0, 1.0, 3, f"2020-01-01T00:00:{i:02d}.000Z")
+
+
+@pytest.mark.parametrize("policy, expected", [
+    (ring_buffer.DROP_NEWEST, [0, 1]),
+    (ring_buffer.DROP_OLDEST, [3, 4])
+])
+def test_put_location_overflow_policies(appconfig, policy, expected):
+
+    async def run():
+        fixes = asyncio.Queue(maxsize=2)
+        results = [await pipeline.put_location(appconfig, fixes, make_location(i)) for i in range(5)]
+        return results, [round((fixes.get_nowait().longitude + 73.6) * 1e4) for _ in range(fixes.qsize())]
+
+    appconfig.queue_overflow_policy = policy
+    results, queued = asyncio.run(run())
+
+    assert queued == expected
+    assert results == ([True, True, False, False, False] if policy == ring_buffer.DROP_NEWEST else [True] * 5)
+
+
+def test_put_location_blocks(appconfig):
+
+    async def run():
+        fixes = asyncio.Queue(maxsize=1)
+        await pipeline.put_location(appconfig, fixes, make_location(0))
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pipeline.put_location(appconfig, fixes, make_location(1)), 0.05)
+
+    appconfig.queue_overflow_policy = ring_buffer.BLOCK
+    asyncio.run(run())
+
+
+def test_buffer_releases_batches_on_deadline_and_size(appconfig):
+
+    async def run():
+        fixes = asyncio.Queue()
+        batches = asyncio.Queue()
+        buffer = asyncio.ensure_future(pipeline.buffer_locations(appconfig, fixes, batches))
+
+        # A single location is released once the batch deadline passed
+        await fixes.put(make_location(0))
+        first = await asyncio.wait_for(batches.get(), 1.0)
+
+        for i in range(1, 6):
+            await fixes.put(make_location(i))
+        await fixes.put(None)
+        await buffer
+
+        return [len(first)] + [len(batch) for batch in iter(batches.get_nowait, None)]
+
+    appconfig.recorder_interval = 0.05
+    appconfig.recorder_batch_size = 3
+
+    assert asyncio.run(run()) == [1, 3, 2]
+
+
+def test_recorder_closes_the_session_when_a_write_fails(appconfig, monkeypatch):
+
+    def failing_insert(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    async def run(recorder):
+        batches = asyncio.Queue()
+        await batches.put(location.LocationBatch([make_location(0)]))
+        await recorder.run(batches)
+
+    appconfig.rollover_policy = None
+    appconfig.storage_layout = database.ROWS
+    monkeypatch.setattr(database, "insert_location_data", failing_insert)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run(pipeline.AsyncRecorder(appconfig)))
+
+    connection_handler = database.connect(appconfig.database_filename)
+    end_timestamp = connection_handler.execute("SELECT end_timestamp FROM session ORDER BY id DESC LIMIT 1;").fetchone()[0]
+    database.disconnect(connection_handler)
+
+    assert end_timestamp is not None
@@ -0,0 +1,69 @@
+from core import location, recorder, ring_buffer, database
+
+import time
+
+
+def make_batch(count):
+
+    return location.LocationBatch([location.Location(45.5, -73.6 + i * 0.001, 30.0, 90.0, 0.0, 15.0, 3, \
+        f"2020-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}.000Z") for i in range(count)])
+
+
+def test_flush_policy_follows_arrival_rate():
+
+    policy = recorder.FlushPolicy(1000, 1.0, smoothing=1.0)
+
+    # 50 locations collected within 0.5 s: 100 locations per second, one second of latency
+    assert policy.update(50, 0.5, 0.01) == 100
+    assert policy.arrival_rate == 100
+
+
+def test_flush_policy_bounds():
+
+    policy = recorder.FlushPolicy(200, 1.0, min_batch_size=10, smoothing=1.0)
+
+    assert policy.update(1, 1.0, 0.001) == 10
+    assert policy.update(10000, 1.0, 0.001) == 200
+
+    # A commit time longer than the latency grows the batch
+    assert policy.update(100, 1.0, 1.5) == 200
+
+
+def test_flush_policy_fixed():
+
+    policy = recorder.FlushPolicy(500, 1.0, adaptive=False)
+    assert policy.update(10, 1.0, 0.1) == 500
+
+
+def test_collect_batch_measures_from_first_location(appconfig):
+
+    q = ring_buffer.RingBuffer()
+    worker = recorder.Recorder(q, appconfig)
+
+    # The idle time before the first location is not part of the collection
+    assert len(worker.collect_batch(10, 0.05)) == 0
+
+    q.put(make_batch(10))
+    before = time.monotonic()
+    batch = worker.collect_batch(10, 1.0)
+
+    assert len(batch) == 10
+    assert worker.first_arrival >= before
+
+
+def test_stop_drains_the_queue(appconfig):
+
+    appconfig.recorder_interval = 0.1
+    q = ring_buffer.RingBuffer()
+    worker = recorder.Recorder(q, appconfig)
+    worker.start()
+
+    for i in range(20):
+        q.put(make_batch(100))
+
+    worker.stop()
+    worker.join()
+
+    connection_handler = database.connect_reader(appconfig.database_filename)
+    assert connection_handler.execute("SELECT COUNT(*) FROM location;").fetchone()[0] == 2000
+    database.disconnect(connection_handler)
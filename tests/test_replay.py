@@ -0,0 +1,85 @@
+from core import replay
+
+from functools import reduce
+
+import gzip
+import json
+import pytest
+
+
+def sentence(body):
+
+    return f"${body}*{reduce(lambda value, c: value ^ ord(c), body, 0):02X}"
+
+
+RMC = sentence("GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W")
+GGA = sentence("GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,")
+
+
+def test_nmea_checksum():
+
+    assert RMC.endswith("*6A") and GGA.endswith("*47")
+    assert replay.nmea_fields(RMC)[0] == "GPRMC"
+    assert replay.nmea_fields(RMC[:-1] + "B") is None
+    assert replay.nmea_fields(RMC[:-3]) is not None
+    assert replay.nmea_fields("$GP") is None
+    assert replay.nmea_fields("GPRMC,123519") is None
+
+
+def test_nmea_coordinate():
+
+    assert replay.nmea_coordinate("4807.038", "N") == pytest.approx(48.1173)
+    assert replay.nmea_coordinate("01131.000", "W") == pytest.approx(-11.516667)
+    assert replay.nmea_coordinate("", "N") is None
+
+
+def test_rmc_and_gga_are_merged():
+
+    locations = list(replay.iter_nmea_locations([RMC, GGA], device_id=4))
+
+    assert len(locations) == 1
+    loc = locations[0]
+    assert (loc.latitude, loc.longitude) == (pytest.approx(48.1173), pytest.approx(11.516667))
+    assert loc.altitude == 545.4 and loc.heading == 84.4
+    assert loc.horizontal_speed == pytest.approx(22.4 * replay.KNOTS_TO_MPS)
+    assert (loc.mode, loc.utc_time, loc.device_id) == (3, "1994-03-23T12:35:19.000Z", 4)
+
+
+def test_epochs_before_the_first_date_are_skipped():
+
+    gga = sentence("GPGGA,123518,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,")
+    rmc = sentence("GNRMC,123519.50,A,4807.038,S,01131.000,W,0.0,,230394,,")
+
+    locations = list(replay.iter_nmea_locations([gga, rmc]))
+
+    assert len(locations) == 1
+    assert locations[0].utc_time == "1994-03-23T12:35:19.500Z"
+    assert locations[0].latitude < 0 and locations[0].longitude < 0
+    assert (locations[0].mode, locations[0].altitude, locations[0].heading) == (2, None, None)
+
+
+def test_void_fix_and_malformed_sentences():
+
+    void = sentence("GPRMC,123520,V,4807.038,N,01131.000,E,,,230394,,")
+    malformed = sentence("GPGGA,123521,4807.038,N,01131.000,E,x,08,0.9,545.4,M,46.9,M,,")
+
+    locations = list(replay.iter_nmea_locations([RMC, void, malformed, "garbage"]))
+
+    assert [loc.mode for loc in locations] == [2, 1]
+
+
+def test_log_format_detection(tmp_path):
+
+    nmea = tmp_path / "log.nmea.gz"
+    with gzip.open(str(nmea), "wt") as log:
+        log.write(f"\n{RMC}\n{GGA}\n")
+
+    gpsd = tmp_path / "log.json"
+    gpsd.write_text("\n".join(json.dumps(report) for report in [{"class": "VERSION"}, [1, 2], \
+        {"class": "TPV", "mode": 3, "lat": 1.0, "lon": 2.0, "time": "2020-01-01T00:00:00.000Z"}]))
+
+    assert [loc.utc_time for loc in replay.iter_log_locations(str(nmea))] == ["1994-03-23T12:35:19.000Z"]
+    assert [loc.latitude for loc in replay.iter_log_locations(str(gpsd))] == [1.0]
+
+    with pytest.raises(ValueError):
+        replay.detect_format("hello")
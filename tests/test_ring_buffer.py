@@ -0,0 +1,114 @@
+from core import location, ring_buffer
+
+from threading import Thread
+
+import queue
+import time
+import pytest
+
+
+def make_location(i):
+
+    return location.Location(45.5, float(i), 30.0, 90.0, 0.0, 1.0, 3, f"2020-01-01T00:00:{i % 60:02d}.000Z")
+
+
+def drain(buffer):
+
+    values = []
+    while not buffer.empty():
+        for item in buffer.get_many(1000, timeout=1.0):
+            values.extend(int(loc.longitude) for loc in (item if isinstance(item, location.LocationBatch) else [item]))
+
+    return values
+
+
+def test_unknown_policy():
+
+    with pytest.raises(ValueError):
+        ring_buffer.RingBuffer(capacity=2, overflow_policy="unknown")
+
+
+def test_drop_oldest():
+
+    buffer = ring_buffer.RingBuffer(capacity=3, overflow_policy=ring_buffer.DROP_OLDEST)
+
+    assert all(buffer.put(make_location(i)) for i in range(5))
+    assert buffer.stats()["dropped"] == 2
+    assert drain(buffer) == [2, 3, 4]
+
+
+def test_drop_newest():
+
+    buffer = ring_buffer.RingBuffer(capacity=3, overflow_policy=ring_buffer.DROP_NEWEST)
+
+    assert [buffer.put(make_location(i)) for i in range(5)] == [True, True, True, False, False]
+    assert buffer.stats()["dropped"] == 2
+    assert drain(buffer) == [0, 1, 2]
+
+
+def test_block_times_out():
+
+    buffer = ring_buffer.RingBuffer(capacity=2, overflow_policy=ring_buffer.BLOCK)
+    buffer.put(make_location(0))
+    buffer.put(make_location(1))
+
+    with pytest.raises(queue.Full):
+        buffer.put(make_location(2), block=False)
+
+    start = time.monotonic()
+    with pytest.raises(queue.Full):
+        buffer.put(make_location(2), timeout=0.05)
+    assert time.monotonic() - start >= 0.05
+
+
+def test_block_waits_for_the_consumer():
+
+    buffer = ring_buffer.RingBuffer(capacity=2, overflow_policy=ring_buffer.BLOCK)
+
+    producer = Thread(target=lambda: [buffer.put(make_location(i)) for i in range(10)])
+    producer.start()
+
+    values = []
+    while len(values) < 10:
+        values.append(int(buffer.get(timeout=1.0).longitude))
+        assert buffer.qsize() <= 2
+
+    producer.join()
+    assert values == list(range(10))
+    assert buffer.stats()["high_water"] == 2
+
+
+def test_oversized_batch_is_accepted_when_empty():
+
+    buffer = ring_buffer.RingBuffer(capacity=2, overflow_policy=ring_buffer.BLOCK)
+
+    assert buffer.put(location.LocationBatch([make_location(i) for i in range(5)]), block=False)
+    assert buffer.qsize() == 5
+
+
+def test_spill_keeps_the_order(tmp_path):
+
+    buffer = ring_buffer.RingBuffer(capacity=4, overflow_policy=ring_buffer.SPILL, spill_directory=str(tmp_path))
+
+    for i in range(0, 20, 2):
+        assert buffer.put(location.LocationBatch([make_location(i), make_location(i + 1)]))
+
+    stats = buffer.stats()
+    assert stats["size"] == 20 and stats["spilled"] == 16 and stats["dropped"] == 0
+
+    assert drain(buffer) == list(range(20))
+    buffer.close()
+
+
+def test_get_many_limits_the_locations():
+
+    buffer = ring_buffer.RingBuffer(capacity=100)
+
+    for i in range(0, 10, 2):
+        buffer.put(location.LocationBatch([make_location(i), make_location(i + 1)]))
+
+    assert [len(item) for item in buffer.get_many(5)] == [2, 2]
+    assert [len(item) for item in buffer.get_many(1)] == [2]
+
+    with pytest.raises(queue.Empty):
+        ring_buffer.RingBuffer(capacity=1).get(timeout=0.01)
@@ -0,0 +1,68 @@
+from core import analytics, archive, database, rollover
+
+import pytest
+
+
+def make_records(session_id, start, count):
+
+    return [(session_id, 45.5 + i * 1e-4, -73.6, 30.0, 0.0, 0.0, 1.0, 3, f"2020-01-01T00:{i // 60:02d}:{i % 60:02d}.000Z", None) \
+            for i in range(start, start + count)]
+
+
+@pytest.fixture
+def rolled(tmp_path):
+
+    roller = rollover.Rollover(str(tmp_path / "gps.db"), rollover.ROWS, max_rows=10)
+    connection_handler = roller.open()
+    assert connection_handler is not None
+
+    session_id = database.create_new_session(connection_handler)
+    connection_handler.commit()
+
+    yield roller, connection_handler, session_id
+
+
+def insert(roller, connection_handler, records):
+
+    count = database.insert_location_data(connection_handler, records, session_table_name="session")
+    return roller.after_insert(connection_handler, count)
+
+
+def test_failed_roll_keeps_the_active_file(rolled, monkeypatch):
+
+    roller, connection_handler, session_id = rolled
+    active = roller.filename
+
+    monkeypatch.setattr(roller, "open_file", lambda filename: None)
+    connection_handler = insert(roller, connection_handler, make_records(session_id, 0, 10))
+
+    # The active file is still open and written to
+    assert roller.filename == active
+    assert roller.catalog.files() == [active]
+    assert database.insert_location_data(connection_handler, make_records(session_id, 10, 5)) == 5
+
+    monkeypatch.undo()
+    connection_handler = insert(roller, connection_handler, make_records(session_id, 15, 1))
+
+    assert roller.filename != active
+    assert roller.catalog.files(state=rollover.CLOSED) == [active]
+    roller.close(connection_handler)
+
+
+def test_sessions_are_read_across_the_files(rolled, tmp_path):
+
+    roller, connection_handler, session_id = rolled
+
+    for start in range(0, 25, 5):
+        connection_handler = insert(roller, connection_handler, make_records(session_id, start, 5))
+    roller.close(connection_handler)
+
+    catalog_filename = rollover.get_catalog_filename(str(tmp_path / "gps.db"))
+    assert len(rollover.find_files(catalog_filename)) == 3
+    assert rollover.list_session_ids(catalog_filename) == [session_id]
+
+    stats = analytics.analyze_session(catalog_filename, session_id, catalog=True)
+    assert stats["points"] == 25
+    assert analytics.analyze_sessions(catalog_filename, processes=1, catalog=True)[session_id]["points"] == 25
+
+    assert archive.archive_sessions(catalog_filename, str(tmp_path / "archive"), catalog=True) == {session_id: 25}
@@ -0,0 +1,83 @@
+from core import database, simplify
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def connection_handler(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "simplify.db"))
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def zigzag_records(count=50):
+
+    """ A straight track heading north with a 100 m detour every 10 locations """
+
+    return [(1, i * 0.0001, 0.001 if i % 10 == 5 else 0.0, None, None, None, 1.0, 2, f"2020-01-01T00:{i // 60:02d}:{i % 60:02d}.000Z") \
+            for i in range(count)]
+
+
+def test_douglas_peucker():
+
+    x = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    y = np.array([0.0, 0.1, 5.0, 0.1, 0.0])
+
+    assert simplify.douglas_peucker(x, y, 1.0).tolist() == [True, False, True, False, True]
+    assert simplify.douglas_peucker(x, y, 10.0).tolist() == [True, False, False, False, True]
+    assert simplify.douglas_peucker(np.empty(0), np.empty(0), 1.0).tolist() == []
+
+    # A closed track (identical end points)
+    assert simplify.douglas_peucker(np.array([0.0, 5.0, 0.0]), np.array([0.0, 0.0, 0.0]), 1.0).tolist() == [True, True, True]
+
+
+def test_visvalingam():
+
+    x = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    y = np.array([0.0, 0.1, 5.0, 0.1, 0.0])
+
+    # The triangles of the flat points have an area of 2.4, then the peak one has an area of 10
+    assert simplify.visvalingam(x, y, 2.0).tolist() == [True, False, True, False, True]
+    assert simplify.visvalingam(x, y, 4.0).tolist() == [True, False, False, False, True]
+    assert simplify.visvalingam(x[:2], y[:2], 10.0).tolist() == [True, True]
+
+
+def test_simplify_windows_keep_the_boundaries():
+
+    points = [(i * 0.0001, 0.0, i) for i in range(25)]
+
+    assert list(simplify.simplify_windows(points, 1.0, window=10)) == [0, 9, 18, 24]
+
+    # The tracks are simplified separately
+    kept = list(simplify.simplify_windows(points, 1.0, window=100, key=lambda i: i // 10))
+    assert kept == [0, 9, 10, 19, 20, 24]
+
+    with pytest.raises(ValueError):
+        simplify.simplify(np.zeros(3), np.zeros(3), 1.0, method="unknown")
+
+
+@pytest.mark.parametrize("method", [simplify.DOUGLAS_PEUCKER, simplify.VISVALINGAM])
+def test_compact_session(connection_handler, method):
+
+    database.insert_location_data(connection_handler, zigzag_records(), session_table_name="session")
+
+    deleted = simplify.compact_session(connection_handler, 1, 5.0, method=method)
+
+    kept = [row[0] for row in connection_handler.execute("SELECT id FROM location ORDER BY id;")]
+    assert deleted == 50 - len(kept)
+    assert kept[0] == 1 and kept[-1] == 50
+    assert all(i in kept for i in (6, 16, 26, 36, 46))
+    assert database.get_session_summary(connection_handler, 1)["point_count"] == len(kept)
+
+
+def test_compact_session_refuses_blocks(connection_handler):
+
+    assert database.insert_location_blocks(connection_handler, zigzag_records()) == 50
+
+    assert simplify.compact_session(connection_handler, 1, 5.0) == -1
+    assert sum(len(arrays["time"]) for _, _, arrays in database.iter_block_arrays(connection_handler, session_id=1)) == 50
@@ -0,0 +1,71 @@
+from core import database
+
+import pytest
+
+
+@pytest.fixture
+def connection_handler(tmp_path):
+
+    connection_handler = database.connect(str(tmp_path / "spatial.db"))
+    database.create_tables(connection_handler)
+    database.migrate(connection_handler)
+    database.create_new_session(connection_handler)
+    yield connection_handler
+    database.disconnect(connection_handler)
+
+
+def insert(connection_handler, longitudes, latitude=0.0):
+
+    records = [(1, latitude, longitude, None, None, None, None, 3, f"2020-01-01T00:00:{i:02d}.000Z", None) \
+               for i, longitude in enumerate(longitudes)]
+    assert database.insert_location_data(connection_handler, records) == len(records)
+
+
+def longitudes_within(connection_handler, latitude, longitude, radius):
+
+    return sorted(row[0] for row in database.iter_locations_within_radius(connection_handler, latitude, longitude, radius, \
+        columns=("longitude",)))
+
+
+def test_radius_to_bbox_wraps_around_the_antimeridian():
+
+    bbox = database.radius_to_bbox(0.0, 179.99, 5000)
+
+    assert bbox[1] > 179.9 and bbox[3] < -179.9
+    assert database.split_bbox(bbox) == [(bbox[0], bbox[1], bbox[2], 180.0), (bbox[0], -180.0, bbox[2], bbox[3])]
+    assert database.radius_to_bbox(89.99, 0.0, 5000)[1::2] == (-180.0, 180.0)
+
+
+def test_radius_across_the_antimeridian(connection_handler):
+
+    insert(connection_handler, [179.98, 179.999, -179.999, -179.98, -179.5, 179.5])
+
+    assert longitudes_within(connection_handler, 0.0, 179.999, 5000) == [-179.999, -179.98, 179.98, 179.999]
+    assert longitudes_within(connection_handler, 0.0, -179.999, 5000) == [-179.999, -179.98, 179.98, 179.999]
+
+
+def test_bbox_across_the_antimeridian(connection_handler):
+
+    insert(connection_handler, [179.5, -179.5, 0.0])
+
+    assert database.list_sessions_in_bbox(connection_handler, (-1.0, 179.0, 1.0, -179.0)) == [1]
+    assert database.list_sessions_in_bbox(connection_handler, (-1.0, 170.0, 1.0, 175.0)) == []
+
+
+def test_inserts_do_not_update_the_index(connection_handler):
+
+    triggers = [row[0] for row in connection_handler.execute("SELECT name FROM sqlite_master WHERE type = 'trigger';")]
+    assert "location_rtree_insert" not in triggers
+
+    insert(connection_handler, [10.0, 10.001, 20.0])
+    assert connection_handler.execute("SELECT COUNT(*) FROM location_rtree;").fetchone()[0] == 0
+
+    # The locations stored after the watermark are found without the index
+    assert longitudes_within(connection_handler, 0.0, 10.0, 1000) == [10.0, 10.001]
+
+    assert database.update_spatial_index(connection_handler, chunk_size=2) == 3
+    assert connection_handler.execute("SELECT COUNT(*) FROM location_rtree;").fetchone()[0] == 3
+    assert database.update_spatial_index(connection_handler) == 0
+
+    insert(connection_handler, [10.002])
+    assert longitudes_within(connection_handler, 0.0, 10.0, 1000) == [10.0, 10.001, 10.002]
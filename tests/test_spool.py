@@ -0,0 +1,178 @@
+from core import location, spool, recorder, database, ring_buffer, monitor
+
+import os
+
+
+def make_batch(count, start=0):
+
+    return location.LocationBatch([location.Location(45.5 + i * 0.001, -73.6, 30.0, 90.0, 0.0, 15.0, 3, \
+        f"2020-01-01T00:00:{i % 60:02d}.000Z") for i in range(start, start + count)])
+
+
+def open_spool(directory, **kwargs):
+
+    lspool = spool.Spool(str(directory), **kwargs)
+    assert lspool.open() == 0
+    return lspool
+
+
+def test_record_size():
+
+    assert spool.RECORD_SIZE == 77
+
+
+def test_release_moves_checkpoint_over_contiguous_prefix(tmp_path):
+
+    lspool = open_spool(tmp_path)
+    first = make_batch(10)
+    second = make_batch(10, start=10)
+    lspool.append(first)
+    lspool.append(second)
+
+    # The second batch is committed first: the checkpoint must not skip the first one
+    lspool.release(second.seq)
+    assert lspool.committed_seq == 0
+    assert lspool.read_checkpoint() == 0
+
+    lspool.release(first.seq)
+    assert lspool.committed_seq == 20
+    lspool.close()
+
+
+def test_release_ignores_unspooled_locations(tmp_path):
+
+    lspool = open_spool(tmp_path)
+    lspool.release(make_batch(3).seq)
+    assert lspool.committed_seq == 0
+    lspool.close()
+
+
+def test_replay_after_restart(tmp_path):
+
+    lspool = open_spool(tmp_path)
+    batch = make_batch(5)
+    lspool.append(batch)
+    lspool.release(batch.seq[:2])
+    lspool.close()
+
+    lspool = open_spool(tmp_path)
+    replayed = [seq for b in lspool.replay() for seq in b.seq]
+    assert replayed == [3, 4, 5]
+    assert lspool.next_seq == 6
+
+    # The replayed locations hold the checkpoint until they are released
+    new = make_batch(2)
+    lspool.append(new)
+    lspool.release(new.seq)
+    assert lspool.committed_seq == 2
+
+    lspool.release(replayed)
+    assert lspool.committed_seq == 7
+    lspool.close()
+
+
+def test_corrupted_record_stops_segment(tmp_path):
+
+    lspool = open_spool(tmp_path)
+    lspool.append(make_batch(5))
+    lspool.close()
+
+    # Flip a byte of the third record and truncate the last one (torn write)
+    path = lspool.segments()[0]
+    with open(path, "r+b") as segment:
+        segment.seek(2 * spool.RECORD_SIZE + 10)
+        value = segment.read(1)
+        segment.seek(2 * spool.RECORD_SIZE + 10)
+        segment.write(bytes([value[0] ^ 0xff]))
+        segment.truncate(5 * spool.RECORD_SIZE - 3)
+
+    assert [fields[0] for fields in lspool.read_segment(path)] == [1, 2]
+
+    lspool = open_spool(tmp_path)
+    assert [seq for b in lspool.replay() for seq in b.seq] == [1, 2]
+    lspool.close()
+
+
+def test_corrupted_checkpoint_is_ignored(tmp_path):
+
+    lspool = open_spool(tmp_path)
+    batch = make_batch(3)
+    lspool.append(batch)
+    lspool.release(batch.seq)
+    lspool.close()
+
+    with open(os.path.join(str(tmp_path), spool.CHECKPOINT_FILENAME), "r+b") as checkpoint:
+        checkpoint.write(b"\xff")
+
+    assert open_spool(tmp_path).committed_seq == 0
+
+
+def test_sync_after_interval(tmp_path):
+
+    lspool = open_spool(tmp_path, fsync_interval=0)
+    lspool.append(make_batch(1))
+    assert not lspool.unsynced
+
+    lspool.fsync_interval = 3600
+    lspool.append(make_batch(1))
+    assert lspool.unsynced
+
+    lspool.fsync_interval = 0
+    assert lspool.sync() == 0
+    assert not lspool.unsynced
+    lspool.close()
+
+
+def test_failed_insert_is_retried_and_not_released(tmp_path, monkeypatch, appconfig):
+
+    lspool = open_spool(tmp_path / "spool")
+    worker = recorder.Recorder(ring_buffer.RingBuffer(), appconfig, spool=lspool)
+    assert worker.init_connection() == 0
+    worker.session_id = 1
+
+    failed = make_batch(3)
+    committed = make_batch(3, start=3)
+    lspool.append(failed)
+    lspool.append(committed)
+
+    monkeypatch.setattr(database, "insert_location_data", lambda *args, **kwargs: -1)
+    worker.write_batch(failed)
+    monkeypatch.undo()
+
+    worker.write_batch(committed)
+    assert len(worker.failed) == 3
+    assert lspool.committed_seq == 0
+
+    batch = worker.failed
+    worker.failed = location.LocationBatch()
+    worker.write_batch(batch)
+    assert len(worker.failed) == 0
+    assert lspool.committed_seq == 6
+
+    database.disconnect(worker.connection_handler)
+    lspool.close()
+
+
+def test_dropped_batches_are_released(tmp_path, appconfig):
+
+    for policy in (ring_buffer.DROP_OLDEST, ring_buffer.DROP_NEWEST):
+
+        lspool = open_spool(tmp_path / policy)
+        q = ring_buffer.RingBuffer(capacity=6, overflow_policy=policy)
+        source = monitor.Monitor(q, appconfig, spool=lspool)
+        source.filter = None
+
+        for i in range(0, 30, 3):
+            assert source.report_batch(make_batch(3, start=i)) == 0
+
+        # The recorder commits the buffered locations, the dropped ones must not hold the checkpoint
+        while not q.empty():
+            for batch in q.get_many(6):
+                lspool.release(batch.seq)
+
+        assert q.stats()["dropped"] == 24
+        assert lspool.committed_seq == 30
+        assert lspool.pending == []
+        lspool.close()
+
+        assert list(open_spool(tmp_path / policy).replay()) == []